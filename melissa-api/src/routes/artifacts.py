@@ -1,25 +1,163 @@
-from fastapi import APIRouter, HTTPException, Header, Response
-from src.storage.fsrepo import load_artifact_rel
+import json
+from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Header, Query, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from src.storage.aio import artifact_entry, patch_entry, read_chunks
+from src.services.binbundle import MEDIA_TYPE as MLB_MEDIA_TYPE
+from src.services.delta import MEDIA_TYPE as DELTA_MEDIA_TYPE
 from src.storage.safe import validate_uuid, validate_semver
 
-validate_uuid(strategy_id, "strategy_id")
-validate_semver(semver)
-
 router = APIRouter()
 
+PREFERRED_ENCODINGS = ("zstd", "gzip")
+BATCH_MAX_ITEMS = 500
+BATCH_MEDIA_TYPE = "application/x-melissa-frames"
+BATCH_CHUNK = 64 * 1024
+MEDIA_TYPES = {"json": "application/json; charset=utf-8", "mlb": MLB_MEDIA_TYPE}
+
+def _etag_matches(if_none_match: str, etags: list[str]) -> bool:
+    # If-None-Match: список через запятую или "*"; сравнение слабое (W/ не учитывается)
+    if if_none_match.strip() == "*":
+        return True
+    tags = {e.removeprefix("W/") for e in etags}
+    return any(t.strip().removeprefix("W/") in tags for t in if_none_match.split(","))
+
+def _pick_encoding(accept_encoding: str | None, available: list[str]) -> str:
+    if not accept_encoding:
+        return "identity"
+    q = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.strip().split(";")
+        weight = 1.0
+        for p in params:
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    weight = float(v)
+                except ValueError:
+                    weight = 0.0
+        q[name.strip().lower()] = weight
+    for enc in PREFERRED_ENCODINGS:
+        if enc in available and q.get(enc, q.get("*", 0.0)) > 0:
+            return enc
+    return "identity"
+
 @router.get("/{sid}/{semver}")
-def get_artifact(sid: str, semver: str, if_none_match: str | None = Header(default=None, convert_underscores=False)):
-    
-    rel = f"{sid}/{semver}.bundle.json"
-    obj = load_artifact_rel(rel)
-    if not obj:
+async def get_artifact(sid: str, semver: str, if_none_match: str | None = Header(default=None),
+                 accept_encoding: str | None = Header(default=None), accept: str | None = Header(default=None),
+                 base: str | None = Query(default=None)):
+    """
+    ?base=<semver> — у клиента уже есть файл этой версии (в том же представлении): вместо полного
+    файла может прийти патч base -> semver (Content-Type application/vnd.melissa.delta,
+    X-Delta-Base, ETag — целевого файла). Патч невыгоден или базы нет — обычный полный ответ.
+    Горячий артефакт (мета и тело в LRU) отдаётся без единого обращения к диску и потокам.
+    """
+    validate_uuid(sid, "strategy_id")
+    validate_semver(semver)
+    # бинарный контейнер — только тем, кто его явно попросил; остальным прежний JSON
+    fmt = "mlb" if accept and MLB_MEDIA_TYPE in accept else "json"
+    art = await artifact_entry(sid, semver, fmt=fmt)
+    if not art:
         raise HTTPException(404, "artifact not found")
-    raw, etag = obj
+    enc = _pick_encoding(accept_encoding, art["encodings"])
+    if enc != "identity":
+        art = await artifact_entry(sid, semver, enc, fmt=fmt)
+    headers = {"ETag": art["etag"], "Vary": "Accept, Accept-Encoding"}
+
+    # Если клиент прислал If-None-Match и совпало — 304 (ETag из sidecar/кеша, тело не читаем).
+    # Совпадение с ETag любого варианта: содержимое после распаковки одно и то же.
+    if if_none_match and _etag_matches(if_none_match, art["etags"]):
+        return Response(status_code=304, headers=headers)
+
+    if base and base != semver:
+        patch = await patch_entry(sid, base, semver, fmt=fmt)
+        if patch:
+            penc = _pick_encoding(accept_encoding, patch["encodings"])
+            patch = await patch_entry(sid, base, semver, penc, with_body=True, fmt=fmt)
+            headers.update({"ETag": patch["target_etag"], "X-Delta-Base": base})
+            if penc != "identity":
+                headers["Content-Encoding"] = penc
+            if patch["body"] is not None:
+                return Response(content=patch["body"], media_type=DELTA_MEDIA_TYPE, headers=headers)
+            return FileResponse(patch["path"], media_type=DELTA_MEDIA_TYPE, headers=headers)
+
+    # Иначе отдать 200 + тело + ETag: горячие — из памяти, остальные — файлом с диска
+    if enc != "identity":
+        headers["Content-Encoding"] = enc
+    art = await artifact_entry(sid, semver, enc, with_body=True, fmt=fmt)
+    if art["body"] is not None:
+        return Response(content=art["body"], media_type=MEDIA_TYPES[fmt], headers=headers)
+    return FileResponse(art["path"], media_type=MEDIA_TYPES[fmt], headers=headers)
+
+def _frame(header: Dict[str, Any]) -> bytes:
+    return json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n"
 
-    # Если клиент прислал If-None-Match и совпало — 304
-    if if_none_match and if_none_match == etag:
-        return Response(status_code=304)
+async def _batch_frames(entries: list):
+    # кадр: строка-заголовок JSON, затем ровно header["size"] байт тела; в конце — {"end": true}
+    sent = 0
+    for header, enc in entries:
+        yield _frame(header)
+        if enc is None:
+            continue
+        # тело берём по ходу потока: в памяти не больше одного бандла сверх LRU
+        if header.get("delta_base"):
+            art = await patch_entry(header["strategy_id"], header["delta_base"], header["semver"], enc,
+                                    with_body=True, fmt=header["format"])
+        else:
+            art = await artifact_entry(header["strategy_id"], header["semver"], enc, with_body=True,
+                                       fmt=header["format"])
+        if art["body"] is not None:
+            yield art["body"]
+        else:
+            async for chunk in read_chunks(art["path"], BATCH_CHUNK):
+                yield chunk
+        sent += 1
+    yield _frame({"end": True, "count": sent})
 
-    # Иначе отдать 200 + тело + ETag
-    headers = {"ETag": etag, "Content-Type": "application/json; charset=utf-8"}
-    return Response(content=raw, media_type="application/json", headers=headers)
+@router.post("/batch")
+async def get_artifacts_batch(payload: Dict[str, Any]):
+    """
+    Тело: {"items": [{"strategy_id", "semver", "etag"?, "base"?}, ...], "encodings": ["zstd", "gzip"]?,
+           "format": "json"|"mlb"?}
+    Один потоковый ответ вместо N GET: в нём только изменившиеся бандлы (etag не совпал)
+    и кадры status=404 для отсутствующих. Тело кадра — вариант в кодировке из header["encoding"];
+    если в заголовке есть "delta_base" — это патч от версии base (как GET ?base=).
+    """
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(422, "items required")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(413, f"too many items (max {BATCH_MAX_ITEMS})")
+    accepted = payload.get("encodings") or []
+    if not isinstance(accepted, list) or not all(isinstance(e, str) for e in accepted):
+        raise HTTPException(422, "encodings must be a list of strings")
+    fmt = payload.get("format") or "json"
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(422, "Invalid format")
+    for it in items:
+        if not isinstance(it, dict) or not all(isinstance(it.get(k), str) for k in ("strategy_id", "semver")) \
+                or not all(isinstance(it.get(k), (str, type(None))) for k in ("etag", "base")):
+            raise HTTPException(422, "each item needs string strategy_id and semver (etag, base — strings)")
+    entries = []
+    # всё, что может дать 4xx, проверяем до начала потока; дальше — только чтение готовых файлов
+    for it in items:
+        sid, semver = it.get("strategy_id"), it.get("semver")
+        validate_uuid(sid, "strategy_id")
+        validate_semver(semver)
+        header = {"strategy_id": sid, "semver": semver}
+        art = await artifact_entry(sid, semver, fmt=fmt)
+        if not art:
+            entries.append((dict(header, status=404, size=0), None))
+            continue
+        if it.get("etag") and _etag_matches(it["etag"], art["etags"]):
+            continue
+        header.update(status=200, etag=art["etag"], format=fmt)
+        base = it.get("base")
+        patch = await patch_entry(sid, base, semver, fmt=fmt) if base and base != semver else None
+        if patch:
+            art, header["delta_base"] = patch, base
+        enc = next((e for e in PREFERRED_ENCODINGS if e in accepted and e in art["encodings"]), "identity")
+        size = (await patch_entry(sid, base, semver, enc, fmt=fmt) if patch
+                else await artifact_entry(sid, semver, enc, fmt=fmt))["size"]
+        entries.append((dict(header, encoding=enc, size=size), enc))
+    return StreamingResponse(_batch_frames(entries), media_type=BATCH_MEDIA_TYPE)
@@ -1,14 +1,32 @@
 import os
-from fastapi import APIRouter, HTTPException, Header, Body
+import re
+import math
+import json
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from fastapi import APIRouter, HTTPException, Header, Body, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import Dict, Any, Optional
-from src.storage.devrepo import (
-    register_device, activate_device_by_code, poll_device, device_by_token, grant_strategy, list_grants
+from src.storage.repo import (
+    activate_device_by_code, device_by_token, grant_strategy, list_grants,
+    revoke_device, device_changes, listing_rev, grant_many, revoke_grants, set_device_tags, devices_by_tag
 )
-from src.storage.fsrepo import get_strategy
+from src.storage.repo import get_strategy
+from src.storage.versions import strategy_index
+from src.storage import aio
+from src.routes.artifacts import _etag_matches
 from src.storage.safe import validate_uuid, validate_semver
+from src.services.notify import hub, activation_topic, device_topic, notify_activated, notify_device
 ADMIN_TOKEN = os.getenv("API_ADMIN_TOKEN")
-
-validate_uuid(device_id, "device_id")
+POLL_MAX_WAIT = 30      # long-poll /poll: не дольше, чем держат прокси по умолчанию
+SSE_KEEPALIVE = 15      # комментарий-пинг в /events, чтобы соединение не резали по простою
+POLL_RECHECK = 2        # long-poll перечитывает диск и без события: активацию мог принять другой воркер
+LISTING_CACHE_ITEMS = 10000
+BULK_MAX_DEVICES = 10000
+TAG_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
 
 router = APIRouter()
 
@@ -16,8 +34,8 @@ def _demo_user() -> str:
     return "u_demo"
 
 @router.post("/register")
-def register():
-    return register_device(verification_uri="http://localhost:8000/link")
+async def register():
+    return await aio.register_device(verification_uri="http://localhost:8000/link")
 
 @router.post("/activate")
 def activate(payload: Dict[str, Any]):
@@ -25,37 +43,115 @@ def activate(payload: Dict[str, Any]):
     Тело: { "user_code": "ABCD-1234" }
     Подразумеваем, что вызывается от имени пользователя (MVP без auth: демо-пользователь).
     """
-    sid = payload.get("strategy_id")
-    if not sid: ...
-    validate_uuid(sid, "strategy_id")
-    pinned = payload.get("pinned_semver")
-    if pinned is not None:
-        validate_semver(pinned)
-
     code = payload.get("user_code")
     if not code:
         raise HTTPException(422, "user_code required")
     dev_id = activate_device_by_code(code, _demo_user())
     if not dev_id:
         raise HTTPException(400, "invalid_or_expired_code")
+    notify_activated(dev_id)
     return {"device_id": dev_id, "status": "linked"}
 
+def _poll_wait(raw: Any) -> float:
+    if raw is None:
+        return 0.0
+    try:
+        wait = float(raw) if not isinstance(raw, bool) else math.nan
+    except (TypeError, ValueError):
+        wait = math.nan
+    if not math.isfinite(wait) or wait < 0:
+        raise HTTPException(422, "wait must be a non-negative number of seconds")
+    return min(wait, POLL_MAX_WAIT)
+
 @router.post("/poll")
-def poll(payload: Dict[str, Any]):
+async def poll(payload: Dict[str, Any]):
     """
-    Тело: { "device_id": "uuid" }
+    Тело: { "device_id": "uuid", "wait": 30 }
     Возвращает {pending:true} пока не активировано
     После активации -> {device_token:"..."} (сохраняй на движке)
+    wait > 0 — long-poll: ответ придёт сразу после активации или через wait секунд (не больше 30).
     """
     dev_id = payload.get("device_id")
     if not dev_id:
         raise HTTPException(422, "device_id required")
-    return poll_device(dev_id)
+    validate_uuid(dev_id, "device_id")
+    wait = _poll_wait(payload.get("wait"))
+    topic = activation_topic(dev_id)
+    seq = hub.seq(topic)  # до чтения с диска: активация между чтением и ожиданием не потеряется
+    res = await aio.poll_device(dev_id)
+    deadline = time.monotonic() + wait
+    while res.get("pending") and (left := deadline - time.monotonic()) > 0:
+        await hub.wait(topic, seq, min(left, POLL_RECHECK))
+        seq = hub.seq(topic)
+        res = await aio.poll_device(dev_id)
+    return res
 
-@router.post("/{device_id}/grants")
-def set_grant(device_id: str, payload: Dict[str, Any], x_admin_token: str = Header(default="")):
+def _require_admin(x_admin_token: str) -> None:
     if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="admin token required")
+
+@router.post("/grants")
+def bulk_grants(payload: Dict[str, Any], x_admin_token: str = Header(default="")):
+    """
+    Тело: { "strategy_id": "uuid", "action": "grant"|"revoke", "allow_latest": bool, "pinned_semver"?,
+            "device_ids": [...] и/или "tag": "fleet-a" }
+    Выдаёт (или снимает) грант стратегии сразу многим устройствам одной операцией хранилища;
+    устройствам — событие "grants_changed". Ответ: {"ok", "action", "devices": [затронутые],
+    "skipped": [остальные]} — при grant это неизвестные устройства, при revoke — те, у кого гранта не было.
+    """
+    _require_admin(x_admin_token)
+    sid = payload.get("strategy_id")
+    validate_uuid(sid, "strategy_id")
+    action = payload.get("action") or "grant"
+    if action not in ("grant", "revoke"):
+        raise HTTPException(422, "action must be grant or revoke")
+    ids = payload.get("device_ids") or []
+    tag = payload.get("tag")
+    if not isinstance(ids, list) or not all(isinstance(d, str) for d in ids) \
+            or (tag is not None and not TAG_RE.match(str(tag))):
+        raise HTTPException(422, "device_ids must be a list, tag — [A-Za-z0-9_.:-]{1,64}")
+    targets = list(dict.fromkeys([*ids, *(devices_by_tag(tag) if tag else [])]))
+    if not targets:
+        raise HTTPException(422, "device_ids or tag required")
+    if len(targets) > BULK_MAX_DEVICES:
+        raise HTTPException(413, f"too many devices (max {BULK_MAX_DEVICES})")
+    for d in targets:
+        validate_uuid(d, "device_id")
+
+    if action == "grant":
+        allow_latest = payload.get("allow_latest")
+        pinned = payload.get("pinned_semver")
+        if allow_latest is None:
+            raise HTTPException(422, "allow_latest required")
+        if pinned is not None:
+            validate_semver(pinned)
+        if not get_strategy(sid):
+            raise HTTPException(404, "strategy not found")
+        changed = grant_many(targets, sid, bool(allow_latest), pinned)
+    else:
+        changed = revoke_grants(targets, sid)
+    for d in changed:
+        notify_device(d, {"type": "grants_changed", "strategy_id": sid})
+    hit = set(changed)
+    skipped = [d for d in targets if d not in hit]
+    return {"ok": True, "strategy_id": sid, "action": action, "devices": changed, "skipped": skipped}
+
+@router.put("/{device_id}/tags")
+def set_tags(device_id: str, payload: Dict[str, Any], x_admin_token: str = Header(default="")):
+    """Тело: { "tags": ["fleet-a", ...] } — метки заменяются целиком; по ним выбирает POST /grants."""
+    _require_admin(x_admin_token)
+    validate_uuid(device_id, "device_id")
+    tags = payload.get("tags")
+    if not isinstance(tags, list) or not all(isinstance(t, str) and TAG_RE.match(t) for t in tags):
+        raise HTTPException(422, "tags must be a list of [A-Za-z0-9_.:-]{1,64}")
+    res = set_device_tags(device_id, list(dict.fromkeys(tags)))
+    if res is None:
+        raise HTTPException(404, "device not found")
+    return {"ok": True, "device_id": device_id, "tags": res}
+
+@router.post("/{device_id}/grants")
+def set_grant(device_id: str, payload: Dict[str, Any], x_admin_token: str = Header(default="")):
+    _require_admin(x_admin_token)
     validate_uuid(device_id, "device_id")
     
     sid = payload.get("strategy_id")
@@ -69,56 +165,175 @@ def set_grant(device_id: str, payload: Dict[str, Any], x_admin_token: str = Head
         raise HTTPException(404, "strategy not found")
     # записываем грант
     grants = grant_strategy(device_id, sid, bool(allow_latest), pinned)
+    notify_device(device_id, {"type": "grants_changed", "strategy_id": sid})
     return {"ok": True, "grants": grants}
 
-@router.get("/{device_id}/strategies")
-def list_for_device(device_id: str, authorization: Optional[str] = Header(default=None)):
-    """
-    Заголовок: Authorization: Device <token>
-    Отдаёт список стратегий, доступных устройству, с указанием latest/pinned и артефакта.
-    Для MVP: latest = последняя опубликованная версия в списке.
-    """
-    # валидация токена
+@router.post("/{device_id}/revoke")
+def revoke(device_id: str, x_admin_token: str = Header(default="")):
+    _require_admin(x_admin_token)
+    validate_uuid(device_id, "device_id")
+    if not revoke_device(device_id):
+        raise HTTPException(404, "device not found")
+    notify_device(device_id, {"type": "revoked"})
+    return {"ok": True, "device_id": device_id, "status": "revoked"}
+
+def _device_token(authorization: Optional[str]) -> str:
     if not authorization or not authorization.startswith("Device "):
         raise HTTPException(401, "missing device token")
-    token = authorization.split(" ", 1)[1].strip()
-    dev = device_by_token(token)
+    return authorization.split(" ", 1)[1].strip()
+
+def _auth_device(device_id: str, authorization: Optional[str]) -> Dict[str, Any]:
+    dev = device_by_token(_device_token(authorization))
     if not dev or dev.get("device_id") != device_id:
         raise HTTPException(401, "invalid device token")
+    return dev
+
+@router.get("/{device_id}/events")
+async def device_events(device_id: str, request: Request,
+                        authorization: Optional[str] = Header(default=None),
+                        last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-Sent Events: "grants_changed" / "artifact_published" / "revoked" для устройства.
+    Заголовок: Authorization: Device <token>; Last-Event-ID — продолжить после переподключения.
+    Событие — только подсказка «пора в sync»: само содержимое по-прежнему берётся из /strategies.
+    """
+    validate_uuid(device_id, "device_id")
+    await aio.run_io(_auth_device, device_id, authorization)
+    topic = device_topic(device_id)
+    try:
+        since = int(last_event_id) if last_event_id else hub.seq(topic)
+    except ValueError:
+        since = hub.seq(topic)
+
+    async def stream():
+        last = since
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            events = await hub.wait(topic, last, SSE_KEEPALIVE)
+            if not events:
+                yield ": ping\n\n"
+                continue
+            for seq, ev in events:
+                last = seq
+                yield f"id: {seq}\nevent: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _device_item(g: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Элемент списка стратегий устройства для гранта g (None — стратегии нет или нет версий)."""
+    sid = g["strategy_id"]
+    s = get_strategy(sid)
+    if not s:
+        return None
+    # latest = последняя опубликованная версия — указатель индекса версий, без сортировки списка
+    versions = s.get("versions", [])
+    vi = strategy_index(s)
+    latest = vi["latest"]
+    if not latest:
+        return None
+    chosen = g["pinned_semver"] or (latest if g["allow_latest"] else None)
+    art = None
+    if chosen:
+        # артефакт доступен по GET /v1/artifacts/{sid}/{chosen}
+        # ETag при скачивании: W/"<sha256>"
+        # sha256 берём из карточки версии
+        vmeta = next((v for v in versions if v["semver"] == chosen), None)
+        if vmeta:
+            art = {
+                "semver": chosen,
+                "url": f"/v1/artifacts/{sid}/{chosen}",
+                "sha256": vmeta["sha256"],
+                "etag": vmeta["etag"]
+            }
+    return {
+        "strategy_id": sid,
+        "name": s["name"],
+        "latest": latest,
+        "latest_stable": vi["latest_stable"],
+        "pinned": g["pinned_semver"],
+        "allow_latest": g["allow_latest"],
+        "artifact": art
+    }
+
+# Готовые ответы /strategies по устройствам: тело, ETag и rev, на котором список собран (listing_rev).
+# Правка грантов, отзыв и публикация любой из его стратегий двигают rev — запись больше не отдаётся.
+# Те же правки шлют событие в хаб (device_topic): пока seq топика не сдвинулся и rev проверяли не дольше
+# POLL_RECHECK назад, запись отдаётся без хранилища; правку на другом воркере видно не позже POLL_RECHECK.
+_listings: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_listings_lock = threading.Lock()
+
+def _build_listing(device_id: str, authorization: Optional[str]) -> Dict[str, Any]:
+    # валидация токена
+    _auth_device(device_id, authorization)
+    seq = hub.seq(device_topic(device_id))
+    # rev — до чтения: правка во время сборки даст новый rev, и запись пересоберётся на следующем запросе
+    rev = listing_rev(device_id)
 
     # соберём список грантов
     grants = list_grants(device_id)
-    out = []
-    for g in grants:
-        sid = g["strategy_id"]
-        s = get_strategy(sid)
-        if not s:
-            continue
-        # latest = последняя версия по created_at
-        versions = s.get("versions", [])
-        if not versions:
-            continue
-        latest = sorted(versions, key=lambda v: v["created_at"])[-1]["semver"]
-        chosen = g["pinned_semver"] or (latest if g["allow_latest"] else None)
-        art = None
-        if chosen:
-            # артефакт доступен по GET /v1/artifacts/{sid}/{chosen}
-            # ETag при скачивании: W/"<sha256>"
-            # sha256 берём из карточки версии
-            vmeta = next((v for v in versions if v["semver"] == chosen), None)
-            if vmeta:
-                art = {
-                    "semver": chosen,
-                    "url": f"/v1/artifacts/{sid}/{chosen}",
-                    "sha256": vmeta["sha256"],
-                    "etag": vmeta["etag"]
-                }
-        out.append({
-            "strategy_id": sid,
-            "name": s["name"],
-            "latest": latest,
-            "pinned": g["pinned_semver"],
-            "allow_latest": g["allow_latest"],
-            "artifact": art
-        })
-    return out
+    items = [it for it in (_device_item(g) for g in grants) if it]
+    body = json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {"token": _device_token(authorization), "rev": rev, "sids": [g["strategy_id"] for g in grants],
+            "seq": seq, "checked": time.monotonic(), "etag": f'W/"{hashlib.sha256(body).hexdigest()[:32]}"', "body": body}
+
+def _cached_listing(device_id: str, token: str) -> Optional[Dict[str, Any]]:
+    with _listings_lock:
+        e = _listings.get(device_id)
+        if e is None or not secrets.compare_digest(e["token"], token):
+            return None
+        _listings.move_to_end(device_id)
+        return e
+
+def _store_listing(device_id: str, e: Dict[str, Any]) -> None:
+    with _listings_lock:
+        _listings[device_id] = e
+        _listings.move_to_end(device_id)
+        while len(_listings) > LISTING_CACHE_ITEMS:
+            _listings.popitem(last=False)
+
+@router.get("/{device_id}/strategies")
+async def list_for_device(device_id: str, authorization: Optional[str] = Header(default=None),
+                          if_none_match: Optional[str] = Header(default=None)):
+    """
+    Заголовок: Authorization: Device <token>
+    Отдаёт список стратегий, доступных устройству, с указанием latest/pinned и артефакта.
+    Для MVP: latest = последняя опубликованная версия в списке.
+    Ответ кешируется по устройству; If-None-Match с ETag прошлого ответа — 304. Пока список не менялся,
+    запрос отдаётся из памяти; раз в POLL_RECHECK — одна проверка rev (снимок счётчика), без чтения
+    устройства, грантов и карточек.
+    """
+    validate_uuid(device_id, "device_id")
+    e = _cached_listing(device_id, _device_token(authorization))
+    seq = hub.seq(device_topic(device_id))
+    if e is not None and (e["seq"] != seq or time.monotonic() - e["checked"] >= POLL_RECHECK):
+        # событие хаба или истёк срок — сверяем rev; seq взят до чтения, событие после него не потеряется
+        if await aio.run_io(listing_rev, device_id, e["sids"]) == e["rev"]:
+            e = dict(e, seq=seq, checked=time.monotonic())
+            _store_listing(device_id, e)
+        else:
+            e = None
+    if e is None:
+        e = await aio.run_io(_build_listing, device_id, authorization)
+        _store_listing(device_id, e)
+    headers = {"ETag": e["etag"]}
+    if if_none_match and _etag_matches(if_none_match, [e["etag"]]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=e["body"], media_type="application/json", headers=headers)
+
+def _changes_for_device(device_id: str, cursor: int, authorization: Optional[str]) -> Dict[str, Any]:
+    _auth_device(device_id, authorization)
+    ch = device_changes(device_id, cursor)
+    items = (_device_item(g) for g in ch["grants"])
+    return {"cursor": ch["cursor"], "full": ch["full"], "items": [it for it in items if it]}
+
+@router.get("/{device_id}/changes")
+async def changes_for_device(device_id: str, cursor: int = 0, authorization: Optional[str] = Header(default=None)):
+    """
+    Дельта-синк. Заголовок: Authorization: Device <token>; ?cursor=<из прошлого ответа> (0 — с нуля).
+    Ответ: {"cursor": N, "full": bool, "items": [...]} — items в формате /strategies, только изменившиеся
+    после cursor (новый грант/правка гранта, новая версия стратегии). full=true — items содержит весь
+    список, локальный нужно заменить. Без изменений — пустой items, стратегии не читаются.
+    """
+    validate_uuid(device_id, "device_id")
+    return await aio.run_io(_changes_for_device, device_id, cursor, authorization)
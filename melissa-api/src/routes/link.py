@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Form
 from fastapi.responses import HTMLResponse
-from src.storage.devrepo import activate_device_by_code
+from src.storage.repo import activate_device_by_code
+from src.services.notify import notify_activated
 
 router = APIRouter()
 
@@ -38,6 +39,7 @@ def link_form():
 def link_submit(user_code: str = Form(...)):
     device_id = activate_device_by_code(user_code, user_id="u_demo")
     if device_id:
+        notify_activated(device_id)
         msg = f'<div class="msg">✅ Устройство привязано: <code>{device_id}</code>. Можно вернуться в консоль движка.</div>'
     else:
         msg = '<div class="msg">❌ Код не найден или срок истёк. Проверьте и попробуйте снова.</div>'
@@ -1,22 +1,39 @@
-from fastapi import APIRouter, HTTPException
+import threading
+from fastapi import APIRouter, HTTPException, Query, Response
 from typing import Any, Dict
-from src.storage.fsrepo import (
-    create_strategy, list_strategies, get_strategy, update_draft, save_artifact
+from src.storage.repo import (
+    create_strategy, list_strategies, list_strategies_page, get_strategy, update_draft, save_artifact,
+    blob_signature, prepare_patches
 )
+from src.storage.versions import semver_key
+from src.storage.repo import devices_for_strategy
+from src.storage.safe import validate_uuid, validate_semver
 from src.services.validator import validate_all
-from src.services.signer import sign_bytes
-import json
-import hashlib
+from src.services.signer import sign_canonical, canonical_bytes, key_id
+from src.services.notify import notify_device
 
 router = APIRouter()
 
+PUBLISH_MAX_ITEMS = 500
+STRATEGIES_PAGE_MAX = 200
+
 def _demo_user() -> str:
     # до реальной авторизации просто возвращаем демо-юзера
     return "u_demo"
 
 @router.get("/")
-def list_my_strategies():
-    return list_strategies(_demo_user())
+def list_my_strategies(response: Response, limit: int | None = Query(default=None, ge=1, le=STRATEGIES_PAGE_MAX),
+                       cursor: str | None = Query(default=None)):
+    """
+    Без параметров — весь список, как раньше. ?limit=N — страница в порядке создания;
+    курсор следующей — в заголовке X-Next-Cursor (нет заголовка — страница последняя), дальше ?cursor=...
+    """
+    if limit is None and cursor is None:
+        return list_strategies(_demo_user())
+    items, nxt = list_strategies_page(_demo_user(), limit or STRATEGIES_PAGE_MAX, cursor)
+    if nxt:
+        response.headers["X-Next-Cursor"] = nxt
+    return items
 
 @router.post("/")
 def create_new_strategy(payload: Dict[str, Any]):
@@ -46,7 +63,7 @@ def put_draft(sid: str, body: dict):
         raise HTTPException(404, "not found")
     if s["user_id"] != _demo_user():
         raise HTTPException(403, "forbidden")
-    return update_draft(sid, draft)
+    return update_draft(sid, body)
 
 @router.post("/{sid}/publish")
 def publish_version(sid: str, body: Dict[str, Any]):
@@ -58,6 +75,11 @@ def publish_version(sid: str, body: Dict[str, Any]):
     semver = body.get("semver")
     if not semver:
         raise HTTPException(422, "semver is required")
+    return _publish(sid, semver)
+
+def _publish(sid: str, semver: str) -> Dict[str, Any]:
+    validate_uuid(sid, "strategy_id")
+    validate_semver(semver)
 
     s = get_strategy(sid)
     if not s:
@@ -66,6 +88,8 @@ def publish_version(sid: str, body: Dict[str, Any]):
         raise HTTPException(403, "forbidden")
     if not s.get("draft"):
         raise HTTPException(400, "draft is empty")
+    if any(v["semver"] == semver for v in s.get("versions", [])):
+        raise HTTPException(status_code=409, detail="Version already exists; use a new semver")
 
     draft = s["draft"]
     # повторная валидация
@@ -83,18 +107,27 @@ def publish_version(sid: str, body: Dict[str, Any]):
     if "policy" in draft and draft["policy"] is not None:
         payload["policy"] = draft["policy"]
 
-    # первичный raw и sha
-    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
-    sha = hashlib.sha256(raw).hexdigest()
+    # hash и подпись — по одним и тем же каноническим байтам (без manifest.hash), как проверяет движок;
+    # уже опубликованный где-то payload не подписываем заново — подпись берётся из блоба
+    payload["manifest"] = dict(payload["manifest"], signature_alg="ed25519")
+    sha, sig_b64 = sign_canonical(canonical_bytes(payload), known=blob_signature)
     payload["manifest"]["hash"] = sha
-    payload["manifest"]["signature_alg"] = "ed25519"
 
-    # финальный raw и подпись
-    raw2 = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
-    sig_b64 = sign_bytes(raw2)
+    bundle = {"payload": payload, "signature_b64": sig_b64}
+    # sha256/ETag — по байтам файла, который отдаёт GET /v1/artifacts (общего блоба для одинаковых бандлов)
+    meta = save_artifact(sid, semver, bundle, key_id=key_id())
+    if meta["already_exists"]:
+        # параллельный publish той же версии успел первым
+        raise HTTPException(status_code=409, detail="Version already exists; use a new semver")
 
-    bundle = {"payload": payload, "signature": {"alg":"ed25519","sig_b64": sig_b64}}
-    meta = save_artifact(sid, semver, bundle)
+    # патч от старшей из прежних версий (её sync клиента и пришлёт как base) — заранее, в фоне
+    prev = [v["semver"] for v in s.get("versions", [])]
+    if prev:
+        base = max(prev, key=semver_key)
+        threading.Thread(target=_prepare_patches, args=(sid, base, semver), daemon=True).start()
+
+    for device_id in devices_for_strategy(sid):
+        notify_device(device_id, {"type": "artifact_published", "strategy_id": sid, "semver": semver})
 
     # относительный URL артефакта для нашего GET /v1/artifacts/{sid}/{semver}
     return {
@@ -106,8 +139,31 @@ def publish_version(sid: str, body: Dict[str, Any]):
         "sig_b64": sig_b64
     }
 
+def _prepare_patches(sid: str, base: str, semver: str) -> None:
+    try:
+        prepare_patches(sid, base, semver)
+    except Exception:
+        pass  # не вышло — патч посчитается по первому запросу
 
-vers = list_versions(sid)
-if any(v["semver"] == req.semver for v in vers):
-    raise HTTPException(status_code=409, detail="Version already exists; use a new semver")
-res = save_artifact(sid, req.semver, bundle, sha256=sha, etag=etag)
\ No newline at end of file
+@router.post("/publish")
+def publish_many(body: Dict[str, Any]):
+    """
+    body: { "items": [ {"strategy_id": "...", "semver": "1.0.0"}, ... ] }
+    Публикация пачкой одним запросом: ключ подписи разбирается один раз, уже подписанные payload
+    не подписываются заново. Ошибка одной версии не отменяет остальные — у неё в ответе "error".
+    """
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(422, "items required")
+    if len(items) > PUBLISH_MAX_ITEMS:
+        raise HTTPException(413, f"too many items (max {PUBLISH_MAX_ITEMS})")
+    out = []
+    for it in items:
+        sid, semver = it.get("strategy_id"), it.get("semver")
+        try:
+            if not semver:
+                raise HTTPException(422, "semver is required")
+            out.append(_publish(sid, semver))
+        except HTTPException as e:
+            out.append({"strategy_id": sid, "semver": semver, "error": {"status": e.status_code, "detail": e.detail}})
+    return {"items": out, "published": sum(1 for r in out if "error" not in r)}
@@ -0,0 +1,47 @@
+"""
+Бинарный контейнер бандла (.bundle.mlb), отдаётся рядом с JSON.
+
+  0:4      b"MLB1"
+  4:8      длина заголовка H (uint32 LE)
+  8:8+H    заголовок JSON: {"v": 1, "hash", "signature_b64", "sections": {name: [off, len]}}
+  8+H:     канонические байты payload (canonical_bytes) — ровно то, что подписано
+
+Секции (manifest/indicators/rules/orders/...) — диапазоны внутри канонического блока: значение
+ключа верхнего уровня в sort_keys-JSON и есть его отдельная сериализация. Движок хеширует и
+проверяет подпись прямо по блоку, а секции разбирает по требованию; manifest.hash — в заголовке.
+"""
+import json
+import struct
+from typing import Any, Dict
+
+from src.services.signer import canonical_bytes
+
+MAGIC = b"MLB1"
+MEDIA_TYPE = "application/vnd.melissa.bundle"
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+def encode_bundle(bundle: Dict[str, Any]) -> bytes:
+    payload = bundle["payload"]
+    canon = canonical_bytes(payload)
+    sections, parts, pos = {}, [], 1
+    for name in sorted(payload):
+        value = payload[name]
+        if name == "manifest":
+            value = {k: v for k, v in value.items() if k != "hash"}
+        key = json.dumps(name, ensure_ascii=False).encode("utf-8") + b":"
+        blob = _dumps(value)
+        pos += len(key)
+        sections[name] = [pos, len(blob)]
+        parts.append(key + blob)
+        pos += len(blob) + 1  # "," или закрывающая "}"
+    if b"{" + b",".join(parts) + b"}" != canon:
+        raise ValueError("section layout does not match canonical bytes")
+    header = json.dumps({
+        "v": 1,
+        "hash": payload["manifest"]["hash"],
+        "signature_b64": bundle["signature_b64"],
+        "sections": sections,
+    }, separators=(",", ":")).encode("utf-8")
+    return MAGIC + struct.pack("<I", len(header)) + header + canon
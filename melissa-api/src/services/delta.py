@@ -0,0 +1,58 @@
+"""
+Бинарный патч между двумя представлениями бандла (байты файла базовой версии -> целевой).
+
+  0:4      b"MLD1"
+  4:8      длина заголовка H (uint32 LE)
+  8:8+H    заголовок JSON: {"base_sha256", "target_sha256", "target_size"}
+  далее    операции: b"C" + uint32 off + uint32 len — копия из базы,
+                     b"I" + uint32 len + байты   — вставка
+
+Новые версии обычно меняют пару params в indicators/orders: почти весь файл — копии из базы.
+Применение — src/core/delta.py в движке; результат сверяется по target_sha256 и подписи.
+"""
+import hashlib
+import json
+import struct
+
+MAGIC = b"MLD1"
+MEDIA_TYPE = "application/vnd.melissa.delta"
+BLOCK = 16  # длина якоря: базу индексируем по блокам, цель сканируем побайтно
+
+def _copy(off: int, n: int) -> bytes:
+    return b"C" + struct.pack("<II", off, n)
+
+def _insert(data: bytes) -> bytes:
+    return b"I" + struct.pack("<I", len(data)) + data
+
+def make_patch(base: bytes, target: bytes) -> bytes:
+    index = {}
+    for i in range(0, len(base) - BLOCK + 1, BLOCK):
+        index.setdefault(base[i:i + BLOCK], i)
+    ops = []
+    lit = j = 0
+    n, nb = len(target), len(base)
+    while j + BLOCK <= n:
+        i = index.get(target[j:j + BLOCK])
+        if i is None:
+            j += 1
+            continue
+        # совпадение тянем назад (в ещё не записанную вставку) и вперёд — сначала блоками, потом по байту
+        while j > lit and i > 0 and base[i - 1] == target[j - 1]:
+            i, j = i - 1, j - 1
+        k = BLOCK
+        while i + k + BLOCK <= nb and j + k + BLOCK <= n and base[i + k:i + k + BLOCK] == target[j + k:j + k + BLOCK]:
+            k += BLOCK
+        while i + k < nb and j + k < n and base[i + k] == target[j + k]:
+            k += 1
+        if j > lit:
+            ops.append(_insert(target[lit:j]))
+        ops.append(_copy(i, k))
+        j = lit = j + k
+    if lit < n:
+        ops.append(_insert(target[lit:]))
+    header = json.dumps({
+        "base_sha256": hashlib.sha256(base).hexdigest(),
+        "target_sha256": hashlib.sha256(target).hexdigest(),
+        "target_size": n,
+    }, separators=(",", ":")).encode("utf-8")
+    return MAGIC + struct.pack("<I", len(header)) + header + b"".join(ops)
@@ -0,0 +1,87 @@
+"""
+In-process хаб уведомлений для long-poll и SSE.
+
+Топик — строка ("activation:<device_id>", "device:<device_id>"). У топика монотонный seq
+и короткий хвост последних событий: переподключившийся клиент (Last-Event-ID / since)
+получает то, что пришло между запросами, а не только новое.
+
+publish() можно звать из sync-хендлеров (они крутятся в threadpool): ожидающих будим через
+loop.call_soon_threadsafe. Хаб живёт в памяти процесса — при нескольких воркерах uvicorn
+событие увидят только клиенты того же воркера, остальные догонят плановым sync.
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+Event = Tuple[int, Dict[str, Any]]
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+class Hub:
+    def __init__(self, keep: int = 32):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._seq: Dict[str, int] = {}
+        self._tail: Dict[str, Deque[Event]] = {}
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+    def publish(self, topic: str, event: Dict[str, Any]) -> int:
+        with self._lock:
+            seq = self._seq.get(topic, 0) + 1
+            self._seq[topic] = seq
+            self._tail.setdefault(topic, deque(maxlen=self.keep)).append((seq, event))
+            waiters = self._waiters.pop(topic, [])
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(_wake, fut)
+        return seq
+
+    def seq(self, topic: str) -> int:
+        with self._lock:
+            return self._seq.get(topic, 0)
+
+    def since(self, topic: str, seq: int) -> List[Event]:
+        with self._lock:
+            if seq > self._seq.get(topic, 0):
+                seq = 0  # id из прошлой жизни процесса — отдаём весь хвост
+            return [(s, e) for s, e in self._tail.get(topic, ()) if s > seq]
+
+    async def wait(self, topic: str, since: int, timeout: float) -> List[Event]:
+        """События топика новее `since`; если их нет — ждём до `timeout` секунд ([] по таймауту)."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._lock:
+            cur = self._seq.get(topic, 0)
+            if cur == since or since > cur and not self._tail.get(topic):
+                self._waiters.setdefault(topic, []).append((loop, fut))
+            else:
+                fut = None
+        if fut is not None:
+            try:
+                await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    ws = self._waiters.get(topic)
+                    if ws and (loop, fut) in ws:
+                        ws.remove((loop, fut))
+                        if not ws:
+                            del self._waiters[topic]
+        return self.since(topic, since)
+
+hub = Hub()
+
+def activation_topic(device_id: str) -> str:
+    return f"activation:{device_id}"
+
+def device_topic(device_id: str) -> str:
+    return f"device:{device_id}"
+
+def notify_activated(device_id: str) -> None:
+    hub.publish(activation_topic(device_id), {"type": "activated"})
+
+def notify_device(device_id: str, event: Dict[str, Any]) -> None:
+    hub.publish(device_topic(device_id), event)
@@ -1,10 +1,22 @@
 import os
+import json
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
 from nacl.signing import SigningKey
 
 _PRIV_B64 = os.getenv("API_ED25519_PRIVKEY_B64") or ""
+SIG_CACHE_ITEMS = 4096  # canonical sha256 -> подпись (этим же ключом), для повторных compile/publish
 
+_sig_cache: "OrderedDict[str, str]" = OrderedDict()
+_sig_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
 def _get_signing_key() -> SigningKey:
+    # ключ разбирается один раз на процесс: bulk publish подписывает сотни версий подряд
     if not _PRIV_B64:
         raise RuntimeError("API_ED25519_PRIVKEY_B64 is not set in environment (.env)")
     return SigningKey(base64.b64decode(_PRIV_B64))
@@ -16,3 +28,39 @@ def sign_bytes(payload: bytes) -> str:
     sk = _get_signing_key()
     sig = sk.sign(payload).signature
     return base64.b64encode(sig).decode()
+
+@lru_cache(maxsize=1)
+def key_id() -> str:
+    """Отпечаток текущего ключа: подпись из хранилища переиспользуется, только если ключ тот же."""
+    return hashlib.sha256(bytes(_get_signing_key().verify_key)).hexdigest()[:16]
+
+def sign_canonical(raw: bytes, known: Optional[Callable[[str, str], Optional[str]]] = None) -> Tuple[str, str]:
+    """
+    (sha256, signature_b64) канонических байт. Ed25519 детерминирована: тот же hash тем же ключом
+    даёт ту же подпись, поэтому уже известную (LRU процесса или known(hash, key_id) из хранилища) не считаем заново.
+    """
+    sha = hashlib.sha256(raw).hexdigest()
+    with _sig_lock:
+        sig = _sig_cache.get(sha)
+        if sig is not None:
+            _sig_cache.move_to_end(sha)
+            return sha, sig
+    sig = (known(sha, key_id()) if known else None) or sign_bytes(raw)
+    with _sig_lock:
+        _sig_cache[sha] = sig
+        while len(_sig_cache) > SIG_CACHE_ITEMS:
+            _sig_cache.popitem(last=False)
+    return sha, sig
+
+def canonical_bytes(payload: dict) -> bytes:
+    """
+    Байты для manifest.hash и подписи: sort_keys, без пробелов, без manifest.hash.
+    Движок (src/core/verify.py) сериализует payload так же.
+    """
+    manifest = payload.get("manifest", {})
+    orig_hash = manifest.pop("hash", None)
+    try:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    finally:
+        if orig_hash is not None:
+            manifest["hash"] = orig_hash
@@ -1,11 +1,30 @@
+"""
+Проверка секций draft/payload по JSON Schema — то же, что melissa-engine/src/core/schema.py
+(пакеты ставятся отдельно и оба как `src`, поэтому код не импортируется, а повторяет движок).
+
+Валидаторы собираются один раз при импорте; при установленном fastjsonschema (extra `fast`)
+сначала пробуется сгенерированный код, текст ошибки всегда строит jsonschema.
+Успешные проверки запоминаются по sha256 канонических байт секций: publish повторно
+проверяет тот же draft, что уже принял PUT /draft.
+"""
+import hashlib
 import json
 import pathlib
-from jsonschema import Draft202012Validator, exceptions as js_exc
-from jsonschema import validate, ValidationError
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from jsonschema import Draft202012Validator, ValidationError
+
+try:
+    import fastjsonschema
+except ImportError:  # только jsonschema
+    fastjsonschema = None
 
 
 BASE = pathlib.Path(__file__).resolve().parents[1] / "schemas"
 REQUIRED_KEYS = ("manifest","indicators","rules","orders")
+VALID_CACHE_ITEMS = 1024
 
 SCHEMAS = {
     "manifest": json.loads((BASE / "manifest.schema.json").read_text(encoding="utf-8")),
@@ -14,19 +33,55 @@ SCHEMAS = {
     "orders": json.loads((BASE / "orders.schema.json").read_text(encoding="utf-8")),
 }
 
+def _fast(schema: dict):
+    if fastjsonschema is None:
+        return None
+    try:
+        return fastjsonschema.compile(schema, use_default=False)
+    except fastjsonschema.JsonSchemaDefinitionException:
+        return None  # схему генератор не осилил — проверяет jsonschema
+
+# валидаторы собираются один раз на процесс, а не на каждый вызов
+VALIDATORS = {name: Draft202012Validator(schema) for name, schema in SCHEMAS.items()}
+FAST = {name: _fast(schema) for name, schema in SCHEMAS.items()}
+
+_passed: "OrderedDict[str, None]" = OrderedDict()
+_passed_lock = threading.Lock()
+
 def validate_part(name: str, doc: dict):
-    schema = SCHEMAS[name]
-    Draft202012Validator(schema).validate(doc)
+    fast = FAST[name]
+    if fast is not None:
+        try:
+            fast(doc)
+            return
+        except fastjsonschema.JsonSchemaException:
+            pass  # за сообщением — к jsonschema
+    VALIDATORS[name].validate(doc)
 
+def _digest(doc: dict) -> str:
+    raw = json.dumps({k: doc[k] for k in REQUIRED_KEYS}, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-def validate_all(doc: dict):
-    # 1) ключи
+def validate_all(doc: dict, doc_hash: Optional[str] = None):
+    """
+    ValueError с путём до ошибки. doc_hash — уже посчитанный sha256 секций (иначе считается здесь);
+    документ, прошедший проверку, второй раз не проверяется.
+    """
     missing = [k for k in REQUIRED_KEYS if k not in doc]
     if missing:
         raise ValueError(f"Missing top-level sections: {', '.join(missing)}")
-    # 2) далее — jsonschema.validate(...) для каждой секции/целого документа
-    try:
-        # validate(doc, FULL_SCHEMA)  # если есть общая схема
-        pass
-    except ValidationError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
\ No newline at end of file
+    key = doc_hash or _digest(doc)
+    with _passed_lock:
+        if key in _passed:
+            _passed.move_to_end(key)
+            return
+    for name in REQUIRED_KEYS:
+        try:
+            validate_part(name, doc[name])
+        except ValidationError as e:
+            path = ".".join(map(str, e.path))
+            raise ValueError(f"Schema validation error in {name}{'.' + path if path else ''}: {e.message}") from e
+    with _passed_lock:
+        _passed[key] = None
+        while len(_passed) > VALID_CACHE_ITEMS:
+            _passed.popitem(last=False)
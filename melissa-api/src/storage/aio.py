@@ -0,0 +1,52 @@
+"""
+Асинхронный фасад хранилища для async-хендлеров.
+
+Функции repo блокирующие (файлы, sqlite) — здесь они уходят в потоки с собственным лимитом
+API_IO_THREADS, а не в общий threadpool starlette (40 потоков), где ждали бы вперемешку с sync-хендлерами.
+Что можно ответить из памяти (LRU артефактов) — отвечается прямо в event loop, без потока.
+"""
+import os
+from functools import partial, wraps
+from typing import Any, AsyncIterator, Dict, Optional
+
+import anyio
+
+from . import repo
+
+IO_THREADS = int(os.getenv("API_IO_THREADS") or 64)
+_limiter = anyio.CapacityLimiter(IO_THREADS)
+
+async def run_io(fn, *args, **kwargs):
+    """fn(*args, **kwargs) в потоке хранилища."""
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs), limiter=_limiter)
+
+def _offload(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_io(fn, *args, **kwargs)
+    return wrapper
+
+register_device = _offload(repo.register_device)
+poll_device = _offload(repo.poll_device)
+
+async def artifact_entry(strategy_id: str, semver: str, encoding: str = "identity",
+                         with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    e = repo.cached_artifact_entry(strategy_id, semver, encoding, with_body, fmt)
+    if e is not None:
+        return e
+    return await run_io(repo.artifact_entry, strategy_id, semver, encoding, with_body, fmt)
+
+async def patch_entry(strategy_id: str, base: str, semver: str, encoding: str = "identity",
+                      with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    e = repo.cached_patch_entry(strategy_id, base, semver, encoding, with_body, fmt)
+    if e is not None:
+        return e
+    return await run_io(repo.patch_entry, strategy_id, base, semver, encoding, with_body, fmt)
+
+async def read_chunks(path, chunk: int) -> AsyncIterator[bytes]:
+    f = await run_io(open, path, "rb")
+    try:
+        while data := await run_io(f.read, chunk):
+            yield data
+    finally:
+        await run_io(f.close)
@@ -1,11 +1,14 @@
-import json, pathlib, uuid, time, secrets
+import json, os, pathlib, uuid, time, secrets, hashlib
 from typing import Optional, Dict, Any, List
 from .safe import validate_uuid, safe_join
+from .jsonindex import JsonIndex
+from .revs import ROOT, next_rev, snapshot
 
 
-ROOT = pathlib.Path(__file__).resolve().parents[2] / "storage_data"
 DEV_DIR   = ROOT / "devices"
 GRANTS_DIR= ROOT / "grants"
+INDEX_PATH = ROOT / "device_index.json"
+GRANT_INDEX_PATH = ROOT / "grant_index.json"
 for p in (DEV_DIR, GRANTS_DIR):
     p.mkdir(parents=True, exist_ok=True)
 
@@ -21,6 +24,51 @@ def _grant_path(device_id: str) -> pathlib.Path:
     validate_uuid(device_id, "device_id")
     return safe_join(GRANTS_DIR, f"{device_id}.json")
 
+def _token_key(device_token: str) -> str:
+    # в индексе — только sha256 токена: утечка индекса не даёт доступа к устройствам
+    return hashlib.sha256(device_token.encode("utf-8")).hexdigest()
+
+def _scan_devices() -> Dict[str, Any]:
+    # индекс устройств: {"tokens": {sha256(token): device_id}, "codes": {user_code: [device_id, expires_at]},
+    #                    "tags": {tag: {device_id: 1}}}
+    idx = {"tokens": {}, "codes": {}, "tags": {}}
+    now = int(time.time())
+    for f in DEV_DIR.glob("*.json"):
+        d = json.loads(f.read_text(encoding="utf-8"))
+        for t in d.get("tags", []):
+            idx["tags"].setdefault(t, {})[d["device_id"]] = 1
+        if d.get("status") == "active" and d.get("device_token"):
+            idx["tokens"][_token_key(d["device_token"])] = d["device_id"]
+        elif d.get("user_code") and (d.get("user_code_expires_at") or 0) >= now:
+            idx["codes"][d["user_code"]] = [d["device_id"], d["user_code_expires_at"]]
+    return idx
+
+def _prune_codes(idx: Dict[str, Any]) -> None:
+    now = int(time.time())
+    idx["codes"] = {c: v for c, v in idx["codes"].items() if v[1] >= now}
+
+_index = JsonIndex(INDEX_PATH, build=_scan_devices, prune=_prune_codes)
+
+def _scan_grants() -> Dict[str, Any]:
+    # обратный индекс грантов: {"strategies": {strategy_id: {device_id: 1}}} — кому слать события публикации
+    idx: Dict[str, Any] = {"strategies": {}}
+    for f in GRANTS_DIR.glob("*.json"):
+        for g in json.loads(f.read_text(encoding="utf-8")):
+            idx["strategies"].setdefault(g["strategy_id"], {})[f.stem] = 1
+    return idx
+
+# порядок блокировок везде один: счётчик (next_rev), затем обратный индекс
+_grant_index = JsonIndex(GRANT_INDEX_PATH, build=_scan_grants)
+
+def _reindex(gidx: Dict[str, Any], device_id: str, before: set, after: set) -> None:
+    holders = gidx["strategies"]
+    for sid in before - after:
+        holders.get(sid, {}).pop(device_id, None)
+        if not holders.get(sid, True):
+            del holders[sid]
+    for sid in after - before:
+        holders.setdefault(sid, {})[device_id] = 1
+
 def register_device(verification_uri: str = "http://localhost:8000/link") -> Dict[str, Any]:
     device_id = str(uuid.uuid4())
     user_code = f"{secrets.token_hex(2)}-{secrets.token_hex(2)}".upper()  # абы какой формат ABCD-1234
@@ -40,6 +88,8 @@ def register_device(verification_uri: str = "http://localhost:8000/link") -> Dic
     # пустые гранты
     if not _grant_path(device_id).exists():
         _grant_path(device_id).write_text(json.dumps([], ensure_ascii=False, indent=2), encoding="utf-8")
+    with _index.update() as idx:
+        idx["codes"][user_code] = [device_id, rec["user_code_expires_at"]]
     return {"device_id": device_id, "user_code": user_code, "verification_uri": verification_uri, "expires_in": 600}
 
 def _load_device(device_id: str) -> Optional[Dict[str, Any]]:
@@ -53,21 +103,62 @@ def _save_device(doc: Dict[str, Any]) -> None:
     _dev_path(doc["device_id"]).write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
 
 def activate_device_by_code(user_code: str, user_id: str) -> Optional[str]:
-    # поиск по файлам (MVP)
-    for f in DEV_DIR.glob("*.json"):
-        d = json.loads(f.read_text(encoding="utf-8"))
-        if d.get("user_code") == user_code:
-            if d.get("user_code_expires_at", 0) < int(time.time()):
-                return None
-            d["user_id"] = user_id
-            d["status"] = "active"
-            d["user_code"] = None
-            d["user_code_expires_at"] = None
-            # выдаём device_token
-            d["device_token"] = secrets.token_urlsafe(32)
-            _save_device(d)
-            return d["device_id"]
-    return None
+    if not _index.get("codes", user_code):
+        return None
+    # под блокировкой индекса: один код не активируется дважды и из разных воркеров
+    with _index.update() as idx:
+        hit = idx["codes"].pop(user_code, None)
+        d = _load_device(hit[0]) if hit else None
+        if not d or d.get("user_code") != user_code:
+            return None
+        if (d.get("user_code_expires_at") or 0) < int(time.time()):
+            return None
+        d["user_id"] = user_id
+        d["status"] = "active"
+        d["user_code"] = None
+        d["user_code_expires_at"] = None
+        # выдаём device_token
+        d["device_token"] = secrets.token_urlsafe(32)
+        _save_device(d)
+        idx["tokens"][_token_key(d["device_token"])] = d["device_id"]
+        return d["device_id"]
+
+def revoke_device(device_id: str) -> bool:
+    with _index.update() as idx:
+        d = _load_device(device_id)
+        if not d:
+            return False
+        if d.get("device_token"):
+            idx["tokens"].pop(_token_key(d["device_token"]), None)
+        if d.get("user_code"):
+            idx["codes"].pop(d["user_code"], None)
+        d["status"] = "revoked"
+        d["device_token"] = None
+        d["user_code"] = None
+        _save_device(d)
+    with next_rev() as (revs, rev):
+        revs.setdefault("devices", {})[device_id] = rev  # список, закешированный со старым токеном, устарел
+    return True
+
+def set_device_tags(device_id: str, tags: List[str]) -> Optional[List[str]]:
+    """Метки устройства (для массовой выдачи грантов); None — устройства нет."""
+    with _index.update() as idx:
+        d = _load_device(device_id)
+        if not d:
+            return None
+        by_tag = idx.setdefault("tags", {})
+        for t in d.get("tags", []):
+            by_tag.get(t, {}).pop(device_id, None)
+            if not by_tag.get(t, True):
+                del by_tag[t]
+        for t in tags:
+            by_tag.setdefault(t, {})[device_id] = 1
+        d["tags"] = tags
+        _save_device(d)
+    return tags
+
+def devices_by_tag(tag: str) -> List[str]:
+    return list(_index.read().get("tags", {}).get(tag, {}))
 
 def poll_device(device_id: str) -> Dict[str, Any]:
     d = _load_device(device_id)
@@ -78,10 +169,13 @@ def poll_device(device_id: str) -> Dict[str, Any]:
     return {"device_token": d["device_token"]}
 
 def device_by_token(device_token: str) -> Optional[Dict[str, Any]]:
-    for f in DEV_DIR.glob("*.json"):
-        d = json.loads(f.read_text(encoding="utf-8"))
-        if d.get("device_token") == device_token and d.get("status") == "active":
-            return d
+    device_id = _index.get("tokens", _token_key(device_token))
+    if not device_id:
+        return None
+    d = _load_device(device_id)
+    # файл устройства — источник истины; индекс только сужает поиск до одного файла
+    if d and d.get("device_token") == device_token and d.get("status") == "active":
+        return d
     return None
 
 def list_grants(device_id: str) -> List[Dict[str, Any]]:
@@ -90,10 +184,20 @@ def list_grants(device_id: str) -> List[Dict[str, Any]]:
         return []
     return json.loads(p.read_text(encoding="utf-8"))
 
-def save_grants(device_id: str, grants: List[Dict[str, Any]]) -> None:
+def _write_grants(device_id: str, grants: List[Dict[str, Any]]) -> None:
     _grant_path(device_id).write_text(json.dumps(grants, ensure_ascii=False, indent=2), encoding="utf-8")
 
-def grant_strategy(device_id: str, strategy_id: str, allow_latest: bool, pinned_semver: str | None = None) -> List[Dict[str, Any]]:
+def save_grants(device_id: str, grants: List[Dict[str, Any]]) -> None:
+    # полная замена списка: устройство с курсором старше получит список целиком
+    with next_rev() as (revs, rev), _grant_index.update() as gidx:
+        before = {g["strategy_id"] for g in list_grants(device_id)}
+        _write_grants(device_id, [dict(g, rev=rev) for g in grants])
+        revs["resets"][device_id] = rev
+        revs.setdefault("devices", {})[device_id] = rev
+        _reindex(gidx, device_id, before, {g["strategy_id"] for g in grants})
+
+def _upserted(device_id: str, strategy_id: str, allow_latest: bool, pinned_semver: str | None,
+              rev: int) -> List[Dict[str, Any]]:
     grants = list_grants(device_id)
     # заменяем, если есть
     updated = False
@@ -101,9 +205,117 @@ def grant_strategy(device_id: str, strategy_id: str, allow_latest: bool, pinned_
         if g["strategy_id"] == strategy_id:
             g["allow_latest"] = allow_latest
             g["pinned_semver"] = pinned_semver
+            g["rev"] = rev
             updated = True
             break
     if not updated:
-        grants.append({"strategy_id": strategy_id, "allow_latest": allow_latest, "pinned_semver": pinned_semver})
-    save_grants(device_id, grants)
+        grants.append({"strategy_id": strategy_id, "allow_latest": allow_latest, "pinned_semver": pinned_semver,
+                       "rev": rev})
+    return grants
+
+def _upsert_grant(device_id: str, strategy_id: str, allow_latest: bool, pinned_semver: str | None,
+                  rev: int) -> List[Dict[str, Any]]:
+    grants = _upserted(device_id, strategy_id, allow_latest, pinned_semver, rev)
+    _write_grants(device_id, grants)
+    return grants
+
+def grant_strategy(device_id: str, strategy_id: str, allow_latest: bool, pinned_semver: str | None = None) -> List[Dict[str, Any]]:
+    # под блокировкой счётчика: rev гранта и запись файла — одна операция для всех воркеров
+    with next_rev() as (revs, rev), _grant_index.update() as gidx:
+        revs.setdefault("devices", {})[device_id] = rev
+        grants = _upsert_grant(device_id, strategy_id, allow_latest, pinned_semver, rev)
+        gidx["strategies"].setdefault(strategy_id, {})[device_id] = 1
     return grants
+
+def grant_many(device_ids: List[str], strategy_id: str, allow_latest: bool,
+               pinned_semver: str | None = None) -> List[str]:
+    """
+    Один грант многим устройствам: один rev и одна запись счётчика и обратного индекса на всех.
+    Блокировки держатся до конца — для других воркеров это одна операция. Несуществующие
+    устройства пропускаются; возвращает тех, кому грант выдан.
+
+    Файлы грантов сначала пишутся во временные, затем подменяются пачкой; при ошибке уже
+    подменённые восстанавливаются, а счётчик и индекс не записываются. Транзакцией это не
+    становится: если процесс умрёт посреди подмены, часть устройств останется с грантом,
+    чей rev не попал в счётчик (такие гарантии — у sqlite-бэкенда).
+    """
+    for device_id in device_ids:
+        validate_uuid(device_id, "device_id")
+    found = [d for d in device_ids if _dev_path(d).exists()]
+    with next_rev() as (revs, rev), _grant_index.update() as gidx:
+        staged, done = [], []
+        try:
+            for device_id in found:
+                p = _grant_path(device_id)
+                old = p.read_bytes() if p.exists() else None
+                tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+                grants = _upserted(device_id, strategy_id, allow_latest, pinned_semver, rev)
+                staged.append((p, tmp, old))
+                tmp.write_text(json.dumps(grants, ensure_ascii=False, indent=2), encoding="utf-8")
+            for p, tmp, old in staged:
+                os.replace(tmp, p)
+                done.append((p, old))
+        except BaseException:
+            for p, tmp, _ in staged:
+                tmp.unlink(missing_ok=True)
+            for p, old in done:
+                if old is None:
+                    p.unlink(missing_ok=True)
+                else:
+                    p.write_bytes(old)
+            raise
+        devs = revs.setdefault("devices", {})
+        holders = gidx["strategies"].setdefault(strategy_id, {})
+        for device_id in found:
+            devs[device_id] = rev
+            holders[device_id] = 1
+    return found
+
+def revoke_grants(device_ids: List[str], strategy_id: str) -> List[str]:
+    """Снять грант стратегии с устройств (так же, одной операцией); возвращает тех, у кого он был."""
+    for device_id in device_ids:
+        validate_uuid(device_id, "device_id")
+    out = []
+    with next_rev() as (revs, rev), _grant_index.update() as gidx:
+        devs = revs.setdefault("devices", {})
+        for device_id in device_ids:
+            grants = list_grants(device_id)
+            left = [g for g in grants if g["strategy_id"] != strategy_id]
+            if len(left) == len(grants):
+                continue
+            _write_grants(device_id, left)
+            # удаление дельтой не выразить: устройство с курсором старше получит список целиком
+            revs["resets"][device_id] = rev
+            devs[device_id] = rev
+            _reindex(gidx, device_id, {strategy_id}, set())
+            out.append(device_id)
+    return out
+
+def device_changes(device_id: str, cursor: int) -> Dict[str, Any]:
+    """
+    Гранты устройства, изменившиеся после `cursor` (свой rev или новая версия стратегии), и новый курсор.
+    full=True — курсора нет/устарел: в grants весь список.
+    """
+    snap = snapshot()
+    cur = snap["rev"]
+    grants = list_grants(device_id)
+    full = cursor <= 0 or cursor > cur or snap["resets"].get(device_id, 0) > cursor
+    if not full:
+        grants = [g for g in grants
+                  if g.get("rev", 0) > cursor or snap["strategies"].get(g["strategy_id"], 0) > cursor]
+    return {"cursor": cur, "full": full, "grants": grants}
+
+def listing_rev(device_id: str, strategy_ids: List[str] | None = None) -> int:
+    """
+    Версия списка стратегий устройства: rev последней правки его грантов/отзыва или публикации
+    в одной из strategy_ids (None — стратегии текущих грантов). Не изменилась — список тот же.
+    """
+    snap = snapshot()
+    if strategy_ids is None:
+        strategy_ids = [g["strategy_id"] for g in list_grants(device_id)]
+    strategies = snap["strategies"]
+    return max([snap.get("devices", {}).get(device_id, 0), *(strategies.get(s, 0) for s in strategy_ids)])
+
+def devices_for_strategy(strategy_id: str) -> List[str]:
+    # по обратному индексу: кому отправить уведомление о новой версии
+    return list(_grant_index.read()["strategies"].get(strategy_id, {}))
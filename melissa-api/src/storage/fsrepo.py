@@ -1,15 +1,44 @@
 import json, pathlib, hashlib, time
+import gzip
 import os
-from typing import Optional, Dict, Any, List
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi import HTTPException
 from .safe import validate_uuid, validate_semver, safe_join
+from .revs import ROOT, next_rev
+from .jsonindex import JsonIndex, file_lock
+from .versions import index_add, version_index
+from src.services.binbundle import encode_bundle
+from src.services.delta import make_patch
+
+try:
+    import zstandard
+except ImportError:  # zstd-варианты не пишутся, отдаём gzip/identity
+    zstandard = None
 
 
 
-ROOT = pathlib.Path(__file__).resolve().parents[2] / "storage_data"
 STRAT_DIR = ROOT / "strategies"
 ART_DIR   = ROOT / "artifacts"
-for p in (STRAT_DIR, ART_DIR):
+BLOB_DIR  = ROOT / "blobs"
+PATCH_DIR = ROOT / "patches"
+for p in (STRAT_DIR, ART_DIR, BLOB_DIR, PATCH_DIR):
     p.mkdir(parents=True, exist_ok=True)
+BLOB_LOCK = ROOT / "blobs.lock"
+BLOB_RE = re.compile(r"^[0-9a-f]{64}(-[0-9a-f]{16})?$")  # canonical hash[-key_id]
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+BLOB_GC_GRACE = 3600  # сек: свежий блоб без ссылок может принадлежать публикации, которая ещё идёт
+PATCH_LOCK = ROOT / "patches.lock"
+PATCH_MAX_RATIO = 0.5  # патч больше этой доли полного файла не отдаём — дешевле скачать целиком
+STRAT_INDEX_PATH = ROOT / "strategy_index.json"
+
+ART_CACHE_ITEMS = 4096                                                      # мета артефактов в памяти
+ART_CACHE_BYTES = int(os.getenv("API_ARTIFACT_CACHE_BYTES") or 64 * 2**20)  # тела горячих артефактов
+ART_CACHE_MAX_BODY = 1 * 2**20                                              # крупнее — только с диска
+VARIANT_SUFFIX = {"zstd": ".zst", "gzip": ".gz"}                            # в порядке предпочтения
+FORMAT_SUFFIX = {"json": ".bundle.json", "mlb": ".bundle.mlb"}              # представления бандла
 
 
 
@@ -17,8 +46,18 @@ def _now_iso():
     import datetime as dt
     return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
+def _scan_strategies() -> Dict[str, Any]:
+    # индекс пользователь -> стратегии (в порядке создания); собирается сканом один раз
+    docs = [json.loads(f.read_text(encoding="utf-8")) for f in STRAT_DIR.glob("*.json")]
+    users: Dict[str, List[str]] = {}
+    for d in sorted(docs, key=lambda d: d["created_at"]):
+        users.setdefault(d["user_id"], []).append(d["id"])
+    return {"users": users}
+
+_strat_index = JsonIndex(STRAT_INDEX_PATH, build=_scan_strategies)
+
 def _sid_exists(sid: str) -> bool:
-    return (STRATS_DIR / f"{sid}.json").exists()
+    return (STRAT_DIR / f"{sid}.json").exists()
 
 def create_strategy(user_id: str, name: str) -> Dict[str, Any]:
     import uuid
@@ -32,16 +71,28 @@ def create_strategy(user_id: str, name: str) -> Dict[str, Any]:
         "created_at": _now_iso(),
         "updated_at": _now_iso(),
     }
-    (STRATS_DIR / f"{sid}.json").write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+    (STRAT_DIR / f"{sid}.json").write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+    # в индекс — после файла: стратегия из индекса всегда читается
+    with _strat_index.update() as idx:
+        idx["users"].setdefault(user_id, []).append(sid)
     return doc
 
 def list_strategies(user_id: str) -> list[Dict[str, Any]]:
-    out = []
-    for f in STRATS_DIR.glob("*.json"):
-        j = json.loads(f.read_text(encoding="utf-8"))
-        if j.get("user_id") == user_id:
-            out.append(j)
-    return out
+    return list_strategies_page(user_id)[0]
+
+def list_strategies_page(user_id: str, limit: int | None = None,
+                         cursor: str | None = None) -> tuple[list[Dict[str, Any]], str | None]:
+    """
+    Страница стратегий пользователя в порядке создания и курсор следующей (None — это последняя).
+    Читаются только файлы стратегий страницы: список id берётся из индекса.
+    """
+    sids = _strat_index.read()["users"].get(user_id, [])
+    if cursor and not cursor.isdigit():
+        raise HTTPException(422, "Invalid cursor")
+    start = int(cursor) if cursor else 0
+    end = len(sids) if limit is None else start + limit
+    out = [s for s in (get_strategy(sid) for sid in sids[start:end]) if s]
+    return out, str(end) if end < len(sids) else None
 
 
 def _strategy_path(strategy_id: str) -> pathlib.Path:
@@ -81,35 +132,356 @@ def update_draft(sid: str, draft: Dict[str, Any]) -> Dict[str, Any]:
         raise FileNotFoundError("strategy not found")
     cur["draft"] = draft
     cur["updated_at"] = _now_iso()
-    (STRATS_DIR / f"{sid}.json").write_text(json.dumps(cur, ensure_ascii=False, indent=2), encoding="utf-8")
+    (STRAT_DIR / f"{sid}.json").write_text(json.dumps(cur, ensure_ascii=False, indent=2), encoding="utf-8")
     return cur
 
-def save_artifact(strategy_id: str, semver: str, bundle: Dict[str, Any], sha256: str, etag: str) -> Dict[str, Any]:
+def save_artifact(strategy_id: str, semver: str, bundle: Dict[str, Any], key_id: str | None = None) -> Dict[str, Any]:
+    """
+    Версия -> блоб по canonical hash. {"already_exists", "blob", "sha256", "etag"};
+    sha256/etag — байтов файла, который отдаёт GET /v1/artifacts (у одинаковых бандлов — общие).
+    """
     # политика: запрещаем дубликаты semver → 409 handled в роутере
+    # под блокировкой счётчика изменений: проверка дубля и запись не гоняются между воркерами
+    with next_rev() as (revs, rev):
+        s = get_strategy(strategy_id)
+        assert s, "strategy must exist"
+        if any(v["semver"] == semver for v in s.get("versions", [])):
+            # не трогаем ни файл, ни мету — роутер отвечает 409
+            return {"already_exists": True}
+        blob = link_artifact(strategy_id, semver, bundle, key_id)
+        s["version_index"] = index_add(s.get("version_index") or version_index(s.get("versions", [])), semver)
+        s.setdefault("versions", []).append({
+            "semver": semver, "sha256": blob["sha256"], "etag": blob["etag"], "blob": blob["blob"],
+            "created_at": int(time.time()), "rev": rev
+        })
+        save_strategy(s)
+        revs["strategies"][strategy_id] = rev
+    return dict(blob, already_exists=False)
+
+def blob_refs() -> Counter:
+    """Сколько версий ссылается на каждый блоб (источник истины для GC)."""
+    refs: Counter = Counter()
+    for f in STRAT_DIR.glob("*.json"):
+        for v in json.loads(f.read_text(encoding="utf-8")).get("versions", []):
+            if v.get("blob"):
+                refs[v["blob"]] += 1
+    return refs
+
+def _meta_path(ap: pathlib.Path) -> pathlib.Path:
+    return ap.with_name(ap.name.replace(".bundle.json", ".bundle.meta.json"))
+
+def _format_path(ap: pathlib.Path, fmt: str) -> pathlib.Path:
+    return ap.with_name(ap.name.replace(".bundle.json", FORMAT_SUFFIX[fmt]))
+
+def _variant_path(ap: pathlib.Path, encoding: str) -> pathlib.Path:
+    return ap if encoding == "identity" else ap.with_name(ap.name + VARIANT_SUFFIX[encoding])
+
+def _compress(encoding: str, raw: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(raw, compresslevel=9, mtime=0)
+    return zstandard.ZstdCompressor(level=19).compress(raw)
+
+def artifact_bytes(bundle: Dict[str, Any]) -> bytes:
+    """Байты файла артефакта (по ним считаются sha256/ETag версии). Подпись — по payload, не по ним."""
+    return json.dumps(bundle, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _write_variants(path: pathlib.Path, raw: bytes, tag: str, etag: str) -> Dict[str, Any]:
+    # сжатые варианты пишутся один раз; у каждого свой ETag
+    meta = {"etag": etag, "size": len(raw), "variants": {}}
+    for enc in VARIANT_SUFFIX:
+        if enc == "zstd" and zstandard is None:
+            continue
+        body = _compress(enc, raw)
+        _variant_path(path, enc).write_bytes(body)
+        meta["variants"][enc] = {"etag": f'W/"{tag}-{enc}"', "size": len(body)}
+    return meta
+
+def _write_meta(ap: pathlib.Path, raw: bytes, bundle: Dict[str, Any], sha256: str, etag: str,
+                **extra: Any) -> Dict[str, Any]:
+    # JSON-файл уже на диске; рядом — бинарный контейнер, сжатые варианты обоих и sidecar
+    meta = {"sha256": sha256, **_write_variants(ap, raw, sha256, etag), "formats": {}, **extra}
+    mlb = encode_bundle(bundle)
+    bp = _format_path(ap, "mlb")
+    bp.write_bytes(mlb)
+    meta["formats"]["mlb"] = _write_variants(bp, mlb, f"{sha256}-mlb", f'W/"{sha256}-mlb"')
+    _meta_path(ap).write_text(json.dumps(meta), encoding="utf-8")
+    return meta
+
+# --- блобы: бандлы по canonical sha256, версии — указатели на них ------------------------
+
+def _blob_path(blob: str) -> pathlib.Path:
+    if not BLOB_RE.match(blob or ""):
+        raise ValueError("invalid blob hash")
+    return BLOB_DIR / blob[:2] / f"{blob}.bundle.json"
+
+def _read_blob_meta(blob: str) -> Optional[Dict[str, Any]]:
+    mp = _meta_path(_blob_path(blob))
+    return json.loads(mp.read_text(encoding="utf-8")) if mp.exists() else None
+
+def _find_blob(blob_hash: str, key_id: str | None) -> Optional[Tuple[str, Dict[str, Any]]]:
+    # блоб с подписью ключа key_id: "<hash>-<key_id>" или старый, названный только по hash
+    for blob in ((f"{blob_hash}-{key_id}",) if key_id else ()) + (blob_hash,):
+        meta = _read_blob_meta(blob)
+        if meta and meta.get("key_id") == key_id:
+            return blob, meta
+    return None
+
+def blob_signature(blob_hash: str, key_id: str) -> Optional[str]:
+    """Подпись уже сохранённого бандла с этим canonical hash, если она сделана ключом key_id."""
+    found = _find_blob(blob_hash, key_id) if HASH_RE.match(blob_hash or "") else None
+    return found[1].get("signature_b64") if found else None
+
+def put_blob(bundle: Dict[str, Any], key_id: str | None = None) -> Dict[str, Any]:
+    """
+    Блоб бандла (JSON, .mlb, сжатые варианты, sidecar). Ключ блоба — canonical hash и key_id подписи:
+    после смены ключа тот же payload ложится новым блобом с новой подписью, а версии, опубликованные
+    старым ключом, продолжают отдавать свои байты. Если такой блоб уже есть — файлы не пишутся,
+    только обновляется mtime sidecar (GC не заберёт его из-под публикации).
+    """
+    blob_hash = bundle["payload"]["manifest"]["hash"]
+    if not HASH_RE.match(blob_hash or ""):
+        raise ValueError("invalid blob hash")
+    with file_lock(BLOB_LOCK):
+        found = _find_blob(blob_hash, key_id)
+        if found is not None:
+            blob, meta = found
+            os.utime(_meta_path(_blob_path(blob)))
+        else:
+            blob = f"{blob_hash}-{key_id}" if key_id else blob_hash
+            bp = _blob_path(blob)
+            raw = artifact_bytes(bundle)
+            sha = hashlib.sha256(raw).hexdigest()
+            bp.parent.mkdir(parents=True, exist_ok=True)
+            bp.write_bytes(raw)
+            meta = _write_meta(bp, raw, bundle, sha, f'W/"{sha}"',
+                               signature_b64=bundle["signature_b64"], key_id=key_id)
+    return {"blob": blob, "sha256": meta["sha256"], "etag": meta["etag"]}
+
+def link_artifact(strategy_id: str, semver: str, bundle: Dict[str, Any], key_id: str | None = None) -> Dict[str, Any]:
+    """
+    Блоб бандла и указатель на него (<semver>.bundle.meta.json = {"blob": "<hash>-<key_id>"}):
+    отдача потом не читает и не хеширует тело, одинаковые бандлы лежат на диске один раз.
+    """
+    blob = put_blob(bundle, key_id)
     ap = _artifact_path(strategy_id, semver)
-    ap.write_text(json.dumps(bundle, ensure_ascii=False, indent=2), encoding="utf-8")
-    s = get_strategy(strategy_id)
-    assert s, "strategy must exist"
-    if any(v["semver"] == semver for v in s.get("versions", [])):
-        # не обновляем мету здесь — роутер решает: либо 409, либо обновление записи
-        return {"already_exists": True}
-    s.setdefault("versions", []).append({
-        "semver": semver, "sha256": sha256, "etag": etag, "created_at": int(time.time())
-    })
-    save_strategy(s)
-    return {"already_exists": False}
+    _meta_path(ap).write_text(json.dumps({"blob": blob["blob"]}), encoding="utf-8")
+    return blob
+
+def gc_blobs(refs: Dict[str, int], grace: float = BLOB_GC_GRACE, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Удаляет блобы, на которые не ссылается ни одна версия (refs — blob_refs() бэкенда)
+    и которые не трогались дольше grace секунд.
+    Счётчики ссылок не хранятся, а пересчитываются по версиям: версии неизменяемы и не удаляются,
+    так что ссылка пропадает только у блоба, чью версию не дописал publish (падение, 409 в гонке).
+    Хранимый счётчик при таком падении разошёлся бы с версиями, а пересчёт — нет; grace бережёт
+    блоб публикации, которая ещё пишет версию. Скан O(версий + блобов) — только в офлайн-команде gc.
+    """
+    out = {"blobs": 0, "referenced": 0, "deleted": [], "freed_bytes": 0}
+    with file_lock(BLOB_LOCK):
+        for mp in BLOB_DIR.glob("*/*.bundle.meta.json"):
+            blob = mp.name.split(".", 1)[0]
+            out["blobs"] += 1
+            if refs.get(blob, 0) > 0:
+                out["referenced"] += 1
+                continue
+            if time.time() - mp.stat().st_mtime < grace:
+                continue
+            files = list(mp.parent.glob(f"{blob}.*"))
+            sha = json.loads(mp.read_text(encoding="utf-8"))["sha256"]
+            # патчи из этого блоба и в него (имена — по sha256 файла представления)
+            files += [f for f in PATCH_DIR.glob("*/*.patch*") if sha in f.name]
+            out["freed_bytes"] += sum(f.stat().st_size for f in files)
+            out["deleted"].append(blob)
+            if not dry_run:
+                # sidecar — последним: без него блоб считается отсутствующим
+                for f in sorted(files, key=lambda f: f == mp):
+                    f.unlink()
+    return out
+
+class _ArtifactCache:
+    """
+    LRU по (sid, semver, format, encoding): мета (path, etag, size) и, для небольших артефактов, само тело.
+    Опубликованный артефакт неизменяем, поэтому запись в кеше не инвалидируется.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int, max_body: int):
+        self.max_items, self.max_bytes, self.max_body = max_items, max_bytes, max_body
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            e = self._items.get(key)
+            if e is not None:
+                self._items.move_to_end(key)
+            return e
+
+    def put(self, key: tuple, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old and old.get("body") is not None:
+                self._bytes -= len(old["body"])
+            self._items[key] = entry
+            if entry.get("body") is not None:
+                self._bytes += len(entry["body"])
+            while len(self._items) > self.max_items:
+                self._drop_oldest()
+            # бюджет тел: у старых записей отбираем тело, мета остаётся
+            for k, e in self._items.items():
+                if self._bytes <= self.max_bytes:
+                    break
+                if e.get("body") is not None:
+                    self._bytes -= len(e["body"])
+                    e["body"] = None
+
+    def _drop_oldest(self) -> None:
+        _, e = self._items.popitem(last=False)
+        if e.get("body") is not None:
+            self._bytes -= len(e["body"])
+
+_art_cache = _ArtifactCache(ART_CACHE_ITEMS, ART_CACHE_BYTES, ART_CACHE_MAX_BODY)
+
+def _load_meta(strategy_id: str, semver: str) -> Optional[Dict[str, Any]]:
+    ap = safe_join(ART_DIR, strategy_id, f"{semver}.bundle.json")
+    mp = _meta_path(ap)
+    meta = json.loads(mp.read_text(encoding="utf-8")) if mp.exists() else None
+    if meta is not None and "blob" in meta:
+        bp = _blob_path(meta["blob"])
+        blob_meta = _read_blob_meta(meta["blob"])
+        return dict(blob_meta, path=bp) if blob_meta else None
+    if meta is None or "formats" not in meta:
+        # артефакт, опубликованный до sidecar/вариантов/.mlb, — досчитываем один раз
+        if not ap.exists():
+            return None
+        raw = ap.read_bytes()
+        sha = hashlib.sha256(raw).hexdigest()
+        meta = _write_meta(ap, raw, json.loads(raw), sha, f'W/"{sha}"')
+    return dict(meta, path=ap)
+
+def artifact_entry(strategy_id: str, semver: str, encoding: str = "identity",
+                   with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    """
+    {"path", "etag", "size", "body", "encodings", "etags"} варианта артефакта в представлении fmt
+    (json | mlb) и кодировке (identity | gzip | zstd); body — bytes из LRU или None (отдавать файлом);
+    encodings/etags — все доступные варианты этого представления.
+    Повторный 304 не трогает диск; sidecar пишется при публикации (для старых артефактов — здесь, один раз).
+    """
+    validate_uuid(strategy_id, "strategy_id")
+    validate_semver(semver)
+    key = (strategy_id, semver, fmt, encoding)
+    e = _art_cache.get(key)
+    if e is None:
+        meta = _load_meta(strategy_id, semver)
+        if meta is None:
+            return None
+        fm = meta if fmt == "json" else meta["formats"].get(fmt)
+        if fm is None:
+            return None
+        variants = {"identity": {"etag": fm["etag"], "size": fm["size"]}, **fm["variants"]}
+        if encoding not in variants:
+            return None
+        etags = [v["etag"] for v in variants.values()]
+        path = _format_path(meta["path"], fmt)
+        for enc, v in variants.items():
+            entry = {"path": _variant_path(path, enc), "etag": v["etag"], "size": v["size"], "body": None,
+                     "encodings": list(variants), "etags": etags}
+            _art_cache.put((strategy_id, semver, fmt, enc), entry)
+            if enc == encoding:
+                e = entry
+    if with_body and e["body"] is None and e["size"] <= _art_cache.max_body:
+        e = dict(e, body=e["path"].read_bytes())
+        _art_cache.put(key, e)
+    return e
+
+def _cached(key: tuple, with_body: bool) -> Optional[Dict[str, Any]]:
+    e = _art_cache.get(key)
+    if e is None or (with_body and e["body"] is None and e["size"] <= _art_cache.max_body):
+        return None
+    return e
+
+def cached_artifact_entry(strategy_id: str, semver: str, encoding: str = "identity",
+                          with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    """То же, что artifact_entry, но только из памяти: None — нужен диск (или артефакта нет)."""
+    return _cached((strategy_id, semver, fmt, encoding), with_body)
+
+def cached_patch_entry(strategy_id: str, base: str, semver: str, encoding: str = "identity",
+                       with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    return _cached(("patch", strategy_id, base, semver, fmt, encoding), with_body)
+
+def _tag(etag: str) -> str:
+    # W/"<sha>[-mlb]" -> <sha>[-mlb]: имя представления файла (без кодировки)
+    return etag.removeprefix("W/").strip('"')
+
+def _load_patch_meta(base: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    bt, tt = _tag(base["etag"]), _tag(target["etag"])
+    pp = PATCH_DIR / tt[:2] / f"{tt}.from.{bt}.patch"
+    mp = pp.with_name(pp.name + ".meta.json")
+    if not mp.exists():
+        # генерация одна на все воркеры; sidecar пишется последним — по нему патч считается готовым
+        with file_lock(PATCH_LOCK):
+            if not mp.exists():
+                patch = make_patch(base["path"].read_bytes(), target["path"].read_bytes())
+                pp.parent.mkdir(parents=True, exist_ok=True)
+                if len(patch) <= target["size"] * PATCH_MAX_RATIO:
+                    pp.write_bytes(patch)
+                    meta = _write_variants(pp, patch, f"{tt}-from-{bt}", f'W/"{tt}-from-{bt}"')
+                else:
+                    meta = {"skip": True}  # запоминаем, что патч невыгоден, чтобы не считать снова
+                mp.write_text(json.dumps(meta), encoding="utf-8")
+    return dict(json.loads(mp.read_text(encoding="utf-8")), path=pp)
+
+def patch_entry(strategy_id: str, base: str, semver: str, encoding: str = "identity",
+                with_body: bool = False, fmt: str = "json") -> Optional[Dict[str, Any]]:
+    """
+    Патч файла версии base -> semver в представлении fmt, в форме artifact_entry (+ "target_etag").
+    Считается один раз на пару (base, цель) — при публикации (prepare_patches) или первом запросе —
+    и кешируется на диске; None — базы/цели нет или патч невыгоден.
+    """
+    validate_semver(base)
+    key = ("patch", strategy_id, base, semver, fmt, encoding)
+    e = _art_cache.get(key)
+    if e is None:
+        src = artifact_entry(strategy_id, base, fmt=fmt)
+        dst = artifact_entry(strategy_id, semver, fmt=fmt)
+        if not src or not dst:
+            return None
+        meta = _load_patch_meta(src, dst)
+        if meta.get("skip"):
+            return None
+        variants = {"identity": {"etag": meta["etag"], "size": meta["size"]}, **meta["variants"]}
+        if encoding not in variants:
+            return None
+        etags = [v["etag"] for v in variants.values()]
+        for enc, v in variants.items():
+            entry = {"path": _variant_path(meta["path"], enc), "etag": v["etag"], "size": v["size"], "body": None,
+                     "encodings": list(variants), "etags": etags, "target_etag": dst["etag"]}
+            _art_cache.put(("patch", strategy_id, base, semver, fmt, enc), entry)
+            if enc == encoding:
+                e = entry
+    if with_body and e["body"] is None and e["size"] <= _art_cache.max_body:
+        e = dict(e, body=e["path"].read_bytes())
+        _art_cache.put(key, e)
+    return e
+
+def prepare_patches(strategy_id: str, base: str, semver: str) -> None:
+    """
+    Патчи base -> semver в обоих представлениях — сразу после публикации (в фоне), чтобы первый
+    sync с ?base= получил готовый файл, а не ждал побайтного make_patch в запросе.
+    """
+    for fmt in ("mlb", "json"):
+        patch_entry(strategy_id, base, semver, fmt=fmt)
 
 def read_artifact(strategy_id: str, semver: str) -> Optional[Dict[str, Any]]:
-    ap = _artifact_path(strategy_id, semver)
-    if not ap.exists():
+    e = artifact_entry(strategy_id, semver)
+    if not e:
         return None
-    return json.loads(ap.read_text(encoding="utf-8"))
+    return json.loads(e["path"].read_text(encoding="utf-8"))
 
 def load_artifact_rel(rel_path: str) -> Optional[tuple[bytes, str]]:
-    p = ART_DIR / rel_path
-    if not p.exists():
+    # "<sid>/<semver>.bundle.json" — путь из ответа publish
+    sid, _, name = rel_path.partition("/")
+    e = artifact_entry(sid, name.removesuffix(".bundle.json"))
+    if not e:
         return None
-    raw = p.read_bytes()
-    sha = hashlib.sha256(raw).hexdigest()
-    etag = f'W/"{sha}"'
-    return raw, etag
+    return e["path"].read_bytes(), e["etag"]
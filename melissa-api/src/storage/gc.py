@@ -0,0 +1,25 @@
+"""
+Сборка мусора в хранилище блобов артефактов:
+    python -m src.storage.gc [--grace СЕК] [--dry-run]
+Ссылки считаются по версиям бэкенда из API_STORAGE (.env): удаляются блобы без единой ссылки,
+не тронутые дольше grace секунд (по умолчанию BLOB_GC_GRACE — публикация могла ещё не записать версию).
+"""
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv(dotenv_path=Path(__file__).resolve().parents[2] / ".env")
+
+from .fsrepo import BLOB_GC_GRACE  # noqa: E402
+from .repo import blob_refs, gc_blobs  # noqa: E402
+
+def _opt(args: list, name: str, default: str) -> str:
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    refs = blob_refs()
+    res = gc_blobs(refs, grace=float(_opt(args, "--grace", str(BLOB_GC_GRACE))), dry_run="--dry-run" in args)
+    verb = "would delete" if "--dry-run" in args else "deleted"
+    print(f"blobs: {res['blobs']}, referenced: {res['referenced']}, {verb}: {len(res['deleted'])} "
+          f"({res['freed_bytes']} bytes)")
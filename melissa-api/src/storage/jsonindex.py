@@ -0,0 +1,86 @@
+"""
+Небольшой JSON-индекс рядом с файлами хранилища, общий для нескольких воркеров uvicorn.
+
+Читается один раз и перечитывается, только если файл сменился (mtime/size/inode — запись
+идёт через os.replace), поэтому чтение — O(1) на запрос. Запись — под межпроцессной
+блокировкой: перечитать с диска, изменить, атомарно заменить. Нет файла — собирается
+функцией build (обычно сканом каталога) при первом обращении.
+
+Цена этой атомарности — запись O(размер индекса): каждая правка перечитывает и переписывает
+файл целиком (на 100k устройств — порядка мегабайтов на register/activate/revoke), а другие
+воркеры после неё перечитывают его заново. Это осознанный предел fs-бэкенда (разработка,
+небольшие парки). Под нагрузкой — API_STORAGE=sqlite: токены, user_code, гранты и счётчик
+там — индексированные колонки, запись O(log N) в транзакции, без общего файла.
+"""
+import json, os, pathlib, threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+
+    def _flock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+except ImportError:  # Windows
+    import msvcrt
+
+    def _flock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+@contextmanager
+def file_lock(path: pathlib.Path):
+    """Межпроцессная блокировка на файле `path` (снимается при выходе)."""
+    with open(path, "a+b") as lock:
+        _flock(lock)
+        yield
+
+class JsonIndex:
+    def __init__(self, path: pathlib.Path, build: Callable[[], Dict[str, Any]],
+                 prune: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.path = path
+        self.lock_path = path.with_suffix(".lock")
+        self.build = build
+        self.prune = prune
+        self._mu = threading.Lock()
+        self._stamp = None
+        self._data: Optional[Dict[str, Any]] = None
+
+    def _disk_stamp(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def read(self) -> Dict[str, Any]:
+        """Текущий снимок (не изменять — для записи есть update())."""
+        stamp = self._disk_stamp()
+        if stamp is None:
+            with self.update():
+                pass
+            stamp = self._disk_stamp()
+        with self._mu:
+            if stamp != self._stamp:
+                self._data = json.loads(self.path.read_text(encoding="utf-8"))
+                self._stamp = stamp
+            return self._data
+
+    def get(self, table: str, key: str):
+        return self.read()[table].get(key)
+
+    @contextmanager
+    def update(self):
+        """with index.update() as idx: ... — изменения idx сохраняются при выходе."""
+        with self._mu, file_lock(self.lock_path):
+            if self.path.exists():
+                idx = json.loads(self.path.read_text(encoding="utf-8"))
+            else:
+                idx = self.build()
+            yield idx
+            if self.prune:
+                self.prune(idx)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(idx, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, self.path)
+            self._data, self._stamp = idx, self._disk_stamp()
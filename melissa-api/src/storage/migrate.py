@@ -0,0 +1,65 @@
+"""
+Разовый перенос storage_data (JSON-файлы) в SQLite:
+    python -m src.storage.migrate [путь к .db]
+Повторный запуск безопасен: уже перенесённые записи пропускаются (INSERT OR IGNORE).
+Файлы артефактов остаются на месте — SQLite-бэкенд читает их из того же ART_DIR.
+"""
+import json
+import pathlib
+import sys
+
+from .fsrepo import STRAT_DIR
+from .devrepo import DEV_DIR, GRANTS_DIR
+from .sqlrepo import DB_PATH, connect, init_schema
+from .versions import version_index
+
+def _docs(d: pathlib.Path):
+    for f in sorted(d.glob("*.json")):
+        yield f, json.loads(f.read_text(encoding="utf-8"))
+
+def migrate(db_path: pathlib.Path = DB_PATH) -> dict:
+    db = connect(db_path)
+    init_schema(db)
+    n = {"strategies": 0, "versions": 0, "devices": 0, "grants": 0}
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for _, s in _docs(STRAT_DIR):
+            cur = db.execute(
+                "INSERT OR IGNORE INTO strategies (id, user_id, name, draft, created_at, updated_at, version_index)"
+                " VALUES (?,?,?,?,?,?,?)",
+                (s["id"], s["user_id"], s["name"],
+                 json.dumps(s["draft"], ensure_ascii=False) if s.get("draft") is not None else None,
+                 s["created_at"], s["updated_at"],
+                 json.dumps(s.get("version_index") or version_index(s.get("versions", [])))))
+            n["strategies"] += cur.rowcount
+            for v in s.get("versions", []):
+                cur = db.execute(
+                    "INSERT OR IGNORE INTO versions (strategy_id, semver, sha256, etag, created_at, blob) VALUES (?,?,?,?,?,?)",
+                    (s["id"], v["semver"], v["sha256"], v["etag"], v["created_at"], v.get("blob")))
+                n["versions"] += cur.rowcount
+        for _, d in _docs(DEV_DIR):
+            cur = db.execute(
+                "INSERT OR IGNORE INTO devices (device_id, user_id, name, status, user_code, user_code_expires_at,"
+                " device_token, created_at, updated_at, verification_uri) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                (d["device_id"], d.get("user_id"), d.get("name"), d["status"], d.get("user_code"),
+                 d.get("user_code_expires_at"), d.get("device_token"), d["created_at"], d["updated_at"],
+                 d.get("verification_uri")))
+            n["devices"] += cur.rowcount
+            db.executemany("INSERT OR IGNORE INTO device_tags (tag, device_id) VALUES (?,?)",
+                           [(t, d["device_id"]) for t in d.get("tags", [])])
+        for f, grants in _docs(GRANTS_DIR):
+            for g in grants:
+                cur = db.execute(
+                    "INSERT OR IGNORE INTO grants (device_id, strategy_id, allow_latest, pinned_semver) VALUES (?,?,?,?)",
+                    (f.stem, g["strategy_id"], int(bool(g["allow_latest"])), g.get("pinned_semver")))
+                n["grants"] += cur.rowcount
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+    db.close()
+    return n
+
+if __name__ == "__main__":
+    path = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else DB_PATH
+    print(f"migrated into {path}:", migrate(path))
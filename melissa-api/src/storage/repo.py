@@ -0,0 +1,36 @@
+"""
+Хранилище API: один набор функций, бэкенд выбирается переменной API_STORAGE.
+  fs      — JSON-файлы в storage_data (по умолчанию, для разработки; индексы — JsonIndex,
+            их запись O(числа устройств), см. storage/jsonindex.py);
+  sqlite  — storage/sqlrepo.py (WAL, индексы, транзакционные publish/grant).
+Перенос существующих данных: python -m src.storage.migrate
+Сборка мусора в блобах артефактов: python -m src.storage.gc
+Для async-хендлеров — те же функции с выносом в потоки: storage/aio.py
+"""
+import os
+from .fsrepo import (
+    blob_signature, gc_blobs, patch_entry, prepare_patches, cached_artifact_entry, cached_patch_entry,
+)
+
+BACKEND = (os.getenv("API_STORAGE") or "fs").lower()
+
+if BACKEND == "sqlite":
+    from .sqlrepo import (
+        create_strategy, list_strategies, list_strategies_page, get_strategy, save_strategy, list_versions,
+        update_draft, save_artifact, read_artifact, load_artifact_rel, artifact_entry, artifact_bytes, blob_refs,
+        register_device, activate_device_by_code, poll_device, device_by_token, revoke_device,
+        list_grants, save_grants, grant_strategy, grant_many, revoke_grants, devices_for_strategy, device_changes,
+        listing_rev, set_device_tags, devices_by_tag,
+    )
+elif BACKEND == "fs":
+    from .fsrepo import (
+        create_strategy, list_strategies, list_strategies_page, get_strategy, save_strategy, list_versions,
+        update_draft, save_artifact, read_artifact, load_artifact_rel, artifact_entry, artifact_bytes, blob_refs,
+    )
+    from .devrepo import (
+        register_device, activate_device_by_code, poll_device, device_by_token, revoke_device,
+        list_grants, save_grants, grant_strategy, grant_many, revoke_grants, devices_for_strategy, device_changes,
+        listing_rev, set_device_tags, devices_by_tag,
+    )
+else:
+    raise RuntimeError(f"Unknown API_STORAGE={BACKEND!r} (expected fs or sqlite)")
@@ -0,0 +1,32 @@
+"""
+Счётчик изменений для дельта-синка устройств (fs-бэкенд).
+
+revs.json: {"rev": N, "strategies": {sid: rev последней публикации}, "resets": {device_id: rev},
+            "devices": {device_id: rev последней правки грантов или отзыва}}
+Каждая публикация и правка гранта берёт следующий rev под блокировкой индекса и помечает им
+запись; курсор устройства — rev, до которого оно уже синхронизировано. "resets" — полная
+замена списка грантов (удаления дельтой не выразить): курсор старше — отдаём список целиком.
+По "devices" и "strategies" проверяется закешированный список стратегий устройства (listing_rev).
+"""
+import os
+import pathlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+from .jsonindex import JsonIndex
+
+# корень данных хранилища (все бэкенды); API_DATA_DIR — другой каталог (тесты, несколько копий API)
+ROOT = pathlib.Path(os.getenv("API_DATA_DIR") or pathlib.Path(__file__).resolve().parents[2] / "storage_data")
+REVS_PATH = ROOT / "revs.json"
+
+_revs = JsonIndex(REVS_PATH, build=lambda: {"rev": 0, "strategies": {}, "resets": {}, "devices": {}})
+
+@contextmanager
+def next_rev() -> Iterator[Tuple[Dict[str, Any], int]]:
+    """with next_rev() as (revs, rev): ... — запись делается внутри, пока держим блокировку."""
+    with _revs.update() as revs:
+        revs["rev"] += 1
+        yield revs, revs["rev"]
+
+def snapshot() -> Dict[str, Any]:
+    return _revs.read()
@@ -0,0 +1,445 @@
+"""
+SQLite-бэкенд (WAL) для стратегий, устройств и грантов — те же функции, что fsrepo/devrepo.
+
+Метаданные — в одной базе с индексами по user_id, device_token, user_code и
+(strategy_id, semver); файлы артефактов по-прежнему лежат в ART_DIR (их отдаёт GET /v1/artifacts).
+Запись — в транзакциях BEGIN IMMEDIATE: публикация одной версии из двух запросов/воркеров
+не проходит дважды, грант не теряется при одновременной правке.
+Соединение — своё на поток (sync-хендлеры FastAPI крутятся в threadpool).
+"""
+import json, os, pathlib, secrets, sqlite3, threading, time, uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from fastapi import HTTPException
+from .safe import validate_uuid, validate_semver
+from .versions import index_add, version_index
+from collections import Counter
+from .fsrepo import ROOT, link_artifact, artifact_entry, artifact_bytes, read_artifact, load_artifact_rel
+
+DB_PATH = pathlib.Path(os.getenv("API_SQLITE_PATH") or ROOT / "melissa.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strategies (
+    id          TEXT PRIMARY KEY,
+    user_id     TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    draft       TEXT,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS strategies_user ON strategies(user_id);
+CREATE INDEX IF NOT EXISTS strategies_user_created ON strategies(user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS versions (
+    strategy_id TEXT NOT NULL REFERENCES strategies(id),
+    semver      TEXT NOT NULL,
+    sha256      TEXT NOT NULL,
+    etag        TEXT NOT NULL,
+    created_at  INTEGER NOT NULL,
+    rev         INTEGER NOT NULL DEFAULT 0,
+    blob        TEXT,
+    PRIMARY KEY (strategy_id, semver)
+);
+
+CREATE TABLE IF NOT EXISTS devices (
+    device_id            TEXT PRIMARY KEY,
+    user_id              TEXT,
+    name                 TEXT,
+    status               TEXT NOT NULL,
+    user_code            TEXT UNIQUE,
+    user_code_expires_at INTEGER,
+    device_token         TEXT UNIQUE,
+    created_at           TEXT NOT NULL,
+    updated_at           TEXT NOT NULL,
+    verification_uri     TEXT,
+    grants_reset_rev     INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS devices_user ON devices(user_id);
+
+CREATE TABLE IF NOT EXISTS grants (
+    device_id     TEXT NOT NULL,
+    strategy_id   TEXT NOT NULL,
+    allow_latest  INTEGER NOT NULL,
+    pinned_semver TEXT,
+    rev           INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, strategy_id)
+);
+CREATE INDEX IF NOT EXISTS grants_strategy ON grants(strategy_id);
+
+-- метки устройств для массовой выдачи грантов
+CREATE TABLE IF NOT EXISTS device_tags (
+    tag       TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    PRIMARY KEY (tag, device_id)
+);
+CREATE INDEX IF NOT EXISTS device_tags_device ON device_tags(device_id);
+
+-- счётчик изменений для дельта-синка: публикация и правка гранта берут следующий rev
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+_ADDED_COLUMNS = [
+    ("versions", "rev", "INTEGER NOT NULL DEFAULT 0"),
+    ("grants", "rev", "INTEGER NOT NULL DEFAULT 0"),
+    ("devices", "grants_reset_rev", "INTEGER NOT NULL DEFAULT 0"),
+    ("versions", "blob", "TEXT"),
+    ("devices", "rev", "INTEGER NOT NULL DEFAULT 0"),
+    ("strategies", "version_index", "TEXT"),  # JSON src/storage/versions.py, пишется при публикации
+]
+
+def init_schema(db: sqlite3.Connection) -> None:
+    db.executescript(SCHEMA)
+    for table, col, decl in _ADDED_COLUMNS:
+        if col not in {r[1] for r in db.execute(f"PRAGMA table_info({table})")}:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_ready = False
+
+def _now_iso():
+    import datetime as dt
+    return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+
+def connect(path: pathlib.Path = DB_PATH) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path, isolation_level=None, timeout=5.0)  # транзакции — явные
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA foreign_keys=ON")
+    return db
+
+def _db() -> sqlite3.Connection:
+    global _ready
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = _local.db = connect()
+        if not _ready:
+            with _init_lock:
+                if not _ready:
+                    init_schema(db)
+                    _ready = True
+    return db
+
+@contextmanager
+def _tx() -> Iterator[sqlite3.Connection]:
+    db = _db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+def _next_rev(db: sqlite3.Connection) -> int:
+    db.execute("INSERT INTO counters (name, value) VALUES ('rev', 1) "
+               "ON CONFLICT(name) DO UPDATE SET value = value + 1")
+    return db.execute("SELECT value FROM counters WHERE name = 'rev'").fetchone()[0]
+
+# --- стратегии -----------------------------------------------------------------------
+
+def _versions(db: sqlite3.Connection, sids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    out: Dict[str, List[Dict[str, Any]]] = {sid: [] for sid in sids}
+    if not sids:
+        return out
+    q = ",".join("?" * len(sids))
+    rows = db.execute(
+        f"SELECT strategy_id, semver, sha256, etag, created_at FROM versions "
+        f"WHERE strategy_id IN ({q}) ORDER BY created_at, rowid", sids)
+    for r in rows:
+        out[r["strategy_id"]].append(
+            {"semver": r["semver"], "sha256": r["sha256"], "etag": r["etag"], "created_at": r["created_at"]})
+    return out
+
+def _strategy_doc(r: sqlite3.Row, versions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = {
+        "id": r["id"],
+        "user_id": r["user_id"],
+        "name": r["name"],
+        "draft": json.loads(r["draft"]) if r["draft"] else None,
+        "versions": versions,
+        "created_at": r["created_at"],
+        "updated_at": r["updated_at"],
+    }
+    if r["version_index"]:
+        doc["version_index"] = json.loads(r["version_index"])
+    return doc
+
+def create_strategy(user_id: str, name: str) -> Dict[str, Any]:
+    sid = str(uuid.uuid4())
+    now = _now_iso()
+    with _tx() as db:
+        db.execute("INSERT INTO strategies (id, user_id, name, draft, created_at, updated_at) VALUES (?,?,?,?,?,?)",
+                   (sid, user_id, name, None, now, now))
+    return {"id": sid, "user_id": user_id, "name": name, "draft": None, "versions": [],
+            "created_at": now, "updated_at": now}
+
+def list_strategies(user_id: str) -> list[Dict[str, Any]]:
+    return list_strategies_page(user_id)[0]
+
+def list_strategies_page(user_id: str, limit: int | None = None,
+                         cursor: str | None = None) -> tuple[list[Dict[str, Any]], str | None]:
+    """
+    Страница стратегий пользователя в порядке создания и курсор следующей (None — это последняя).
+    Курсор "<created_at>~<rowid>" последней строки: страница — диапазон индекса (user_id, created_at).
+    """
+    after = ("", 0)
+    if cursor:
+        created, _, rid = cursor.rpartition("~")
+        if not created or not rid.isdigit():
+            raise HTTPException(422, "Invalid cursor")
+        after = (created, int(rid))
+    db = _db()
+    rows = db.execute(
+        "SELECT rowid AS rid, * FROM strategies WHERE user_id = ? AND (created_at, rowid) > (?, ?) "
+        "ORDER BY created_at, rowid LIMIT ?", (user_id, *after, -1 if limit is None else limit + 1)).fetchall()
+    more = limit is not None and len(rows) > limit
+    rows = rows[:limit] if more else rows
+    vers = _versions(db, [r["id"] for r in rows])
+    nxt = f"{rows[-1]['created_at']}~{rows[-1]['rid']}" if more else None
+    return [_strategy_doc(r, vers[r["id"]]) for r in rows], nxt
+
+def get_strategy(strategy_id: str) -> Optional[Dict[str, Any]]:
+    validate_uuid(strategy_id, "strategy_id")
+    db = _db()
+    r = db.execute("SELECT * FROM strategies WHERE id = ?", (strategy_id,)).fetchone()
+    if not r:
+        return None
+    return _strategy_doc(r, _versions(db, [strategy_id])[strategy_id])
+
+def save_strategy(doc: Dict[str, Any]) -> None:
+    validate_uuid(doc["id"], "strategy_id")
+    with _tx() as db:
+        db.execute(
+            "INSERT INTO strategies (id, user_id, name, draft, created_at, updated_at) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET name=excluded.name, draft=excluded.draft, updated_at=excluded.updated_at",
+            (doc["id"], doc["user_id"], doc["name"],
+             json.dumps(doc["draft"], ensure_ascii=False) if doc.get("draft") is not None else None,
+             doc.get("created_at") or _now_iso(), doc.get("updated_at") or _now_iso()))
+
+def list_versions(strategy_id: str) -> List[Dict[str, Any]]:
+    validate_uuid(strategy_id, "strategy_id")
+    return _versions(_db(), [strategy_id])[strategy_id]
+
+def update_draft(sid: str, draft: Dict[str, Any]) -> Dict[str, Any]:
+    validate_uuid(sid, "strategy_id")
+    with _tx() as db:
+        cur = db.execute("UPDATE strategies SET draft = ?, updated_at = ? WHERE id = ?",
+                         (json.dumps(draft, ensure_ascii=False), _now_iso(), sid))
+        if cur.rowcount == 0:
+            raise FileNotFoundError("strategy not found")
+    return get_strategy(sid)
+
+def save_artifact(strategy_id: str, semver: str, bundle: Dict[str, Any], key_id: str | None = None) -> Dict[str, Any]:
+    validate_uuid(strategy_id, "strategy_id")
+    validate_semver(semver)
+    with _tx() as db:
+        if db.execute("SELECT 1 FROM versions WHERE strategy_id = ? AND semver = ?", (strategy_id, semver)).fetchone():
+            # строка версии уже есть — указатель существующей версии не трогаем
+            return {"already_exists": True}
+        # блоб пишется внутри транзакции: не записался — строки версии тоже не будет;
+        # упала вставка — блоб без ссылок подберёт GC
+        blob = link_artifact(strategy_id, semver, bundle, key_id)
+        r = db.execute("SELECT version_index FROM strategies WHERE id = ?", (strategy_id,)).fetchone()
+        idx = json.loads(r[0]) if r and r[0] else version_index(_versions(db, [strategy_id])[strategy_id])
+        db.execute("UPDATE strategies SET version_index = ? WHERE id = ?",
+                   (json.dumps(index_add(idx, semver)), strategy_id))
+        db.execute("INSERT INTO versions (strategy_id, semver, sha256, etag, created_at, rev, blob) VALUES (?,?,?,?,?,?,?)",
+                   (strategy_id, semver, blob["sha256"], blob["etag"], int(time.time()), _next_rev(db), blob["blob"]))
+    return dict(blob, already_exists=False)
+
+def blob_refs() -> Counter:
+    rows = _db().execute("SELECT blob, COUNT(*) FROM versions WHERE blob IS NOT NULL GROUP BY blob")
+    return Counter({r[0]: r[1] for r in rows})
+
+# --- устройства ----------------------------------------------------------------------
+
+def _device_doc(r: sqlite3.Row) -> Dict[str, Any]:
+    return {k: r[k] for k in r.keys()}
+
+def register_device(verification_uri: str = "http://localhost:8000/link") -> Dict[str, Any]:
+    device_id = str(uuid.uuid4())
+    user_code = f"{secrets.token_hex(2)}-{secrets.token_hex(2)}".upper()  # абы какой формат ABCD-1234
+    expires = int(time.time()) + 10 * 60
+    now = _now_iso()
+    with _tx() as db:
+        # просроченные коды освобождаем, чтобы UNIQUE(user_code) не мешал выдать тот же код снова
+        db.execute("UPDATE devices SET user_code = NULL, user_code_expires_at = NULL "
+                   "WHERE user_code = ? AND user_code_expires_at < ?", (user_code, int(time.time())))
+        db.execute(
+            "INSERT INTO devices (device_id, user_id, name, status, user_code, user_code_expires_at, device_token,"
+            " created_at, updated_at, verification_uri) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (device_id, None, None, "pending", user_code, expires, None, now, now, verification_uri))
+    return {"device_id": device_id, "user_code": user_code, "verification_uri": verification_uri, "expires_in": 600}
+
+def activate_device_by_code(user_code: str, user_id: str) -> Optional[str]:
+    with _tx() as db:
+        r = db.execute("SELECT device_id, user_code_expires_at FROM devices WHERE user_code = ?",
+                       (user_code,)).fetchone()
+        if not r or (r["user_code_expires_at"] or 0) < int(time.time()):
+            return None
+        db.execute(
+            "UPDATE devices SET user_id = ?, status = 'active', user_code = NULL, user_code_expires_at = NULL,"
+            " device_token = ?, updated_at = ? WHERE device_id = ?",
+            (user_id, secrets.token_urlsafe(32), _now_iso(), r["device_id"]))
+        return r["device_id"]
+
+def poll_device(device_id: str) -> Dict[str, Any]:
+    validate_uuid(device_id, "device_id")
+    r = _db().execute("SELECT status, device_token FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+    if not r:
+        return {"error": "unknown_device"}
+    if r["status"] != "active" or not r["device_token"]:
+        return {"pending": True}
+    return {"device_token": r["device_token"]}
+
+def device_by_token(device_token: str) -> Optional[Dict[str, Any]]:
+    r = _db().execute("SELECT * FROM devices WHERE device_token = ? AND status = 'active'",
+                      (device_token,)).fetchone()
+    return _device_doc(r) if r else None
+
+def revoke_device(device_id: str) -> bool:
+    validate_uuid(device_id, "device_id")
+    with _tx() as db:
+        cur = db.execute(
+            "UPDATE devices SET status = 'revoked', device_token = NULL, user_code = NULL,"
+            " user_code_expires_at = NULL, updated_at = ?, rev = ? WHERE device_id = ?",
+            (_now_iso(), _next_rev(db), device_id))
+        return cur.rowcount > 0
+
+def set_device_tags(device_id: str, tags: List[str]) -> Optional[List[str]]:
+    """Метки устройства (для массовой выдачи грантов); None — устройства нет."""
+    validate_uuid(device_id, "device_id")
+    with _tx() as db:
+        if not db.execute("SELECT 1 FROM devices WHERE device_id = ?", (device_id,)).fetchone():
+            return None
+        db.execute("DELETE FROM device_tags WHERE device_id = ?", (device_id,))
+        db.executemany("INSERT INTO device_tags (tag, device_id) VALUES (?,?)", [(t, device_id) for t in tags])
+    return tags
+
+def devices_by_tag(tag: str) -> List[str]:
+    return [r[0] for r in _db().execute("SELECT device_id FROM device_tags WHERE tag = ? ORDER BY rowid", (tag,))]
+
+def _grants(db: sqlite3.Connection, device_id: str) -> List[Dict[str, Any]]:
+    rows = db.execute("SELECT strategy_id, allow_latest, pinned_semver FROM grants WHERE device_id = ? ORDER BY rowid",
+                      (device_id,))
+    return [{"strategy_id": r["strategy_id"], "allow_latest": bool(r["allow_latest"]),
+             "pinned_semver": r["pinned_semver"]} for r in rows]
+
+def list_grants(device_id: str) -> List[Dict[str, Any]]:
+    validate_uuid(device_id, "device_id")
+    return _grants(_db(), device_id)
+
+def save_grants(device_id: str, grants: List[Dict[str, Any]]) -> None:
+    validate_uuid(device_id, "device_id")
+    with _tx() as db:
+        rev = _next_rev(db)
+        db.execute("DELETE FROM grants WHERE device_id = ?", (device_id,))
+        db.executemany(
+            "INSERT INTO grants (device_id, strategy_id, allow_latest, pinned_semver, rev) VALUES (?,?,?,?,?)",
+            [(device_id, g["strategy_id"], int(bool(g["allow_latest"])), g.get("pinned_semver"), rev) for g in grants])
+        # полная замена списка: устройство с курсором старше получит список целиком
+        db.execute("UPDATE devices SET grants_reset_rev = ?, rev = ? WHERE device_id = ?", (rev, rev, device_id))
+
+def grant_strategy(device_id: str, strategy_id: str, allow_latest: bool, pinned_semver: str | None = None) -> List[Dict[str, Any]]:
+    validate_uuid(device_id, "device_id")
+    with _tx() as db:
+        rev = _next_rev(db)
+        db.execute(
+            "INSERT INTO grants (device_id, strategy_id, allow_latest, pinned_semver, rev) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(device_id, strategy_id) DO UPDATE SET "
+            "allow_latest = excluded.allow_latest, pinned_semver = excluded.pinned_semver, rev = excluded.rev",
+            (device_id, strategy_id, int(bool(allow_latest)), pinned_semver, rev))
+        db.execute("UPDATE devices SET rev = ? WHERE device_id = ?", (rev, device_id))
+        return _grants(db, device_id)
+
+def listing_rev(device_id: str, strategy_ids: List[str] | None = None) -> int:
+    """
+    Версия списка стратегий устройства: rev последней правки его грантов/отзыва или публикации
+    в одной из strategy_ids (None — стратегии текущих грантов). Не изменилась — список тот же.
+    """
+    validate_uuid(device_id, "device_id")
+    db = _db()
+    if strategy_ids is None:
+        pub = db.execute("SELECT MAX(v.rev) FROM grants g JOIN versions v ON v.strategy_id = g.strategy_id "
+                         "WHERE g.device_id = ?", (device_id,)).fetchone()[0]
+    else:
+        marks = ",".join("?" * len(strategy_ids))
+        pub = db.execute(f"SELECT MAX(rev) FROM versions WHERE strategy_id IN ({marks})",
+                         strategy_ids).fetchone()[0] if strategy_ids else None
+    d = db.execute("SELECT rev FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+    return max(d[0] if d else 0, pub or 0)
+
+def grant_many(device_ids: List[str], strategy_id: str, allow_latest: bool,
+               pinned_semver: str | None = None) -> List[str]:
+    """
+    Один грант многим устройствам — одна транзакция и один rev на всех. Несуществующие
+    устройства пропускаются; возвращает тех, кому грант выдан.
+    """
+    for device_id in device_ids:
+        validate_uuid(device_id, "device_id")
+    with _tx() as db:
+        device_ids = [d for d in device_ids
+                      if db.execute("SELECT 1 FROM devices WHERE device_id = ?", (d,)).fetchone()]
+        if not device_ids:
+            return []
+        rev = _next_rev(db)
+        db.executemany(
+            "INSERT INTO grants (device_id, strategy_id, allow_latest, pinned_semver, rev) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(device_id, strategy_id) DO UPDATE SET "
+            "allow_latest = excluded.allow_latest, pinned_semver = excluded.pinned_semver, rev = excluded.rev",
+            [(d, strategy_id, int(bool(allow_latest)), pinned_semver, rev) for d in device_ids])
+        db.executemany("UPDATE devices SET rev = ? WHERE device_id = ?", [(rev, d) for d in device_ids])
+    return list(device_ids)
+
+def revoke_grants(device_ids: List[str], strategy_id: str) -> List[str]:
+    """Снять грант стратегии с устройств одной транзакцией; возвращает тех, у кого он был."""
+    for device_id in device_ids:
+        validate_uuid(device_id, "device_id")
+    out = []
+    with _tx() as db:
+        rev = _next_rev(db)
+        for device_id in device_ids:
+            cur = db.execute("DELETE FROM grants WHERE device_id = ? AND strategy_id = ?", (device_id, strategy_id))
+            if cur.rowcount:
+                out.append(device_id)
+        # удаление дельтой не выразить: устройство с курсором старше получит список целиком
+        db.executemany("UPDATE devices SET grants_reset_rev = ?, rev = ? WHERE device_id = ?",
+                       [(rev, rev, d) for d in out])
+    return out
+
+def devices_for_strategy(strategy_id: str) -> List[str]:
+    rows = _db().execute("SELECT device_id FROM grants WHERE strategy_id = ?", (strategy_id,))
+    return [r["device_id"] for r in rows]
+
+def device_changes(device_id: str, cursor: int) -> Dict[str, Any]:
+    """
+    Гранты устройства, изменившиеся после `cursor` (свой rev или новая версия стратегии), и новый курсор.
+    full=True — курсора нет/устарел: в grants весь список. Всё — из одного снимка базы.
+    """
+    validate_uuid(device_id, "device_id")
+    db = _db()
+    db.execute("BEGIN")
+    try:
+        r = db.execute("SELECT value FROM counters WHERE name = 'rev'").fetchone()
+        cur = r[0] if r else 0
+        d = db.execute("SELECT grants_reset_rev FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+        full = cursor <= 0 or cursor > cur or (d is not None and d[0] > cursor)
+        if full:
+            grants = _grants(db, device_id)
+        else:
+            rows = db.execute(
+                "SELECT strategy_id, allow_latest, pinned_semver FROM grants g WHERE device_id = ? AND (rev > ? OR "
+                "EXISTS (SELECT 1 FROM versions v WHERE v.strategy_id = g.strategy_id AND v.rev > ?)) ORDER BY rowid",
+                (device_id, cursor, cursor))
+            grants = [{"strategy_id": r["strategy_id"], "allow_latest": bool(r["allow_latest"]),
+                       "pinned_semver": r["pinned_semver"]} for r in rows]
+    finally:
+        db.execute("COMMIT")
+    return {"cursor": cur, "full": full, "grants": grants}
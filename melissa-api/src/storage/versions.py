@@ -0,0 +1,42 @@
+"""
+Индекс версий стратегии: {"semvers": [...по возрастанию semver], "latest", "latest_stable"}.
+latest — последняя опубликованная (как и раньше выбирал /strategies устройства: по created_at),
+latest_stable — старшая по semver без pre-release. Пересчитывается при публикации, а не на каждый запрос.
+"""
+import bisect
+from typing import Any, Dict, List, Optional
+
+EMPTY = {"semvers": [], "latest": None, "latest_stable": None}
+
+def semver_key(v: str) -> tuple:
+    # порядок SemVer 2.0: pre-release младше релиза, числовые поля pre-release — числами, build не учитывается
+    core, _, pre = v.split("+", 1)[0].partition("-")
+    key = tuple(int(x) for x in core.split("."))
+    if not pre:
+        return key + ((1,),)
+    return key + ((0, *((0, int(p), "") if p.isdigit() else (1, 0, p) for p in pre.split("."))),)
+
+def is_stable(v: str) -> bool:
+    return "-" not in v.split("+", 1)[0]
+
+def index_add(idx: Optional[Dict[str, Any]], semver: str) -> Dict[str, Any]:
+    """Индекс после публикации semver (idx=None — пустой)."""
+    idx = idx or EMPTY
+    semvers = list(idx["semvers"])
+    bisect.insort(semvers, semver, key=semver_key)
+    stable = idx["latest_stable"]
+    if is_stable(semver) and (stable is None or semver_key(semver) > semver_key(stable)):
+        stable = semver
+    return {"semvers": semvers, "latest": semver, "latest_stable": stable}
+
+def version_index(versions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Индекс по списку версий (для стратегий, опубликованных до индекса)."""
+    idx = None
+    # при равном created_at latest — позже добавленная
+    for v in sorted(versions, key=lambda v: v["created_at"]):
+        idx = index_add(idx, v["semver"])
+    return idx or dict(EMPTY)
+
+def strategy_index(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Индекс версий документа стратегии: сохранённый при публикации или посчитанный по versions."""
+    return doc.get("version_index") or version_index(doc.get("versions", []))
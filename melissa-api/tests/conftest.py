@@ -0,0 +1,66 @@
+import atexit
+import base64
+import copy
+import os
+import shutil
+import tempfile
+
+import pytest
+from nacl.signing import SigningKey
+
+# хранилище и ключ — до импорта src: модули читают окружение при импорте
+os.environ["API_DATA_DIR"] = tempfile.mkdtemp(prefix="melissa-api-test-")
+atexit.register(shutil.rmtree, os.environ["API_DATA_DIR"], True)
+os.environ["API_ED25519_PRIVKEY_B64"] = base64.b64encode(bytes(SigningKey.generate())).decode()
+os.environ["API_ADMIN_TOKEN"] = "adm"
+os.environ.setdefault("API_STORAGE", "fs")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src.main import app  # noqa: E402
+
+ADMIN = {"X-Admin-Token": "adm"}
+
+DRAFT = {
+    "manifest": {
+        "strategy_id": "x", "name": "demo", "version": "1.0.0", "engine_min": "0.1.0",
+        "created_at": "2025-01-01T00:00:00Z", "permissions": {"place_orders": False},
+        "assets": [{"symbol": "BTCUSDT", "tf": ["1m"]}],
+    },
+    "indicators": {
+        "nodes": [
+            {"id": "ef", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 12}},
+            {"id": "es", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 26}},
+        ],
+        "outputs": {},
+    },
+    "rules": {
+        "entries": [{"id": "L", "side": "LONG", "expr": {"cross_up": ["ef", "es"]}}],
+        "exits": [{"id": "XL", "side": "LONG", "expr": {"cross_down": ["ef", "es"]}}],
+    },
+    "orders": {
+        "position_sizing": {"mode": "fixed_usdt", "value": 100, "leverage": 1, "max_concurrent": 1, "side": "long"},
+        "sl": {"type": "pct", "value": 1.5},
+        "order_policy": {"post_only": False, "time_in_force": "GTC", "reduce_on_inverse_signal": True,
+                         "one_signal_per_bar": True},
+    },
+}
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(app)
+
+@pytest.fixture
+def publish(client):
+    """publish(["1.0.0", ...], period=12) -> strategy_id: новая стратегия с опубликованными версиями."""
+    def run(semvers, sid=None, period=12):
+        if sid is None:
+            sid = client.post("/v1/strategies/", json={"name": "t"}).json()["id"]
+        for i, semver in enumerate(semvers):
+            draft = copy.deepcopy(DRAFT)
+            draft["indicators"]["nodes"][0]["params"]["period"] = period + i
+            assert client.put(f"/v1/strategies/{sid}/draft", json=draft).status_code == 200
+            r = client.post(f"/v1/strategies/{sid}/publish", json={"semver": semver})
+            assert r.status_code == 200, r.text
+        return sid
+    return run
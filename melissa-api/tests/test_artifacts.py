@@ -0,0 +1,63 @@
+import gzip
+import hashlib
+import json
+
+import pytest
+
+def _frames(body: bytes):
+    # кадр: строка-заголовок JSON, затем ровно header["size"] байт тела; последний — {"end": true}
+    out, pos = [], 0
+    while True:
+        nl = body.index(b"\n", pos)
+        header = json.loads(body[pos:nl])
+        pos = nl + 1
+        if header.get("end"):
+            assert pos == len(body)
+            return out, header
+        n = header.get("size", 0) if header.get("status") == 200 else 0
+        out.append((header, body[pos:pos + n]))
+        pos += n
+
+def _sha(b: bytes) -> str:
+    return hashlib.sha256(b).hexdigest()
+
+@pytest.mark.parametrize("fmt, accept", [("json", "application/json"), ("mlb", "application/vnd.melissa.bundle")])
+def test_batch_frames_round_trip(client, publish, fmt, accept):
+    a, b = publish(["1.0.0"]), publish(["2.0.0"], period=20)
+    missing = "00000000-0000-4000-8000-000000000001"
+    items = [{"strategy_id": a, "semver": "1.0.0"}, {"strategy_id": missing, "semver": "1.0.0"},
+             {"strategy_id": b, "semver": "2.0.0"}]
+    r = client.post("/v1/artifacts/batch", json={"items": items, "encodings": ["gzip"], "format": fmt})
+    assert r.status_code == 200
+    frames, end = _frames(r.content)
+    assert end["count"] == 2
+    assert [(h["strategy_id"], h["status"]) for h, _ in frames] == [(a, 200), (missing, 404), (b, 200)]
+    for h, body in frames:
+        if h["status"] != 200:
+            continue
+        single = client.get(f"/v1/artifacts/{h['strategy_id']}/{h['semver']}", headers={"Accept": accept,
+                                                                                          "Accept-Encoding": "identity"})
+        raw = gzip.decompress(body) if h["encoding"] == "gzip" else body
+        assert _sha(raw) == _sha(single.content)
+        assert h["etag"] == single.headers["etag"]
+
+def test_batch_skips_unchanged_etag(client, publish):
+    sid = publish(["1.0.0"])
+    etag = client.get(f"/v1/artifacts/{sid}/1.0.0").headers["etag"]
+    r = client.post("/v1/artifacts/batch", json={"items": [{"strategy_id": sid, "semver": "1.0.0", "etag": etag}]})
+    assert _frames(r.content) == ([], {"end": True, "count": 0})
+
+@pytest.mark.parametrize("item", [
+    "x",
+    {"strategy_id": 5, "semver": "1.0.0"},
+    {"strategy_id": "00000000-0000-4000-8000-000000000001", "semver": ["1.0.0"]},
+    {"strategy_id": "00000000-0000-4000-8000-000000000001", "semver": "1.0.0", "base": 1},
+    {"strategy_id": "00000000-0000-4000-8000-000000000001", "semver": "1.0.0", "etag": {}},
+])
+def test_batch_rejects_malformed_items(client, item):
+    r = client.post("/v1/artifacts/batch", json={"items": [item]})
+    assert r.status_code == 422
+
+def test_batch_rejects_malformed_encodings(client):
+    item = {"strategy_id": "00000000-0000-4000-8000-000000000001", "semver": "1.0.0"}
+    assert client.post("/v1/artifacts/batch", json={"items": [item], "encodings": "gzip"}).status_code == 422
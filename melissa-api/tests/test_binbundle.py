@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import json
+import os
+import struct
+
+import pytest
+from nacl.signing import SigningKey
+
+from src.services.binbundle import MAGIC, encode_bundle
+from src.services.signer import canonical_bytes
+
+def _decode(blob: bytes):
+    assert blob[:4] == MAGIC
+    (hlen,) = struct.unpack_from("<I", blob, 4)
+    header = json.loads(blob[8:8 + hlen])
+    return header, blob[8 + hlen:]
+
+def _verify(canon: bytes, sig_b64: str) -> None:
+    key = SigningKey(base64.b64decode(os.environ["API_ED25519_PRIVKEY_B64"])).verify_key
+    key.verify(canon, base64.b64decode(sig_b64))
+
+def test_mlb_matches_json_artifact(client, publish):
+    sid = publish(["1.0.0"])
+    bundle = client.get(f"/v1/artifacts/{sid}/1.0.0").json()
+    blob = client.get(f"/v1/artifacts/{sid}/1.0.0", headers={"Accept": "application/vnd.melissa.bundle"}).content
+    header, canon = _decode(blob)
+    payload = bundle["payload"]
+    # канонический блок — ровно подписанные байты JSON-артефакта
+    assert canon == canonical_bytes(payload)
+    assert header["hash"] == payload["manifest"]["hash"] == hashlib.sha256(canon).hexdigest()
+    assert header["signature_b64"] == bundle["signature_b64"]
+    _verify(canon, header["signature_b64"])
+    # каждая секция разбирается сама по себе и равна ключу payload
+    assert sorted(header["sections"]) == sorted(payload)
+    for name, (off, n) in header["sections"].items():
+        want = {k: v for k, v in payload[name].items() if k != "hash"} if name == "manifest" else payload[name]
+        assert json.loads(canon[off:off + n]) == want
+    assert encode_bundle(bundle) == blob
+
+def test_sections_exclude_manifest_hash():
+    payload = {"manifest": {"hash": "h", "name": "ü"}, "rules": {"a": 1}}
+    header, canon = _decode(encode_bundle({"payload": payload, "signature_b64": "s"}))
+    assert canon == canonical_bytes(payload) == '{"manifest":{"name":"ü"},"rules":{"a":1}}'.encode()
+    assert header["hash"] == "h"
+    off, n = header["sections"]["manifest"]
+    assert json.loads(canon[off:off + n]) == {"name": "ü"}
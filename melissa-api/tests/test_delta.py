@@ -0,0 +1,62 @@
+import hashlib
+import json
+import struct
+import time
+
+from src.services.delta import MAGIC, MEDIA_TYPE, make_patch
+from src.storage.fsrepo import PATCH_DIR
+
+MLB = "application/vnd.melissa.bundle"
+
+def _apply(base: bytes, patch: bytes) -> bytes:
+    # независимый разбор формата MLD1 (как у движка): заголовок, затем операции C/I
+    assert patch[:4] == MAGIC
+    (hlen,) = struct.unpack_from("<I", patch, 4)
+    header = json.loads(patch[8:8 + hlen])
+    assert hashlib.sha256(base).hexdigest() == header["base_sha256"]
+    out, pos = bytearray(), 8 + hlen
+    while pos < len(patch):
+        if patch[pos:pos + 1] == b"C":
+            off, n = struct.unpack_from("<II", patch, pos + 1)
+            out += base[off:off + n]
+            pos += 9
+        else:
+            (n,) = struct.unpack_from("<I", patch, pos + 1)
+            out += patch[pos + 5:pos + 5 + n]
+            pos += 5 + n
+    return bytes(out)
+
+def _sha(b: bytes) -> str:
+    return hashlib.sha256(b).hexdigest()
+
+def test_make_patch_round_trip():
+    base = bytes(range(256)) * 40
+    target = base[:3000] + b"changed" + base[3100:] + b"tail"
+    patch = make_patch(base, target)
+    assert len(patch) < len(target)
+    assert _sha(_apply(base, patch)) == _sha(target)
+
+def test_get_with_base_round_trip(client, publish):
+    sid = publish(["1.0.0", "1.1.0"])
+    get = lambda semver, **kw: client.get(f"/v1/artifacts/{sid}/{semver}",
+                                          headers={"Accept": MLB, "Accept-Encoding": "identity"}, **kw)
+    base, full = get("1.0.0").content, get("1.1.0")
+    r = get("1.1.0", params={"base": "1.0.0"})
+    assert r.status_code == 200
+    assert r.headers["X-Delta-Base"] == "1.0.0"
+    assert r.headers["Content-Type"].startswith(MEDIA_TYPE)
+    assert r.headers["ETag"] == full.headers["ETag"]
+    assert _sha(_apply(base, r.content)) == _sha(full.content)
+
+def test_publish_prepares_patches(client, publish):
+    # свои периоды: блобы общие по содержимому, патч для чужой пары мог уже появиться
+    sid = publish(["1.0.0"], period=40)
+    before = set(PATCH_DIR.glob("*/*.patch"))
+    publish(["1.1.0"], sid=sid, period=41)
+    # патчи строятся фоновым потоком publish — ждём их появления
+    for _ in range(100):
+        new = set(PATCH_DIR.glob("*/*.patch")) - before
+        if len(new) >= 2:
+            break
+        time.sleep(0.05)
+    assert len(new) == 2  # mlb и json
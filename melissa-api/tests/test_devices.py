@@ -0,0 +1,49 @@
+import pytest
+
+from src.routes import devices
+
+ADMIN = {"X-Admin-Token": "adm"}  # не из conftest: повторный импорт пересоздал бы ключ и каталог данных
+
+@pytest.fixture
+def device(client):
+    """(device_id, заголовки с токеном) активированного устройства."""
+    info = client.post("/v1/devices/register").json()
+    client.post("/v1/devices/activate", json={"user_code": info["user_code"]})
+    tok = client.post("/v1/devices/poll", json={"device_id": info["device_id"]}).json()["device_token"]
+    return info["device_id"], {"Authorization": f"Device {tok}"}
+
+def test_listing_304_without_storage(client, publish, device, monkeypatch):
+    did, auth = device
+    sid = publish(["1.0.0"])
+    assert client.post(f"/v1/devices/{did}/grants", json={"strategy_id": sid, "allow_latest": True},
+                       headers=ADMIN).status_code == 200
+    r = client.get(f"/v1/devices/{did}/strategies", headers=auth)
+    assert [it["strategy_id"] for it in r.json()] == [sid]
+    etag = r.headers["ETag"]
+
+    def no_storage(*a, **kw):
+        raise AssertionError("storage touched")
+    with monkeypatch.context() as m:
+        m.setattr(devices, "listing_rev", no_storage)
+        m.setattr(devices, "device_by_token", no_storage)
+        r = client.get(f"/v1/devices/{did}/strategies", headers={**auth, "If-None-Match": etag})
+        assert r.status_code == 304 and r.headers["ETag"] == etag
+
+    # новая версия — событие хаба: запись пересобирается, старый ETag не подходит
+    publish(["1.1.0"], sid=sid)
+    r = client.get(f"/v1/devices/{did}/strategies", headers={**auth, "If-None-Match": etag})
+    assert r.status_code == 200 and r.json()[0]["latest"] == "1.1.0"
+    # отзыв устройства — тоже событие: кешированный токен больше не принимается
+    assert client.post(f"/v1/devices/{did}/revoke", headers=ADMIN).status_code == 200
+    assert client.get(f"/v1/devices/{did}/strategies", headers=auth).status_code == 401
+
+def test_listing_rechecks_rev_after_interval(client, device, monkeypatch):
+    did, auth = device
+    etag = client.get(f"/v1/devices/{did}/strategies", headers=auth).headers["ETag"]
+    calls = []
+    real = devices.listing_rev
+    monkeypatch.setattr(devices, "listing_rev", lambda *a: calls.append(a) or real(*a))
+    # правку на другом воркере хаб не видит — rev сверяется не реже POLL_RECHECK
+    monkeypatch.setattr(devices, "POLL_RECHECK", 0)
+    r = client.get(f"/v1/devices/{did}/strategies", headers={**auth, "If-None-Match": etag})
+    assert r.status_code == 304 and len(calls) == 1
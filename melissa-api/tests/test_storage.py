@@ -0,0 +1,91 @@
+import hashlib
+import sqlite3
+from types import SimpleNamespace
+
+from src.storage import devrepo, fsrepo, sqlrepo
+from src.storage.migrate import migrate
+
+MISSING = "00000000-0000-4000-8000-00000000000f"
+
+def _bundle(tag: str) -> dict:
+    h = hashlib.sha256(tag.encode()).hexdigest()
+    return {"payload": {"manifest": {"name": tag, "hash": h}, "rules": {"tag": tag}}, "signature_b64": "c2ln"}
+
+def _grants(gs, sid):
+    return [(g["strategy_id"] == sid, bool(g["allow_latest"]), g.get("pinned_semver")) for g in gs]
+
+def _scenario(repo, tag: str) -> dict:
+    """Один и тот же сценарий; в ответе — только то, что не зависит от id и времени."""
+    s = repo.create_strategy("u_parity", f"s-{tag}")
+    sid = s["id"]
+    repo.update_draft(sid, {"manifest": {"name": tag}})
+    first = repo.save_artifact(sid, "1.0.0", _bundle(tag + "1"))
+    again = repo.save_artifact(sid, "1.0.0", _bundle(tag + "1"))
+    repo.save_artifact(sid, "1.1.0", _bundle(tag + "2"))
+    doc = repo.get_strategy(sid)
+
+    info = repo.register_device()
+    did = info["device_id"]
+    pending = repo.poll_device(did)
+    assert repo.activate_device_by_code(info["user_code"], "u_parity") == did
+    token = repo.poll_device(did)["device_token"]
+    rev0 = repo.listing_rev(did)
+    tags = repo.set_device_tags(did, [f"t-{tag}", "x"])
+    repo.grant_strategy(did, sid, True)
+    rev1 = repo.listing_rev(did)
+    changed = repo.grant_many([did, MISSING], sid, False, "1.0.0")
+    ch = repo.device_changes(did, 0)
+    return {
+        "draft": doc["draft"],
+        "versions": [v["semver"] for v in doc["versions"]],
+        "sha": [v["sha256"] for v in doc["versions"]] == [first["sha256"], repo.list_versions(sid)[1]["sha256"]],
+        "already_exists": (first["already_exists"], again["already_exists"]),
+        "artifact": repo.read_artifact(sid, "1.1.0")["payload"]["rules"],
+        "pending": pending,
+        "token_ok": repo.device_by_token(token)["device_id"] == did,
+        "tags": tags, "by_tag": repo.devices_by_tag(f"t-{tag}") == [did],
+        "rev_moved": rev1 > rev0,
+        "grant_many": changed == [did],
+        "grants": _grants(repo.list_grants(did), sid),
+        "holders": repo.devices_for_strategy(sid) == [did],
+        "changes": (ch["full"], _grants(ch["grants"], sid)),
+        "no_changes": repo.device_changes(did, ch["cursor"])["grants"],
+        "revoke_grants": repo.revoke_grants([did, MISSING], sid) == [did],
+        "after_revoke": repo.list_grants(did),
+        "revoked": repo.revoke_device(did), "token_after": repo.device_by_token(token),
+        "unknown": repo.poll_device(MISSING),
+    }
+
+def test_fs_sqlite_parity():
+    # fs — как его собирает storage/repo.py: стратегии из fsrepo, устройства и гранты из devrepo
+    fs = SimpleNamespace(**{k: getattr(m, k) for m in (fsrepo, devrepo) for k in dir(m) if not k.startswith("_")})
+    got = _scenario(fs, "p")
+    assert got == _scenario(sqlrepo, "p")
+    assert got["versions"] == ["1.0.0", "1.1.0"] and got["already_exists"] == (False, True)
+    assert got["grants"] == [(True, False, "1.0.0")] and got["after_revoke"] == []
+    assert got["revoked"] and got["token_after"] is None
+
+def test_migrate_matches_fs(tmp_path):
+    s = fsrepo.create_strategy("u_mig", "m")
+    fsrepo.save_artifact(s["id"], "1.0.0", _bundle("mig"))
+    info = devrepo.register_device()
+    did = info["device_id"]
+    devrepo.activate_device_by_code(info["user_code"], "u_mig")
+    devrepo.set_device_tags(did, ["mig"])
+    devrepo.grant_strategy(did, s["id"], False, "1.0.0")
+
+    db_path = tmp_path / "m.db"
+    n = migrate(db_path)
+    assert n["strategies"] >= 1 and n["devices"] >= 1 and n["grants"] >= 1
+    # повторный запуск ничего не дублирует
+    assert migrate(db_path) == {"strategies": 0, "versions": 0, "devices": 0, "grants": 0}
+
+    db = sqlite3.connect(db_path)
+    assert db.execute("SELECT semver, sha256, blob FROM versions WHERE strategy_id = ?", (s["id"],)).fetchall() == \
+        [(v["semver"], v["sha256"], v["blob"]) for v in fsrepo.get_strategy(s["id"])["versions"]]
+    dev = devrepo.device_by_token(devrepo.poll_device(did)["device_token"])
+    assert db.execute("SELECT status, device_token FROM devices WHERE device_id = ?", (did,)).fetchone() == \
+        (dev["status"], dev["device_token"])
+    assert db.execute("SELECT tag FROM device_tags WHERE device_id = ?", (did,)).fetchall() == [("mig",)]
+    assert db.execute("SELECT strategy_id, allow_latest, pinned_semver FROM grants WHERE device_id = ?",
+                      (did,)).fetchall() == [(s["id"], 0, "1.0.0")]
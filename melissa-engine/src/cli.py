@@ -4,10 +4,17 @@ import sys
 import time
 import json
 import yaml
-from src.runtime.loader import post_json, get_bytes
-from src.core.verify import verify_bundle
-from src.core.schema import validate_payload_parts
-from src.core.state import load_device, save_device, load_cache, save_cache, bundle_path
+from src.runtime.loader import post_json, make_client
+from src.runtime.sync import shutdown_pool, sync_once
+from src.runtime.daemon import Daemon
+from src.core.state import load_device, save_device, bundle_path, find_bundle
+from src.core.binbundle import load_bundle
+from src.data.bars import BarStore
+from src.data.importer import CHUNK_MB, import_file
+from src.runtime.backtest import Backtest, DEFAULT_BALANCE
+from src.runtime.sweep import grid, random_space, run_sweep
+
+POLL_WAIT = 30
 
 def _cfg():
     p = pathlib.Path(__file__).resolve().parents[1] / "melissa.yaml"
@@ -16,88 +23,191 @@ def _cfg():
 async def cmd_link():
     cfg = _cfg()
     base = cfg["api_base"].rstrip("/")
-    # 1) register
-    info = await post_json(f"{base}/v1/devices/register", {})
-    device_id = info["device_id"]
-    print("🔗 Device ID:", device_id)
-    print("➡️  Go to:", info["verification_uri"])
-    print("➡️  Enter user code:", info["user_code"])
-    # 2) poll loop
-    print("⏳ Waiting for activation...")
-    token = None
-    for _ in range(120):  # до 2 минут
-        await asyncio.sleep(1)
-        res = await post_json(f"{base}/v1/devices/poll", {"device_id": device_id})
-        if not res.get("pending"):
-            token = res.get("device_token")
-            break
+    async with make_client(max_connections=1, timeout=POLL_WAIT + 15) as client:
+        # 1) register
+        info = await post_json(f"{base}/v1/devices/register", {}, client=client)
+        device_id = info["device_id"]
+        print("🔗 Device ID:", device_id)
+        print("➡️  Go to:", info["verification_uri"])
+        print("➡️  Enter user code:", info["user_code"])
+        # 2) long-poll: сервер держит запрос до активации или POLL_WAIT секунд
+        print("⏳ Waiting for activation...")
+        token = None
+        deadline = time.monotonic() + 120  # до 2 минут
+        while time.monotonic() < deadline:
+            t0 = time.monotonic()
+            wait = max(1, min(POLL_WAIT, int(deadline - t0)))
+            res = await post_json(f"{base}/v1/devices/poll", {"device_id": device_id, "wait": wait}, client=client)
+            if not res.get("pending"):
+                token = res.get("device_token")
+                break
+            # старый сервер без long-poll отвечает сразу — не чаще раза в секунду
+            await asyncio.sleep(max(0.0, 1 - (time.monotonic() - t0)))
     if not token:
         print("❌ Activation timed out")
         return
     save_device({"device_id": device_id, "device_token": token, "linked_at": int(time.time())})
     print("✅ Linked! Token saved.")
 
-async def cmd_sync():
+async def cmd_sync(concurrency: int = 1):
+    cfg = _cfg()
+    dev = load_device()
+    if not dev:
+        print("No device linked. Run: melissa link")
+        return
+    concurrency = max(1, concurrency)
+    try:
+        async with make_client(max_connections=concurrency) as client:
+            results = await sync_once(client, cfg, dev, concurrency)
+    finally:
+        shutdown_pool()
+    failed = sum(1 for r in results if r["status"] == "failed")
+    if failed:
+        print(f"⚠️  Sync complete with {failed} failed")
+    else:
+        print("✅ Sync complete")
+
+async def cmd_run(interval: float = 60.0, concurrency: int = 8, poll: float = 1.0, warmup: int = 5000):
     cfg = _cfg()
-    base = cfg["api_base"].rstrip("/")
     dev = load_device()
     if not dev:
         print("No device linked. Run: melissa link")
         return
-    token = dev["device_token"]
-    device_id = dev["device_id"]
+    await Daemon(cfg, dev, interval=interval, concurrency=concurrency, poll=poll, warmup_bars=warmup).run()
+
+def _load_bundle(target: str) -> dict | None:
+    # <strategy_id>@<semver> -> сохранённый sync'ом бандл
+    sid, _, semver = target.partition("@")
+    if not sid or not semver:
+        print("Expected <strategy_id>@<semver>")
+        return None
+    path = find_bundle(sid, semver)
+    if path is None:
+        print(f"No bundle at {bundle_path(sid, semver)}. Run: melissa sync")
+        return None
+    return load_bundle(path)
 
-    # 1) list strategies for device
-    import httpx
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(f"{base}/v1/devices/{device_id}/strategies", headers={"Authorization": f"Device {token}"})
-        r.raise_for_status()
-        lst = r.json()
+def _fmt_stats(st: dict) -> str:
+    return (f"trades={st['trades']} win={st['win_rate']:.1%} pnl={st['net_pnl']:.2f} "
+            f"ret={st['return_pct']:.2f}% maxdd={st['max_drawdown_pct']:.2f}% pf={st['profit_factor']:.2f}")
+
+def cmd_backtest(target: str, symbol: str | None = None, tf: str | None = None, balance: float = DEFAULT_BALANCE,
+                 fee_bps: float = 0.0, sweep: str | None = None, samples: int = 0, workers: int | None = None, top: int = 10):
+    bundle = _load_bundle(target)
+    if not bundle:
+        return
+    payload = bundle["payload"]
+    asset = payload["manifest"]["assets"][0]
+    symbol = symbol or asset["symbol"]
+    tf = tf or asset["tf"][0]
+    cols = BarStore().load(symbol, tf)
+    if not len(cols["ts"]):
+        print(f"No bars for {symbol} {tf}. Run: melissa data import")
+        return
+    print(f"📈 {target} on {symbol} {tf}: {len(cols['ts'])} bars")
+    if not sweep:
+        res = Backtest(payload, balance=balance, fee_bps=fee_bps, tf=tf).run(cols)
+        print(_fmt_stats(res["stats"]))
+        print(f"final equity: {res['stats']['final_equity']:.2f}")
+        return
+    space = json.loads(pathlib.Path(sweep).read_text(encoding="utf-8"))
+    variants = random_space(space, samples) if samples else grid(space)
+    t0 = time.time()
+    results = run_sweep(payload, cols, variants, workers=workers, balance=balance, fee_bps=fee_bps, tf=tf)
+    dt = time.time() - t0
+    print(f"⚙️  {len(variants)} variants in {dt:.1f}s ({len(variants) / max(dt, 1e-9) * 60:.0f}/min)")
+    results.sort(key=lambda r: r[1]["return_pct"], reverse=True)
+    for variant, st in results[:top]:
+        print(f"- {json.dumps(variant)}: {_fmt_stats(st)}")
 
-    cache = load_cache()
+def cmd_data_import(path: str, symbol: str, workers: int | None = None, chunk_mb: float = CHUNK_MB, restart: bool = False):
+    last = [0.0]
 
-    # 2) for each strategy with artifact — fetch with ETag
-    for item in lst:
-        sid = item["strategy_id"]
-        art = item.get("artifact")
-        if not art:
-            print(f"- {sid}: no artifact (pinned/latest not set or no versions)")
-            continue
-        semver = art["semver"]
-        url = base + art["url"]
-        cache_key = f"{sid}:{semver}"
-        etag = cache.get(cache_key, {}).get("etag")
+    def progress(st: dict):
+        # не чаще раза в секунду
+        if time.monotonic() - last[0] >= 1:
+            last[0] = time.monotonic()
+            print(f"\r… {st['read']} rows read", end="", flush=True)
 
-        status, body, new_etag = await get_bytes(url, etag=etag)
-        if status == 304:
-            print(f"- {sid}@{semver}: 304 (cached)")
-            continue
-        # got 200
-        bundle = json.loads(body.decode("utf-8"))
-        # validate and verify
-        validate_payload_parts(bundle["payload"])
-        verify_bundle(bundle, cfg["public_ed25519_pubkey_b64"])
-        # save to disk
-        path = bundle_path(sid, semver)
-        path.write_text(json.dumps(bundle, ensure_ascii=False, indent=2), encoding="utf-8")
-        # update cache
-        cache[cache_key] = {"etag": new_etag}
-        print(f"- {sid}@{semver}: downloaded, verified, saved to {path}")
+    try:
+        res = import_file(path, symbol, workers=workers, chunk_mb=chunk_mb, restart=restart, progress=progress)
+    except (OSError, ValueError) as e:
+        print(f"\r❌ Import failed: {e}")
+        return
+    except KeyboardInterrupt:
+        print("\r⏸  Interrupted — rerun the same command to resume")
+        return
+    rate = res["read"] / max(res["seconds"], 1e-9) * 60
+    print(f"\r✅ {symbol}: +{res['added']} bars (read {res['read']}, duplicates {res['dups']}, "
+          f"older than store {res['older']}) in {res['seconds']:.1f}s ({rate:,.0f} rows/min)")
 
-    save_cache(cache)
-    print("✅ Sync complete")
+def _opt(args: list[str], name: str, default: str | None = None) -> str | None:
+    # --name value | --name=value
+    for i, a in enumerate(args):
+        if a == name and i + 1 < len(args):
+            return args[i + 1]
+        if a.startswith(name + "="):
+            return a.split("=", 1)[1]
+    return default
 
 def main():
     if len(sys.argv) == 1:
         print("Usage:")
         print("  melissa link            # register & activate device")
         print("  melissa sync            # fetch artifacts for this device")
+        print("      [--concurrency N]   # parallel downloads over one pooled connection")
+        print("  melissa run             # long-running engine with background sync & hot reload")
+        print("      [--interval 60] [--concurrency 8] [--poll 1] [--warmup 5000]")
+        print("  melissa backtest <strategy_id>@<semver>")
+        print("      [--symbol S] [--tf 1h] [--balance 10000] [--fee-bps 0]")
+        print("      [--sweep space.json [--random N] [--workers K] [--top 10]]")
+        print("  melissa data import <file.csv|.csv.gz|.parquet> --symbol S")
+        print("      [--workers K] [--chunk-mb 16] [--restart]   # resumable: rerun to continue")
         print("  melissa                 # (legacy demo) compile sample bundle")
         return
     if sys.argv[1] == "link":
         asyncio.run(cmd_link())
     elif sys.argv[1] == "sync":
-        asyncio.run(cmd_sync())
+        asyncio.run(cmd_sync(concurrency=int(_opt(sys.argv[2:], "--concurrency", "1"))))
+    elif sys.argv[1] == "run":
+        args = sys.argv[2:]
+        try:
+            asyncio.run(cmd_run(
+                interval=float(_opt(args, "--interval", "60")),
+                concurrency=int(_opt(args, "--concurrency", "8")),
+                poll=float(_opt(args, "--poll", "1")),
+                warmup=int(_opt(args, "--warmup", "5000")),
+            ))
+        except KeyboardInterrupt:
+            print("👋 Stopped")
+    elif sys.argv[1] == "backtest" and len(sys.argv) > 2:
+        args = sys.argv[3:]
+        workers = _opt(args, "--workers")
+        cmd_backtest(
+            sys.argv[2],
+            symbol=_opt(args, "--symbol"),
+            tf=_opt(args, "--tf"),
+            balance=float(_opt(args, "--balance", str(DEFAULT_BALANCE))),
+            fee_bps=float(_opt(args, "--fee-bps", "0")),
+            sweep=_opt(args, "--sweep"),
+            samples=int(_opt(args, "--random", "0")),
+            workers=int(workers) if workers else None,
+            top=int(_opt(args, "--top", "10")),
+        )
+    elif sys.argv[1:3] == ["data", "import"] and len(sys.argv) > 3:
+        args = sys.argv[4:]
+        symbol = _opt(args, "--symbol")
+        if not symbol:
+            print("Expected --symbol S")
+            return
+        workers = _opt(args, "--workers")
+        cmd_data_import(
+            sys.argv[3],
+            symbol,
+            workers=int(workers) if workers else None,
+            chunk_mb=float(_opt(args, "--chunk-mb", str(CHUNK_MB))),
+            restart="--restart" in args,
+        )
     else:
         print("Unknown command")
 
@@ -0,0 +1,87 @@
+"""
+Бинарный контейнер бандла (.bundle.mlb) — формат описан в melissa-api/src/services/binbundle.py:
+b"MLB1", uint32 LE длина заголовка, заголовок JSON (hash, signature_b64, sections), канонические байты.
+
+Файл читается через mmap: проверка подписи хеширует канонический блок напрямую (без json.loads
+и пересериализации с sort_keys), а секции payload разбираются по первому обращению.
+"""
+import json
+import mmap
+import pathlib
+import struct
+from collections.abc import Mapping
+from typing import Any, Dict
+
+from src.core.verify import verify_signed
+
+MAGIC = b"MLB1"
+MEDIA_TYPE = "application/vnd.melissa.bundle"
+
+class BinBundle:
+    def __init__(self, buf):
+        if bytes(buf[:4]) != MAGIC:
+            raise ValueError("Not a binary bundle")
+        (hlen,) = struct.unpack_from("<I", buf, 4)
+        self.header = json.loads(bytes(buf[8:8 + hlen]))
+        self.canonical = memoryview(buf)[8 + hlen:]
+        self.sections: Dict[str, list] = self.header["sections"]
+        self._decoded: Dict[str, Any] = {}
+        self._buf = buf
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "BinBundle":
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def check_layout(self) -> None:
+        # диапазоны секций должны в точности собирать канонический JSON: секцию нельзя подменить
+        # соседней через неподписанный заголовок
+        parts = []
+        for name in sorted(self.sections):
+            off, n = self.sections[name]
+            parts.append(json.dumps(name, ensure_ascii=False).encode("utf-8") + b":" + self.canonical[off:off + n])
+        if b"{" + b",".join(parts) + b"}" != self.canonical:
+            raise ValueError("Section layout mismatch")
+
+    def verify(self, pubkey_b64: str) -> None:
+        self.check_layout()
+        verify_signed(self.canonical, self.header["hash"], self.header["signature_b64"], pubkey_b64)
+
+    def section(self, name: str) -> Any:
+        if name not in self._decoded:
+            off, n = self.sections[name]
+            value = json.loads(bytes(self.canonical[off:off + n]))
+            if name == "manifest":
+                value["hash"] = self.header["hash"]
+            self._decoded[name] = value
+        return self._decoded[name]
+
+    def bundle(self) -> dict:
+        """Бандл в привычной форме {"payload", "signature_b64"}; payload разбирается по секциям лениво."""
+        return {"payload": LazyPayload(self), "signature_b64": self.header["signature_b64"]}
+
+class LazyPayload(Mapping):
+    def __init__(self, bb: BinBundle):
+        self._bb = bb
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._bb.sections:
+            raise KeyError(name)
+        return self._bb.section(name)
+
+    def __iter__(self):
+        return iter(self._bb.sections)
+
+    def __len__(self) -> int:
+        return len(self._bb.sections)
+
+    def __reduce__(self):
+        # в пул процессов (sweep) уходит обычный dict, а не mmap
+        return dict, (dict(self),)
+
+def load_bundle(path: pathlib.Path) -> dict:
+    """Сохранённый sync'ом бандл: .mlb — через mmap с ленивыми секциями, .json — целиком."""
+    path = pathlib.Path(path)
+    if path.suffix == ".mlb":
+        return BinBundle.open(path).bundle()
+    return json.loads(path.read_text(encoding="utf-8"))
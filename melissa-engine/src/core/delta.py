@@ -0,0 +1,37 @@
+"""
+Применение бинарного патча сервера (формат — melissa-api/src/services/delta.py):
+b"MLD1", заголовок {"base_sha256", "target_sha256", "target_size"}, операции копирования/вставки.
+"""
+import hashlib
+import json
+import struct
+
+MAGIC = b"MLD1"
+
+def apply_patch(base: bytes, patch: bytes) -> bytes:
+    """Байты целевого файла. ValueError, если база не та или результат не сошёлся по sha256."""
+    if patch[:4] != MAGIC:
+        raise ValueError("Not a delta patch")
+    (hlen,) = struct.unpack_from("<I", patch, 4)
+    header = json.loads(patch[8:8 + hlen])
+    if hashlib.sha256(base).hexdigest() != header["base_sha256"]:
+        raise ValueError("Patch base mismatch")
+    out = bytearray()
+    pos, end = 8 + hlen, len(patch)
+    while pos < end:
+        op = patch[pos:pos + 1]
+        if op == b"C":
+            off, n = struct.unpack_from("<II", patch, pos + 1)
+            if off + n > len(base):
+                raise ValueError("Patch copy out of range")
+            out += base[off:off + n]
+            pos += 9
+        elif op == b"I":
+            (n,) = struct.unpack_from("<I", patch, pos + 1)
+            out += patch[pos + 5:pos + 5 + n]
+            pos += 5 + n
+        else:
+            raise ValueError("Bad patch op")
+    if len(out) != header["target_size"] or hashlib.sha256(out).hexdigest() != header["target_sha256"]:
+        raise ValueError("Patch result mismatch")
+    return bytes(out)
@@ -0,0 +1,403 @@
+"""
+Векторный расчёт графа `indicators` из бандла.
+
+Узел: {"id", "type", "inputs", "params", "tf"}.
+  - inputs: {"src": "close"} для EMA/SMA/RSI/MACD; {"high","low","close"} для ATR/ADX
+    (если не указаны — берутся одноимённые колонки OHLCV).
+    Ссылка — имя колонки OHLCV, id другого узла или "id.field" для многовыходных узлов.
+  - params: period (EMA/SMA/RSI/ATR/ADX), fast/slow/signal (MACD).
+outputs: {"имя": "ссылка"}.
+
+Всё считается целыми массивами NumPy; первые бары до прогрева — NaN.
+
+Узел со своим `tf` (старше базового) считается на барах этого tf, а в результат попадает
+выровненным на базовый индекс: на базовом баре виден последний старший бар, закрывшийся
+не позже его закрытия (forward-fill только по закрытым барам, без заглядывания вперёд).
+Входы такого узла — колонки его tf или узлы того же tf; базовые узлы могут ссылаться на старшие.
+"""
+import json
+import math
+from typing import Any, Dict, List, Mapping, MutableMapping, Optional, Tuple
+
+import numpy as np
+
+from src.data.bars import TF_MS
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+
+# поля многовыходных узлов; первое — значение по умолчанию для ссылки "id"
+FIELDS = {
+    "EMA": ("value",),
+    "SMA": ("value",),
+    "RSI": ("value",),
+    "ATR": ("value",),
+    "MACD": ("macd", "signal", "hist"),
+    "ADX": ("adx", "plus_di", "minus_di"),
+}
+
+DEFAULT_PARAMS = {
+    "EMA": {"period": 20},
+    "SMA": {"period": 20},
+    "RSI": {"period": 14},
+    "ATR": {"period": 14},
+    "ADX": {"period": 14},
+    "MACD": {"fast": 12, "slow": 26, "signal": 9},
+}
+
+INPUTS = {
+    "EMA": ("src",),
+    "SMA": ("src",),
+    "RSI": ("src",),
+    "MACD": ("src",),
+    "ATR": ("high", "low", "close"),
+    "ADX": ("high", "low", "close"),
+}
+
+# --- примитивы ---------------------------------------------------------------
+
+def _first_valid(x: np.ndarray) -> int:
+    ok = ~np.isnan(x)
+    return int(ok.argmax()) if ok.any() else len(x)
+
+def _ewm_tail(x: np.ndarray, alpha: float, y0: float) -> np.ndarray:
+    """
+    y[t] = alpha*x[t] + (1-alpha)*y[t-1], y[-1] = y0 — без цикла по барам.
+    Внутри блока рекуррентность разворачивается в cumsum с весами w^-k;
+    размер блока подобран так, чтобы w^-k не переполнялся.
+    """
+    n = len(x)
+    out = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return out
+    w = 1.0 - alpha
+    if w <= 0.0:
+        out[:] = x
+        return out
+    block = max(1, min(n, int(300.0 / -math.log(w))))
+    k = np.arange(1, block + 1, dtype=np.float64)
+    pw = w ** k                      # w^1 .. w^B
+    ipw = 1.0 / pw                   # w^-1 .. w^-B
+    prev = y0
+    for s in range(0, n, block):
+        xb = x[s:s + block]
+        m = len(xb)
+        acc = np.cumsum(alpha * xb * ipw[:m])
+        out[s:s + m] = pw[:m] * (prev + acc)
+        prev = out[s + m - 1]
+    return out
+
+def _seeded(x: np.ndarray, period: int, alpha: float) -> np.ndarray:
+    # затравка — SMA первых `period` валидных значений, дальше экспоненциальное сглаживание
+    out = np.full(len(x), np.nan)
+    s = _first_valid(x)
+    if period < 1 or len(x) - s < period:
+        return out
+    seed_at = s + period - 1
+    out[seed_at] = x[s:seed_at + 1].mean()
+    out[seed_at + 1:] = _ewm_tail(x[seed_at + 1:], alpha, out[seed_at])
+    return out
+
+def sma(x: np.ndarray, period: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    s = _first_valid(x)
+    if period < 1 or len(x) - s < period:
+        return out
+    c = np.cumsum(x[s:], dtype=np.float64)
+    c[period:] = c[period:] - c[:-period]
+    out[s + period - 1:] = c[period - 1:] / period
+    return out
+
+def ema(x: np.ndarray, period: int) -> np.ndarray:
+    return _seeded(x, period, 2.0 / (period + 1))
+
+def rma(x: np.ndarray, period: int) -> np.ndarray:
+    # сглаживание Уайлдера (alpha = 1/period)
+    return _seeded(x, period, 1.0 / period)
+
+def _diff(x: np.ndarray) -> np.ndarray:
+    d = np.full(len(x), np.nan)
+    d[1:] = x[1:] - x[:-1]
+    return d
+
+def _ratio_index(up: np.ndarray, down: np.ndarray) -> np.ndarray:
+    # 100 * up / (up + down); при нулевом знаменателе — 50 (нет движения)
+    tot = up + down
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(tot > 0, 100.0 * up / np.where(tot > 0, tot, 1.0), 50.0)
+    r[np.isnan(tot)] = np.nan
+    return r
+
+def gain_loss(x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    d = _diff(x)
+    gain = np.where(d > 0, d, 0.0)
+    loss = np.where(d < 0, -d, 0.0)
+    gain[np.isnan(d)] = np.nan
+    loss[np.isnan(d)] = np.nan
+    return gain, loss
+
+def rsi(x: np.ndarray, period: int) -> np.ndarray:
+    gain, loss = gain_loss(x)
+    return _ratio_index(rma(gain, period), rma(loss, period))
+
+def macd(x: np.ndarray, fast: int, slow: int, signal: int) -> Dict[str, np.ndarray]:
+    m = ema(x, fast) - ema(x, slow)
+    sig = ema(m, signal)
+    return {"macd": m, "signal": sig, "hist": m - sig}
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    tr = high - low
+    if len(tr) > 1:
+        pc = close[:-1]
+        tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(high[1:] - pc), np.abs(low[1:] - pc)))
+    return tr
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int) -> np.ndarray:
+    return rma(true_range(high, low, close), period)
+
+def directional(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # +DM, -DM и TR; направленное движение определено со второго бара
+    up = _diff(high)
+    dn = -_diff(low)
+    pdm = np.where((up > dn) & (up > 0), up, 0.0)
+    mdm = np.where((dn > up) & (dn > 0), dn, 0.0)
+    tr = true_range(high, low, close)
+    for a in (pdm, mdm, tr):
+        a[:1] = np.nan
+    return pdm, mdm, tr
+
+def di_dx(s_tr: np.ndarray, s_pdm: np.ndarray, s_mdm: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pdi = np.where(s_tr > 0, 100.0 * s_pdm / s_tr, 0.0)
+        mdi = np.where(s_tr > 0, 100.0 * s_mdm / s_tr, 0.0)
+    pdi[np.isnan(s_tr)] = np.nan
+    mdi[np.isnan(s_tr)] = np.nan
+    dx = np.abs(_ratio_index(pdi, mdi) - 50.0) * 2.0  # = 100*|+DI - -DI| / (+DI + -DI)
+    return pdi, mdi, dx
+
+def adx(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int) -> Dict[str, np.ndarray]:
+    pdm, mdm, tr = directional(high, low, close)
+    pdi, mdi, dx = di_dx(rma(tr, period), rma(pdm, period), rma(mdm, period))
+    return {"adx": rma(dx, period), "plus_di": pdi, "minus_di": mdi}
+
+# --- граф --------------------------------------------------------------------
+
+def _params(node: dict) -> Dict[str, Any]:
+    p = dict(DEFAULT_PARAMS[node["type"]])
+    p.update(node.get("params") or {})
+    return p
+
+def _inputs(node: dict) -> Dict[str, str]:
+    given = node.get("inputs") or {}
+    out = {}
+    for name in INPUTS[node["type"]]:
+        ref = given.get(name, name if name in COLUMNS else None)
+        if ref is None:
+            raise ValueError(f"indicator '{node['id']}': missing input '{name}'")
+        out[name] = ref
+    return out
+
+def _node_of(ref: str) -> str:
+    return ref.split(".", 1)[0]
+
+class IndicatorGraph:
+    """
+    Скомпилированный граф индикаторов: узлы в топологическом порядке.
+    Строится один раз на бандл, `evaluate` вызывается на любых колонках.
+    """
+
+    def __init__(self, indicators: dict):
+        nodes = indicators.get("nodes") or []
+        self.outputs: Dict[str, str] = dict(indicators.get("outputs") or {})
+        by_id: Dict[str, dict] = {}
+        for n in nodes:
+            nid = n["id"]
+            if nid in by_id:
+                raise ValueError(f"duplicate indicator id '{nid}'")
+            if nid in COLUMNS:
+                raise ValueError(f"indicator id '{nid}' clashes with OHLCV column")
+            if n["type"] not in FIELDS:
+                raise ValueError(f"unsupported indicator type '{n['type']}'")
+            by_id[nid] = n
+        self.nodes = by_id
+        self.inputs = {nid: _inputs(n) for nid, n in by_id.items()}
+        self.params = {nid: _params(n) for nid, n in by_id.items()}
+        for nid, ins in self.inputs.items():
+            for ref in ins.values():
+                self._check_ref(ref, f"indicator '{nid}'")
+        for name, ref in self.outputs.items():
+            self._check_ref(ref, f"output '{name}'")
+        self.order: List[str] = self._toposort()
+
+    @classmethod
+    def from_bundle(cls, bundle: dict) -> "IndicatorGraph":
+        payload = bundle.get("payload", bundle)
+        return cls(payload["indicators"])
+
+    def _check_ref(self, ref: str, where: str) -> None:
+        if ref in COLUMNS:
+            return
+        nid, _, field = ref.partition(".")
+        if nid not in self.nodes:
+            raise ValueError(f"{where}: unknown reference '{ref}'")
+        if field and field not in FIELDS[self.nodes[nid]["type"]]:
+            raise ValueError(f"{where}: unknown field '{field}' of '{nid}'")
+
+    def deps(self, nid: str) -> List[str]:
+        return [_node_of(r) for r in self.inputs[nid].values() if r not in COLUMNS]
+
+    def _toposort(self) -> List[str]:
+        indeg = {nid: 0 for nid in self.nodes}
+        users: Dict[str, List[str]] = {nid: [] for nid in self.nodes}
+        for nid in self.nodes:
+            for d in set(self.deps(nid)):
+                indeg[nid] += 1
+                users[d].append(nid)
+        # порядок объявления сохраняется среди независимых узлов
+        ready = [nid for nid in self.nodes if indeg[nid] == 0]
+        order: List[str] = []
+        while ready:
+            nid = ready.pop(0)
+            order.append(nid)
+            for u in users[nid]:
+                indeg[u] -= 1
+                if indeg[u] == 0:
+                    ready.append(u)
+        if len(order) != len(self.nodes):
+            cyc = sorted(nid for nid, k in indeg.items() if k > 0)
+            raise ValueError(f"indicator graph has a cycle: {', '.join(cyc)}")
+        return order
+
+    def _tf(self, nid: str, tf: Optional[str]) -> Optional[str]:
+        # None — базовый tf колонок
+        ntf = self.nodes[nid].get("tf") or None
+        return None if ntf == tf else ntf
+
+    def run(
+        self,
+        columns: Mapping[str, np.ndarray],
+        tf_columns: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None,
+        tf: Optional[str] = None,
+        memo: Optional[MutableMapping[Any, Dict[str, np.ndarray]]] = None,
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, Dict[str, np.ndarray]]]:
+        """
+        (ряды на базовом индексе — как evaluate, {nid: входы узла на его собственном tf}).
+        Входы нужны прогреву StreamingGraph: его состояние узла старшего tf живёт на барах того tf.
+        memo — результаты узлов между вызовами на тех же колонках, ключ — (type, tf, params, входы)
+        вместе со всеми предками; перебор параметров не пересчитывает узлы, которые не менялись.
+        """
+        base = {c: np.asarray(columns[c], dtype=np.float64) for c in COLUMNS if c in columns}
+        native: Dict[str, np.ndarray] = {}
+        aligned: Dict[str, np.ndarray] = {}
+        node_args: Dict[str, Dict[str, np.ndarray]] = {}
+        keys: Dict[str, Any] = {}
+        for nid in self.order:
+            node = self.nodes[nid]
+            ntf = self._tf(nid, tf)
+            if ntf is not None and not (tf_columns and ntf in tf_columns):
+                raise ValueError(f"indicator '{nid}': no bars for its tf '{ntf}'")
+            cols = base if ntf is None else tf_columns[ntf]
+            args = {}
+            for name, ref in self.inputs[nid].items():
+                if ref in COLUMNS:
+                    src = cols[ref]
+                else:
+                    rtf = self._tf(_node_of(ref), tf)
+                    if rtf == ntf:
+                        src = native[ref]
+                    elif ntf is None:
+                        if ref not in aligned:
+                            aligned[ref] = self._align(native[ref], columns, tf_columns[rtf], rtf, tf)
+                        src = aligned[ref]
+                    else:
+                        raise ValueError(f"indicator '{nid}' (tf {ntf}) cannot use '{ref}' (tf {rtf or tf or 'base'}): "
+                                         "a node with its own tf takes only columns and nodes of that tf")
+                args[name] = np.asarray(src, dtype=np.float64)
+            node_args[nid] = args
+            if memo is not None:
+                keys[nid] = (node["type"], ntf, json.dumps(self.params[nid], sort_keys=True, default=str),
+                             tuple(sorted(self.inputs[nid].items())), tuple(keys[d] for d in sorted(set(self.deps(nid)))))
+                if keys[nid] in memo:
+                    res = memo[keys[nid]]
+                else:
+                    res = memo[keys[nid]] = self._compute(node["type"], args, self.params[nid])
+            else:
+                res = self._compute(node["type"], args, self.params[nid])
+            for field, arr in res.items():
+                native[f"{nid}.{field}"] = arr
+            native[nid] = res[FIELDS[node["type"]][0]]
+        series: Dict[str, np.ndarray] = dict(base)
+        for ref, arr in native.items():
+            rtf = self._tf(_node_of(ref), tf)
+            if rtf is None:
+                series[ref] = arr
+            else:
+                if ref not in aligned:
+                    aligned[ref] = self._align(arr, columns, tf_columns[rtf], rtf, tf)
+                series[ref] = aligned[ref]
+        for name, ref in self.outputs.items():
+            series[name] = series[ref]
+        return series, node_args
+
+    @staticmethod
+    def _compute(kind: str, args: Dict[str, np.ndarray], params: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        res = compute_node(kind, args, params)
+        return res if isinstance(res, dict) else {"value": res}
+
+    @staticmethod
+    def _align(values: np.ndarray, columns: Mapping[str, np.ndarray], tf_cols: Mapping[str, np.ndarray],
+               ntf: str, tf: Optional[str]) -> np.ndarray:
+        # базовый бар j видит старший бар k, если k закрылся не позже закрытия j
+        if "ts" not in columns or "ts" not in tf_cols:
+            raise ValueError("aligning series of different tf needs 'ts' in columns")
+        if ntf not in TF_MS or (tf is not None and tf not in TF_MS):
+            raise ValueError(f"unsupported timeframe '{ntf if ntf not in TF_MS else tf}'")
+        ts = np.asarray(columns["ts"], dtype=np.int64)
+        if tf is not None:
+            step = TF_MS[tf]
+        else:
+            # tf не передан — шаг по самим барам (пропуски только увеличивают разницу)
+            d = np.diff(ts)
+            step = int(d[d > 0].min()) if (d > 0).any() else 0
+        closes = np.asarray(tf_cols["ts"], dtype=np.int64) + TF_MS[ntf]
+        k = np.searchsorted(closes, ts + step, "right") - 1
+        out = np.full(len(ts), np.nan)
+        ok = k >= 0
+        out[ok] = np.asarray(values, dtype=np.float64)[k[ok]]
+        return out
+
+    def evaluate(
+        self,
+        columns: Mapping[str, np.ndarray],
+        tf_columns: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None,
+        tf: Optional[str] = None,
+        memo: Optional[MutableMapping[Any, Dict[str, np.ndarray]]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        columns: {"open","high","low","close","volume"[, "ts"]} -> массивы одинаковой длины, tf — их таймфрейм.
+        tf_columns: {tf: columns с "ts"} для узлов со старшим `tf`; без них такой узел — ValueError.
+        Возвращает все ряды по ссылкам на индексе columns: колонки, "id", "id.field", плюс имена из outputs.
+        memo — кэш результатов узлов между вызовами (см. run).
+        """
+        return self.run(columns, tf_columns, tf, memo)[0]
+
+def compute_node(kind: str, args: Dict[str, np.ndarray], params: Dict[str, Any]):
+    if kind == "EMA":
+        return ema(args["src"], int(params["period"]))
+    if kind == "SMA":
+        return sma(args["src"], int(params["period"]))
+    if kind == "RSI":
+        return rsi(args["src"], int(params["period"]))
+    if kind == "MACD":
+        return macd(args["src"], int(params["fast"]), int(params["slow"]), int(params["signal"]))
+    if kind == "ATR":
+        return atr(args["high"], args["low"], args["close"], int(params["period"]))
+    if kind == "ADX":
+        return adx(args["high"], args["low"], args["close"], int(params["period"]))
+    raise ValueError(f"unsupported indicator type '{kind}'")
+
+def compute_indicators(bundle: dict, columns: Mapping[str, np.ndarray], tf_columns=None,
+                       tf: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Верифицированный бандл + OHLCV -> значения только для `outputs`."""
+    g = IndicatorGraph.from_bundle(bundle)
+    series = g.evaluate(columns, tf_columns, tf)
+    return {name: series[name] for name in g.outputs}
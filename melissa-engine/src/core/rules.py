@@ -0,0 +1,341 @@
+"""
+Компиляция `rules.entries/exits/guards` в исполняемые планы.
+
+Выражение `expr` — JSON-дерево:
+  - число / true / false                      константа
+  - "ema_fast", "close", "macd.hist"           ссылка на ряд (колонка OHLCV, узел или output)
+  - {"ref": "ema_fast"}                        то же явно
+  - {"gt": [a, b]}  gte lt lte eq ne          сравнение
+  - {"add": [a, b, ...]}  sub mul div          арифметика
+  - {"neg": a}  {"abs": a}
+  - {"and": [...]}  {"or": [...]}  {"not": a}  логика
+  - {"prev": a}                                значение на предыдущем баре
+  - {"cross_up": [a, b]}  {"cross_down": [a, b]}
+
+guards — выражения (или {"id", "expr"}), которые должны выполняться для любого входа.
+
+План компилируется один раз на бандл (кеш по manifest.hash) и даёт два режима:
+  plan.signals(series)   — булевы маски по целым массивам (backtest);
+  plan.on_bar(cur, prev) — проверка одного бара (live), prev — значения прошлого бара.
+"""
+import operator
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+from src.core.indicators import COLUMNS, FIELDS
+
+NAN = float("nan")
+
+_CMP = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le, "eq": operator.eq, "ne": operator.ne}
+_ARITH = {"add": operator.add, "sub": operator.sub, "mul": operator.mul, "div": operator.truediv}
+_UNARY = {"neg": operator.neg, "abs": abs}
+_LOGIC = ("and", "or", "not")
+_SERIES = ("prev", "cross_up", "cross_down")
+
+class _Node:
+    """Узел дерева после разбора: op, args, константа (если свернулось), оценка стоимости."""
+    __slots__ = ("op", "args", "value", "ref", "cost", "depth")
+
+    def __init__(self, op: str, args: List["_Node"] = (), value: Any = None, ref: Optional[str] = None):
+        self.op = op
+        self.args = list(args)
+        self.value = value
+        self.ref = ref
+        self.depth = max((a.depth for a in self.args), default=0) + (1 if op in _SERIES else 0)
+        base = {"const": 0, "ref": 1, "prev": 1, "cross_up": 3, "cross_down": 3}.get(op, 1)
+        mult = 2 if op in ("prev", "cross_up", "cross_down") else 1
+        self.cost = base + mult * sum(a.cost for a in self.args)
+
+    @property
+    def is_const(self) -> bool:
+        return self.op == "const"
+
+def _const(v: Any) -> _Node:
+    return _Node("const", value=v)
+
+def _div(a, b):
+    try:
+        return a / b
+    except ZeroDivisionError:
+        return NAN
+
+# --- разбор + свёртка констант -------------------------------------------------
+
+def _parse(e: Any, known: Optional[set], where: str) -> _Node:
+    if isinstance(e, bool) or isinstance(e, (int, float)):
+        return _const(e if isinstance(e, bool) else float(e))
+    if isinstance(e, str):
+        e = {"ref": e}
+    if not isinstance(e, dict) or len(e) != 1:
+        raise ValueError(f"{where}: expression must be a constant, a reference or a single-key object")
+    (op, raw), = e.items()
+    if op == "ref":
+        if not isinstance(raw, str):
+            raise ValueError(f"{where}: ref must be a string")
+        if known is not None and raw not in known:
+            raise ValueError(f"{where}: unknown reference '{raw}'")
+        return _Node("ref", ref=raw)
+    if op == "const":
+        return _parse(raw, known, where)
+
+    items = raw if isinstance(raw, list) else [raw]
+    args = [_parse(a, known, where) for a in items]
+    if op in _CMP or op in ("cross_up", "cross_down"):
+        if len(args) != 2:
+            raise ValueError(f"{where}: '{op}' takes 2 arguments")
+    elif op in _ARITH:
+        if len(args) < 2:
+            raise ValueError(f"{where}: '{op}' takes at least 2 arguments")
+    elif op in _UNARY or op in ("not", "prev"):
+        if len(args) != 1:
+            raise ValueError(f"{where}: '{op}' takes 1 argument")
+    elif op in ("and", "or"):
+        if not args:
+            raise ValueError(f"{where}: '{op}' needs arguments")
+    else:
+        raise ValueError(f"{where}: unknown operator '{op}'")
+    node = _fold(op, args)
+    if node.depth > 1:
+        # live-режим хранит только предыдущий бар
+        raise ValueError(f"{where}: nested prev/cross is not supported")
+    return node
+
+def _fold(op: str, args: List[_Node]) -> _Node:
+    if op in ("and", "or"):
+        absorbing = op == "or"  # or: True поглощает, and: False поглощает
+        rest = []
+        for a in args:
+            if a.is_const:
+                if bool(a.value) == absorbing:
+                    return _const(absorbing)
+                continue
+            rest.append(a)
+        if not rest:
+            return _const(not absorbing)
+        if len(rest) == 1:
+            return rest[0]
+        # дешёвые условия — первыми, чтобы короткое замыкание срабатывало раньше
+        return _Node(op, sorted(rest, key=lambda n: n.cost))
+    if op == "not":
+        a = args[0]
+        if a.is_const:
+            return _const(not bool(a.value))
+        if a.op == "not":
+            return a.args[0]
+        return _Node(op, args)
+    if op in _SERIES:
+        return _Node(op, args)
+    if all(a.is_const for a in args):
+        vals = [a.value for a in args]
+        if op in _CMP:
+            return _const(bool(_CMP[op](vals[0], vals[1])))
+        if op in _UNARY:
+            return _const(_UNARY[op](vals[0]))
+        f = _div if op == "div" else _ARITH[op]
+        acc = vals[0]
+        for v in vals[1:]:
+            acc = f(acc, v)
+        return _const(acc)
+    return _Node(op, args)
+
+# --- векторный режим -------------------------------------------------------------
+
+def _shift(x):
+    if np.ndim(x) == 0:
+        return x
+    out = np.empty(len(x), dtype=np.float64)
+    out[:1] = np.nan
+    out[1:] = x[:-1]
+    return out
+
+def _vector(n: _Node) -> Callable[[Mapping[str, np.ndarray]], Any]:
+    op = n.op
+    if op == "const":
+        v = n.value
+        return lambda s: v
+    if op == "ref":
+        r = n.ref
+        return lambda s: s[r]
+    fs = [_vector(a) for a in n.args]
+    if op in _CMP:
+        f, (fa, fb) = _CMP[op], fs
+        def cmp(s):
+            with np.errstate(invalid="ignore"):
+                return np.asarray(f(fa(s), fb(s)))
+        return cmp
+    if op in _ARITH:
+        f = _ARITH[op]
+        def arith(s):
+            acc = fs[0](s)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                for g in fs[1:]:
+                    acc = f(acc, g(s))
+            return acc
+        return arith
+    if op == "neg":
+        return lambda s: -fs[0](s)
+    if op == "abs":
+        return lambda s: np.abs(fs[0](s))
+    if op == "not":
+        return lambda s: ~np.asarray(fs[0](s), dtype=bool)
+    if op in ("and", "or"):
+        is_and = op == "and"
+        def logic(s):
+            acc = np.asarray(fs[0](s), dtype=bool)
+            for g in fs[1:]:
+                # короткое замыкание на уровне массива: дальше считать бессмысленно
+                if is_and and not acc.any():
+                    return acc
+                if not is_and and acc.all():
+                    return acc
+                m = np.asarray(g(s), dtype=bool)
+                acc = (acc & m) if is_and else (acc | m)
+            return acc
+        return logic
+    if op == "prev":
+        return lambda s: _shift(np.asarray(fs[0](s), dtype=np.float64))
+    if op in ("cross_up", "cross_down"):
+        fa, fb = fs
+        up = op == "cross_up"
+        def cross(s):
+            with np.errstate(invalid="ignore"):
+                d = np.asarray(fa(s) - fb(s), dtype=np.float64)
+                p = _shift(d)
+                return (d > 0) & (p <= 0) if up else (d < 0) & (p >= 0)
+        return cross
+    raise ValueError(f"unknown operator '{op}'")
+
+# --- скалярный режим -------------------------------------------------------------
+
+def _scalar(n: _Node) -> Callable[[Mapping[str, float], Optional[Mapping[str, float]]], Any]:
+    op = n.op
+    if op == "const":
+        v = n.value
+        return lambda c, p: v
+    if op == "ref":
+        r = n.ref
+        return lambda c, p: c.get(r, NAN)
+    fs = [_scalar(a) for a in n.args]
+    if op in _CMP:
+        f, (fa, fb) = _CMP[op], fs
+        return lambda c, p: f(fa(c, p), fb(c, p))
+    if op in _ARITH:
+        f = _div if op == "div" else _ARITH[op]
+        def arith(c, p):
+            acc = fs[0](c, p)
+            for g in fs[1:]:
+                acc = f(acc, g(c, p))
+            return acc
+        return arith
+    if op in _UNARY:
+        f, fa = _UNARY[op], fs[0]
+        return lambda c, p: f(fa(c, p))
+    if op == "not":
+        fa = fs[0]
+        return lambda c, p: not fa(c, p)
+    if op == "and":
+        return lambda c, p: all(g(c, p) for g in fs)
+    if op == "or":
+        return lambda c, p: any(g(c, p) for g in fs)
+    if op == "prev":
+        fa = fs[0]
+        return lambda c, p: NAN if p is None else fa(p, None)
+    if op in ("cross_up", "cross_down"):
+        fa, fb = fs
+        up = op == "cross_up"
+        def cross(c, p):
+            if p is None:
+                return False
+            d, pd = fa(c, p) - fb(c, p), fa(p, None) - fb(p, None)
+            return (d > 0 and pd <= 0) if up else (d < 0 and pd >= 0)
+        return cross
+    raise ValueError(f"unknown operator '{op}'")
+
+# --- план ------------------------------------------------------------------------
+
+class CompiledExpr:
+    __slots__ = ("node", "vector", "scalar")
+
+    def __init__(self, node: _Node):
+        self.node = node
+        self.vector = _vector(node)
+        self.scalar = _scalar(node)
+
+    def mask(self, series: Mapping[str, np.ndarray], n: int) -> np.ndarray:
+        m = self.vector(series)
+        if np.ndim(m) == 0:
+            return np.full(n, bool(m))
+        return np.asarray(m, dtype=bool)
+
+class RulePlan:
+    """Скомпилированные rules одного бандла."""
+
+    def __init__(self, rules: dict, known: Optional[Iterable[str]] = None):
+        known_set = set(known) if known is not None else None
+        self.entries = [(r["id"], r["side"], CompiledExpr(_parse(r["expr"], known_set, f"entry '{r['id']}'")))
+                        for r in rules.get("entries", [])]
+        self.exits = [(r["id"], r["side"], CompiledExpr(_parse(r["expr"], known_set, f"exit '{r['id']}'")))
+                      for r in rules.get("exits", [])]
+        guards = []
+        for i, g in enumerate(rules.get("guards") or []):
+            expr = g["expr"] if isinstance(g, dict) and "expr" in g else g
+            guards.append(_parse(expr, known_set, f"guard #{i}"))
+        # все guards — одно and-выражение (со свёрткой и сортировкой по стоимости)
+        self.guard = CompiledExpr(_fold("and", guards)) if guards else None
+
+    def signals(self, series: Mapping[str, np.ndarray], n: Optional[int] = None) -> Dict[str, Dict[str, np.ndarray]]:
+        """Векторный режим: {"entries": {id: mask}, "exits": {id: mask}}; входы уже отфильтрованы guards."""
+        if n is None:
+            n = len(next(iter(series.values())))
+        out: Dict[str, Dict[str, np.ndarray]] = {"entries": {}, "exits": {}}
+        gate = self.guard.mask(series, n) if self.guard else None
+        for rid, _, ce in self.entries:
+            if gate is not None and not gate.any():
+                out["entries"][rid] = np.zeros(n, dtype=bool)
+                continue
+            m = ce.mask(series, n)
+            out["entries"][rid] = m & gate if gate is not None else m
+        for rid, _, ce in self.exits:
+            out["exits"][rid] = ce.mask(series, n)
+        return out
+
+    def on_bar(self, cur: Mapping[str, float], prev: Optional[Mapping[str, float]] = None) -> Dict[str, List[str]]:
+        """Скалярный режим: id сработавших правил; guards проверяются до входов."""
+        fired_exits = [rid for rid, _, ce in self.exits if ce.scalar(cur, prev)]
+        if self.guard and not self.guard.scalar(cur, prev):
+            return {"entries": [], "exits": fired_exits}
+        fired_entries = [rid for rid, _, ce in self.entries if ce.scalar(cur, prev)]
+        return {"entries": fired_entries, "exits": fired_exits}
+
+    def side(self, rule_id: str) -> Optional[str]:
+        for rid, side, _ in self.entries + self.exits:
+            if rid == rule_id:
+                return side
+        return None
+
+def known_refs(indicators: dict) -> set:
+    refs = set(COLUMNS)
+    for n in indicators.get("nodes") or []:
+        refs.add(n["id"])
+        refs.update(f"{n['id']}.{f}" for f in FIELDS.get(n["type"], ()))
+    refs.update((indicators.get("outputs") or {}).keys())
+    return refs
+
+_PLANS: "OrderedDict[str, RulePlan]" = OrderedDict()
+_PLANS_MAX = 256
+
+def compile_rules(bundle: dict) -> RulePlan:
+    """План для бандла; повторный вызов с тем же manifest.hash не парсит rules заново."""
+    payload = bundle.get("payload", bundle)
+    key = payload.get("manifest", {}).get("hash")
+    if key and key in _PLANS:
+        _PLANS.move_to_end(key)
+        return _PLANS[key]
+    plan = RulePlan(payload["rules"], known_refs(payload.get("indicators") or {}))
+    if key:
+        _PLANS[key] = plan
+        if len(_PLANS) > _PLANS_MAX:
+            _PLANS.popitem(last=False)
+    return plan
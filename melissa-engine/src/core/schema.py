@@ -1,26 +1,74 @@
+"""
+Проверка секций payload по JSON Schema.
+
+Валидаторы собираются один раз при импорте. При установленном fastjsonschema (extra `fast`) для схем
+генерируется код проверки — это быстрый путь «прошло/нет»; текст ошибки всегда строит jsonschema,
+чтобы сообщения не зависели от установленных пакетов.
+Успешные проверки запоминаются по manifest.hash — если вызывающий уже сверил его с подписью.
+"""
 import json
 import pathlib
+import threading
+from collections import OrderedDict
+
 from jsonschema import Draft202012Validator, exceptions as js_exc
 
+try:
+    import fastjsonschema
+except ImportError:  # только jsonschema
+    fastjsonschema = None
+
 BASE = pathlib.Path(__file__).resolve().parents[1].parents[0] / "schemas"
+SECTIONS = ("manifest", "indicators", "rules", "orders")
+VALID_CACHE_ITEMS = 1024
 
 def _load(name: str) -> dict:
     return json.loads((BASE / f"{name}.schema.json").read_text(encoding="utf-8"))
 
-SCHEMAS = {
-    "manifest": _load("manifest"),
-    "indicators": _load("indicators"),
-    "rules": _load("rules"),
-    "orders": _load("orders"),
-}
+def _fast(schema: dict):
+    if fastjsonschema is None:
+        return None
+    try:
+        return fastjsonschema.compile(schema, use_default=False)
+    except fastjsonschema.JsonSchemaDefinitionException:
+        return None  # схему генератор не осилил — проверяет jsonschema
+
+SCHEMAS = {name: _load(name) for name in SECTIONS}
+VALIDATORS = {name: Draft202012Validator(schema) for name, schema in SCHEMAS.items()}
+FAST = {name: _fast(schema) for name, schema in SCHEMAS.items()}
+
+_passed: "OrderedDict[str, None]" = OrderedDict()
+_passed_lock = threading.Lock()
+
+def validate_part(name: str, doc) -> None:
+    fast = FAST[name]
+    if fast is not None:
+        try:
+            fast(doc)
+            return
+        except fastjsonschema.JsonSchemaException:
+            pass  # за сообщением — к jsonschema
+    VALIDATORS[name].validate(doc)
 
-def validate_payload_parts(payload: dict):
+def validate_payload_parts(payload, verified_hash: str | None = None):
+    """
+    ValueError с путём до ошибки. verified_hash — manifest.hash, уже сверенный с подписью:
+    тот же бандл второй раз не проверяется (и секции .mlb не разбираются).
+    """
+    if verified_hash is not None:
+        with _passed_lock:
+            if verified_hash in _passed:
+                _passed.move_to_end(verified_hash)
+                return
     try:
-        Draft202012Validator(SCHEMAS["manifest"]).validate(payload["manifest"])
-        Draft202012Validator(SCHEMAS["indicators"]).validate(payload["indicators"])
-        Draft202012Validator(SCHEMAS["rules"]).validate(payload["rules"])
-        Draft202012Validator(SCHEMAS["orders"]).validate(payload["orders"])
+        for name in SECTIONS:
+            validate_part(name, payload[name])
     except js_exc.ValidationError as e:
         path = ".".join(map(str, e.path)) if e.path else ""
         msg = f"{e.message}" + (f" (at '{path}')" if path else "")
         raise ValueError(msg) from e
+    if verified_hash is not None:
+        with _passed_lock:
+            _passed[verified_hash] = None
+            while len(_passed) > VALID_CACHE_ITEMS:
+                _passed.popitem(last=False)
@@ -0,0 +1,76 @@
+"""
+Замер стоимости проверки payload по схемам в зависимости от размера бандла:
+    python -m src.core.schema_bench [--nodes 10,100,1000,10000] [--repeat 5]
+Колонки (мс на бандл): fresh — новый Draft202012Validator на каждую секцию (как было),
+compiled — собранные один раз валидаторы, fast — сгенерированный fastjsonschema код (если установлен),
+cached — повтор того же manifest.hash.
+"""
+import sys
+import time
+
+from jsonschema import Draft202012Validator
+
+from src.core import schema
+
+def make_payload(nodes: int) -> dict:
+    return {
+        "manifest": {
+            "strategy_id": "bench", "name": "bench", "version": "1.0.0", "engine_min": "0.1.0",
+            "created_at": "2025-01-01T00:00:00Z", "permissions": {"place_orders": False},
+            "assets": [{"symbol": "BTCUSDT", "tf": ["1m", "5m"]}], "hash": "0" * 64,
+        },
+        "indicators": {
+            "nodes": [{"id": f"n{i}", "type": ("EMA", "SMA", "RSI", "ATR")[i % 4], "inputs": {"src": "close"},
+                       "params": {"period": 5 + i % 50}} for i in range(nodes)],
+            "outputs": {"fast": "n0"},
+        },
+        "rules": {
+            "entries": [{"id": f"e{i}", "side": "LONG", "expr": {"gt": [f"n{i}", f"n{i + 1}"]}}
+                        for i in range(max(1, nodes // 10))],
+            "exits": [{"id": "x0", "side": "LONG", "expr": {"lt": ["n0", "n1"]}}],
+        },
+        "orders": {
+            "position_sizing": {"mode": "pct_balance", "value": 1.0, "leverage": 1, "max_concurrent": 1,
+                                "side": "long"},
+            "sl": {"type": "pct", "value": 1.0},
+            "order_policy": {"post_only": False, "time_in_force": "GTC", "reduce_on_inverse_signal": True,
+                             "one_signal_per_bar": True},
+        },
+    }
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+def _fresh(payload: dict) -> None:
+    for name in schema.SECTIONS:
+        Draft202012Validator(schema.SCHEMAS[name]).validate(payload[name])
+
+def _compiled(payload: dict) -> None:
+    for name in schema.SECTIONS:
+        schema.VALIDATORS[name].validate(payload[name])
+
+def _fast(payload: dict) -> None:
+    for name in schema.SECTIONS:
+        schema.FAST[name](payload[name])
+
+def _opt(args: list, name: str, default: str) -> str:
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    sizes = [int(x) for x in _opt(args, "--nodes", "10,100,1000,10000").split(",")]
+    repeat = int(_opt(args, "--repeat", "5"))
+    has_fast = all(schema.FAST.values())
+    print(f"{'nodes':>7} {'fresh':>9} {'compiled':>9} {'fast':>9} {'cached':>9}   (ms per bundle)")
+    for n in sizes:
+        payload = make_payload(n)
+        h = f"bench-{n}"
+        schema.validate_payload_parts(payload, h)
+        fast = f"{_best(lambda: _fast(payload), repeat):9.3f}" if has_fast else f"{'-':>9}"
+        print(f"{n:>7} {_best(lambda: _fresh(payload), repeat):9.3f} {_best(lambda: _compiled(payload), repeat):9.3f}"
+              f" {fast} {_best(lambda: schema.validate_payload_parts(payload, h), repeat):9.3f}")
@@ -1,4 +1,5 @@
 import json
+import os
 import pathlib
 
 HOME = pathlib.Path.home() / ".melissa"
@@ -8,6 +9,8 @@ DEV_FILE = HOME / "device.json"
 CACHE_FILE = HOME / "cache.json"
 STRAT_DIR = HOME / "strategies"
 STRAT_DIR.mkdir(parents=True, exist_ok=True)
+BARS_DIR = HOME / "bars"
+BARS_DIR.mkdir(parents=True, exist_ok=True)
 
 def load_device():
     if DEV_FILE.exists():
@@ -25,7 +28,25 @@ def load_cache():
 def save_cache(obj: dict):
     CACHE_FILE.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
 
-def bundle_path(strategy_id: str, semver: str) -> pathlib.Path:
+def semver_key(v: str):
+    core = v.split("+", 1)[0].split("-", 1)[0]
+    return tuple(int(x) for x in core.split(".")) + ((1,) if "-" not in v else (0,))
+
+def bundle_path(strategy_id: str, semver: str, fmt: str = "json") -> pathlib.Path:
     d = STRAT_DIR / strategy_id
     d.mkdir(parents=True, exist_ok=True)
-    return d / f"{semver}.bundle.json"
+    return d / f"{semver}.bundle.{fmt}"
+
+def find_bundle(strategy_id: str, semver: str) -> pathlib.Path | None:
+    # бинарный контейнер предпочтительнее: открывается через mmap без разбора всего JSON
+    for fmt in ("mlb", "json"):
+        p = STRAT_DIR / strategy_id / f"{semver}.bundle.{fmt}"
+        if p.exists():
+            return p
+    return None
+
+def write_bytes_atomic(path: pathlib.Path, data: bytes) -> None:
+    # новый inode через rename: открытый через mmap старый файл не обрезается под читателем
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
@@ -0,0 +1,338 @@
+"""
+Потоковый (live) расчёт графа `indicators`: O(1) на бар.
+
+Состояние каждого узла компактное (скользящие суммы, кольцевые буферы, аккумуляторы
+Уайлдера). Прогрев — из batch-расчёта `core.indicators`, поэтому значения на стыке
+совпадают с backtest, а дальнейшие шаги — в пределах погрешности float.
+
+  sg = StreamingGraph(IndicatorGraph.from_bundle(bundle))
+  sg.warm(columns)              # история
+  sg.peek(bar)                  # формирующийся бар: значения без фиксации состояния
+  sg.update(bar)                # бар закрылся
+"""
+import math
+from typing import Any, Dict, Iterable, Mapping, Optional, Set
+
+import numpy as np
+
+from src.core import indicators as ind
+from src.core.indicators import COLUMNS, FIELDS, IndicatorGraph
+
+NAN = float("nan")
+
+def _isnan(x: float) -> bool:
+    return x != x
+
+def _ratio(up: float, down: float) -> float:
+    # скалярный аналог indicators._ratio_index
+    tot = up + down
+    if _isnan(tot):
+        return NAN
+    return 100.0 * up / tot if tot > 0 else 50.0
+
+def _last(a: np.ndarray) -> float:
+    return float(a[-1]) if len(a) else NAN
+
+class _Smooth:
+    """EMA/RMA с затравкой SMA первых `period` значений (как indicators._seeded)."""
+    __slots__ = ("period", "alpha", "n", "acc", "y")
+
+    def __init__(self, period: int, alpha: float):
+        self.period = period
+        self.alpha = alpha
+        self.n = 0       # сколько валидных значений уже видели (до period)
+        self.acc = 0.0   # сумма для затравки
+        self.y = NAN
+
+    def warm(self, x: np.ndarray) -> None:
+        s = ind._first_valid(x)
+        cnt = len(x) - s
+        if cnt >= self.period:
+            self.n = self.period
+            self.y = _last(ind._seeded(x, self.period, self.alpha))
+        else:
+            self.n = cnt
+            self.acc = float(x[s:].sum())
+            self.y = NAN
+
+    def step(self, x: float, commit: bool) -> float:
+        if _isnan(x):
+            return self.y
+        if self.n >= self.period:
+            y = self.alpha * x + (1.0 - self.alpha) * self.y
+            if commit:
+                self.y = y
+            return y
+        n = self.n + 1
+        acc = self.acc + x
+        y = acc / self.period if n == self.period else NAN
+        if commit:
+            self.n, self.acc, self.y = n, acc, y
+        return y
+
+def _ema(period: int) -> _Smooth:
+    return _Smooth(period, 2.0 / (period + 1))
+
+def _rma(period: int) -> _Smooth:
+    return _Smooth(period, 1.0 / period)
+
+class _Window:
+    """SMA на кольцевом буфере; сумма пересчитывается раз в `period` шагов, чтобы не копить дрейф."""
+    __slots__ = ("period", "buf", "pos", "n", "total", "since")
+
+    def __init__(self, period: int):
+        self.period = period
+        self.buf = [0.0] * period
+        self.pos = 0
+        self.n = 0
+        self.total = 0.0
+        self.since = 0
+
+    def warm(self, x: np.ndarray) -> None:
+        s = ind._first_valid(x)
+        tail = x[max(s, len(x) - self.period):]
+        self.n = len(tail)
+        self.buf = [0.0] * self.period
+        self.buf[:self.n] = [float(v) for v in tail]
+        self.pos = self.n % self.period
+        self.total = float(sum(self.buf))
+        self.since = 0
+
+    def step(self, x: float, commit: bool) -> float:
+        if _isnan(x):
+            return self.total / self.period if self.n >= self.period else NAN
+        full = self.n >= self.period
+        old = self.buf[self.pos] if full else 0.0
+        total = self.total - old + x
+        y = total / self.period if (full or self.n + 1 == self.period) else NAN
+        if commit:
+            self.buf[self.pos] = x
+            self.pos = (self.pos + 1) % self.period
+            self.n = min(self.n + 1, self.period)
+            self.since += 1
+            if self.since >= self.period:
+                total = math.fsum(self.buf)
+                self.since = 0
+            self.total = total
+        return y
+
+# --- состояния узлов -----------------------------------------------------------
+# warm(args: массивы входов) / step(args: скаляры входов, commit) -> значение или {field: значение}
+
+class _EMANode:
+    def __init__(self, p: Dict[str, Any]):
+        self.s = _ema(int(p["period"]))
+
+    def warm(self, a):
+        self.s.warm(a["src"])
+
+    def step(self, a, commit):
+        return self.s.step(a["src"], commit)
+
+class _SMANode:
+    def __init__(self, p: Dict[str, Any]):
+        self.w = _Window(int(p["period"]))
+
+    def warm(self, a):
+        self.w.warm(a["src"])
+
+    def step(self, a, commit):
+        return self.w.step(a["src"], commit)
+
+class _RSINode:
+    def __init__(self, p: Dict[str, Any]):
+        n = int(p["period"])
+        self.g, self.l = _rma(n), _rma(n)
+        self.prev = NAN
+
+    def warm(self, a):
+        gain, loss = ind.gain_loss(a["src"])
+        self.g.warm(gain)
+        self.l.warm(loss)
+        self.prev = _last(a["src"])
+
+    def step(self, a, commit):
+        x = a["src"]
+        d = x - self.prev
+        gain = NAN if _isnan(d) else max(d, 0.0)
+        loss = NAN if _isnan(d) else max(-d, 0.0)
+        r = _ratio(self.g.step(gain, commit), self.l.step(loss, commit))
+        if commit and not _isnan(x):
+            self.prev = x
+        return r
+
+class _MACDNode:
+    def __init__(self, p: Dict[str, Any]):
+        self.fast, self.slow, self.sig = _ema(int(p["fast"])), _ema(int(p["slow"])), _ema(int(p["signal"]))
+        self.p = p
+
+    def warm(self, a):
+        x = a["src"]
+        self.fast.warm(x)
+        self.slow.warm(x)
+        self.sig.warm(ind.ema(x, int(self.p["fast"])) - ind.ema(x, int(self.p["slow"])))
+
+    def step(self, a, commit):
+        m = self.fast.step(a["src"], commit) - self.slow.step(a["src"], commit)
+        sg = self.sig.step(m, commit)
+        return {"macd": m, "signal": sg, "hist": m - sg}
+
+def _tr(h: float, l: float, pc: float) -> float:
+    if _isnan(pc):
+        return h - l
+    return max(h - l, abs(h - pc), abs(l - pc))
+
+class _ATRNode:
+    def __init__(self, p: Dict[str, Any]):
+        self.s = _rma(int(p["period"]))
+        self.pc = NAN
+
+    def warm(self, a):
+        self.s.warm(ind.true_range(a["high"], a["low"], a["close"]))
+        self.pc = _last(a["close"])
+
+    def step(self, a, commit):
+        y = self.s.step(_tr(a["high"], a["low"], self.pc), commit)
+        if commit:
+            self.pc = a["close"]
+        return y
+
+class _ADXNode:
+    def __init__(self, p: Dict[str, Any]):
+        n = int(p["period"])
+        self.tr, self.pdm, self.mdm, self.dx = _rma(n), _rma(n), _rma(n), _rma(n)
+        self.ph = self.pl = self.pc = NAN
+
+    def warm(self, a):
+        h, l, c = a["high"], a["low"], a["close"]
+        pdm, mdm, tr = ind.directional(h, l, c)
+        self.tr.warm(tr)
+        self.pdm.warm(pdm)
+        self.mdm.warm(mdm)
+        n = self.tr.period
+        _, _, dx = ind.di_dx(ind.rma(tr, n), ind.rma(pdm, n), ind.rma(mdm, n))
+        self.dx.warm(dx)
+        self.ph, self.pl, self.pc = _last(h), _last(l), _last(c)
+
+    def step(self, a, commit):
+        h, l, c = a["high"], a["low"], a["close"]
+        if _isnan(self.ph):
+            pdm = mdm = tr = NAN
+        else:
+            up, dn = h - self.ph, self.pl - l
+            pdm = up if (up > dn and up > 0) else 0.0
+            mdm = dn if (dn > up and dn > 0) else 0.0
+            tr = _tr(h, l, self.pc)
+        s_tr = self.tr.step(tr, commit)
+        s_p = self.pdm.step(pdm, commit)
+        s_m = self.mdm.step(mdm, commit)
+        if _isnan(s_tr):
+            pdi = mdi = dx = NAN
+        else:
+            pdi = 100.0 * s_p / s_tr if s_tr > 0 else 0.0
+            mdi = 100.0 * s_m / s_tr if s_tr > 0 else 0.0
+            dx = abs(_ratio(pdi, mdi) - 50.0) * 2.0
+        adx = self.dx.step(dx, commit)
+        if commit:
+            self.ph, self.pl, self.pc = h, l, c
+        return {"adx": adx, "plus_di": pdi, "minus_di": mdi}
+
+NODE_STATES = {
+    "EMA": _EMANode,
+    "SMA": _SMANode,
+    "RSI": _RSINode,
+    "MACD": _MACDNode,
+    "ATR": _ATRNode,
+    "ADX": _ADXNode,
+}
+
+class StreamingGraph:
+    """Живой двойник IndicatorGraph: те же узлы, те же ссылки, обновление за O(1) на бар."""
+
+    def __init__(self, graph: IndicatorGraph):
+        self.graph = graph
+        self.states = {nid: NODE_STATES[n["type"]](graph.params[nid]) for nid, n in graph.nodes.items()}
+        self.values: Dict[str, float] = {}
+
+    def warm(
+        self,
+        columns: Mapping[str, np.ndarray],
+        tf_columns: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None,
+        only: Optional[Iterable[str]] = None,
+        tf: Optional[str] = None,
+    ) -> Dict[str, float]:
+        """
+        Прогрев по истории: один batch-прогон, состояние узлов берётся из его хвоста
+        (узлы старшего tf — из хвоста рядов на своих барах, см. IndicatorGraph.run).
+        only — прогреть лишь эти узлы (остальные сохраняют текущее состояние, см. adopt).
+        """
+        g = self.graph
+        series, node_args = g.run(columns, tf_columns, tf)
+        only = set(g.order) if only is None else set(only)
+        for nid in g.order:
+            if nid in only:
+                self.states[nid].warm(node_args[nid])
+        for ref, arr in series.items():
+            if ref in COLUMNS or ref.split(".", 1)[0] in only or ref in g.outputs:
+                self.values[ref] = _last(arr)
+        return self.values
+
+    def adopt(self, old: "StreamingGraph") -> Set[str]:
+        """
+        Перенять состояние узлов, совпадающих по id и определению, из прежнего графа
+        (горячая замена бандла без потери прогрева). Возвращает id узлов, которым нужен warm(only=...).
+        """
+        g, og = self.graph, old.graph
+        cold = set()
+        for nid in g.order:
+            same = (
+                nid in og.nodes
+                and og.nodes[nid]["type"] == g.nodes[nid]["type"]
+                and og.inputs[nid] == g.inputs[nid]
+                and og.params[nid] == g.params[nid]
+                and og.nodes[nid].get("tf") == g.nodes[nid].get("tf")
+            )
+            if not same:
+                cold.add(nid)
+                continue
+            self.states[nid] = old.states[nid]
+            for ref, v in old.values.items():
+                if ref == nid or ref.startswith(nid + "."):
+                    self.values[ref] = v
+        for c in COLUMNS:
+            if c in old.values:
+                self.values[c] = old.values[c]
+        return cold
+
+    def update(self, bar: Mapping[str, float], tf: Optional[str] = None) -> Dict[str, float]:
+        """Бар закрылся: сдвигаем состояние узлов с этим `tf` (None — узлы без tf)."""
+        return self._run(bar, tf, commit=True)
+
+    def peek(self, bar: Mapping[str, float], tf: Optional[str] = None) -> Dict[str, float]:
+        """Тик формирующегося бара: значения как если бы бар закрылся сейчас, состояние не меняется."""
+        return self._run(bar, tf, commit=False)
+
+    def _run(self, bar: Mapping[str, float], tf: Optional[str], commit: bool) -> Dict[str, float]:
+        g = self.graph
+        vals = self.values if commit else dict(self.values)
+        if tf is None:
+            for c in COLUMNS:
+                if c in bar:
+                    vals[c] = float(bar[c])
+        for nid in g.order:
+            node = g.nodes[nid]
+            if node.get("tf") != tf:
+                continue
+            args = {
+                name: float(bar[ref]) if ref in COLUMNS else vals.get(ref, NAN)
+                for name, ref in g.inputs[nid].items()
+            }
+            res = self.states[nid].step(args, commit)
+            if not isinstance(res, dict):
+                res = {"value": res}
+            for field, v in res.items():
+                vals[f"{nid}.{field}"] = v
+            vals[nid] = res[FIELDS[node["type"]][0]]
+        for name, ref in g.outputs.items():
+            vals[name] = vals.get(ref, NAN)
+        return vals
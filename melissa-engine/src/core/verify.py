@@ -1,6 +1,7 @@
 import base64
 import json
 import hashlib
+from functools import lru_cache
 from nacl.signing import VerifyKey
 from nacl.exceptions import BadSignatureError
 
@@ -15,17 +16,23 @@ def _canonical_bytes(payload: dict) -> bytes:
         if orig_hash is not None:
             manifest["hash"] = orig_hash
 
-def verify_bundle(bundle: dict, pubkey_b64: str):
-    payload = bundle["payload"]
-    sig_b64 = bundle["signature_b64"]
+@lru_cache(maxsize=8)
+def _verify_key(pubkey_b64: str) -> VerifyKey:
+    # ключ разбирается один раз, а не на каждый бандл синка
+    return VerifyKey(base64.b64decode(pubkey_b64))
 
-    raw = _canonical_bytes(payload)
+def verify_signed(raw: bytes, expected_hash: str | None, sig_b64: str, pubkey_b64: str):
+    # raw — канонические байты как есть (из JSON-бандла пересобираются, из .mlb берутся готовыми)
     sha = hashlib.sha256(raw).hexdigest()
-    if payload.get("manifest", {}).get("hash") != sha:
+    if expected_hash != sha:
         raise ValueError("Hash mismatch")
 
-    vk = VerifyKey(base64.b64decode(pubkey_b64))
     try:
-        vk.verify(raw, base64.b64decode(sig_b64))
+        _verify_key(pubkey_b64).verify(bytes(raw), base64.b64decode(sig_b64))
     except BadSignatureError:
-        raise ValueError("Signature mismatch")
\ No newline at end of file
+        raise ValueError("Signature mismatch")
+
+def verify_bundle(bundle: dict, pubkey_b64: str):
+    payload = bundle["payload"]
+    raw = _canonical_bytes(payload)
+    verify_signed(raw, payload.get("manifest", {}).get("hash"), bundle["signature_b64"], pubkey_b64)
\ No newline at end of file
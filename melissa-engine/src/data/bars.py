@@ -0,0 +1,276 @@
+"""
+Колоночное хранилище OHLCV под ~/.melissa/bars.
+
+  bars/<SYMBOL>/<tf>/ts.i8 open.f8 high.f8 low.f8 close.f8 volume.f8   (+ meta.json для старших tf)
+
+Каждая колонка — append-only файл фиксированной ширины (little-endian), читается через
+numpy.memmap без копирования. ts — начало бара, миллисекунды UTC.
+
+Базовый таймфрейм — 1m. Старшие (5m/15m/1h/4h) выводятся из 1m один раз и хранятся на диске;
+при чтении догружаются только новые 1m-строки. В файлы попадают лишь завершённые бары,
+текущий (незакрытый) бар старшего tf собирается на лету — `partial()`.
+
+Запись под flock на (symbol, tf) — bars/<SYMBOL>/.<tf>.lock, общий для потоков и процессов:
+append/truncate держат 1m эксклюзивно, resample (и чтение старшего tf, которое его вызывает)
+держит свой tf, а 1m читает под разделяемой блокировкой. Порядок захвата — старшие tf, потом 1m.
+truncate не обрезает файлы на месте, а подменяет их укороченными копиями: memmap, уже
+отданный читателю, продолжает смотреть на прежний файл (без SIGBUS).
+"""
+import contextlib
+import fcntl
+import json
+import os
+import pathlib
+import re
+import shutil
+from typing import Dict, Optional
+
+import numpy as np
+
+from src.core.state import BARS_DIR
+
+BASE_TF = "1m"
+TF_MS = {
+    "1m": 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "1h": 60 * 60_000,
+    "4h": 4 * 60 * 60_000,
+}
+FIELDS = {
+    "ts": np.dtype("<i8"),
+    "open": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+}
+# ts пишется последним: длина ts.i8 — число целиком записанных строк
+_WRITE_ORDER = ("open", "high", "low", "close", "volume", "ts")
+_CHUNK_ROWS = 4_000_000  # сколько 1m-строк агрегируем за проход
+_SYMBOL_RE = re.compile(r"^[A-Za-z0-9._-]+$")
+
+def aggregate(cols: Dict[str, np.ndarray], tf_ms: int) -> Dict[str, np.ndarray]:
+    """Ресемплинг отсортированных баров в бакеты по tf_ms (векторно, через reduceat)."""
+    ts = np.asarray(cols["ts"])
+    if len(ts) == 0:
+        return {k: np.empty(0, dtype=dt) for k, dt in FIELDS.items()}
+    b = ts // tf_ms * tf_ms
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    return {
+        "ts": b[starts],
+        "open": np.asarray(cols["open"])[starts],
+        "high": np.maximum.reduceat(np.asarray(cols["high"]), starts),
+        "low": np.minimum.reduceat(np.asarray(cols["low"]), starts),
+        "close": np.asarray(cols["close"])[ends],
+        "volume": np.add.reduceat(np.asarray(cols["volume"]), starts),
+    }
+
+class BarStore:
+    def __init__(self, root: pathlib.Path = BARS_DIR):
+        self.root = pathlib.Path(root)
+
+    # --- пути и низкоуровневый доступ --------------------------------------------
+
+    def _dir(self, symbol: str, tf: str) -> pathlib.Path:
+        if tf not in TF_MS:
+            raise ValueError(f"unsupported timeframe '{tf}'")
+        sym = symbol.replace("/", "-")
+        if not _SYMBOL_RE.match(sym) or sym in (".", ".."):
+            raise ValueError(f"invalid symbol '{symbol}'")
+        return self.root / sym / tf
+
+    @contextlib.contextmanager
+    def _locked(self, symbol: str, tf: str, shared: bool = False):
+        d = self._dir(symbol, tf).parent
+        if shared and not d.exists():
+            yield  # символа ещё нет — читать нечего
+            return
+        d.mkdir(parents=True, exist_ok=True)
+        with open(d / f".{tf}.lock", "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _col(self, d: pathlib.Path, field: str) -> pathlib.Path:
+        return d / f"{field}.{FIELDS[field].kind}{FIELDS[field].itemsize}"
+
+    def _meta(self, d: pathlib.Path) -> dict:
+        p = d / "meta.json"
+        if p.exists():
+            return json.loads(p.read_text(encoding="utf-8"))
+        return {"rows": 0, "src_rows": 0}
+
+    def _save_meta(self, d: pathlib.Path, meta: dict) -> None:
+        tmp = d / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, d / "meta.json")
+
+    def _file_rows(self, d: pathlib.Path, field: str) -> int:
+        p = self._col(d, field)
+        return p.stat().st_size // FIELDS[field].itemsize if p.exists() else 0
+
+    def _repair(self, d: pathlib.Path, rows: int) -> None:
+        # обрезаем хвосты колонок после оборванной записи
+        for f, dt in FIELDS.items():
+            p = self._col(d, f)
+            if p.exists() and p.stat().st_size > rows * dt.itemsize:
+                os.truncate(p, rows * dt.itemsize)
+
+    def _shrink(self, d: pathlib.Path, rows: int) -> None:
+        # как _repair, но укороченная копия подменяет файл (os.replace): живые memmap не ломаются
+        for f, dt in FIELDS.items():
+            p, size = self._col(d, f), rows * dt.itemsize
+            if not p.exists() or p.stat().st_size <= size:
+                continue
+            tmp = p.with_name(p.name + ".tmp")
+            with open(p, "rb") as src, open(tmp, "wb") as dst:
+                left = size
+                while left:
+                    chunk = src.read(min(left, 1 << 24))
+                    dst.write(chunk)
+                    left -= len(chunk)
+            os.replace(tmp, p)
+
+    def _write(self, d: pathlib.Path, cols: Dict[str, np.ndarray]) -> None:
+        d.mkdir(parents=True, exist_ok=True)
+        for f in _WRITE_ORDER:
+            with open(self._col(d, f), "ab") as fh:
+                fh.write(np.ascontiguousarray(cols[f], dtype=FIELDS[f]).tobytes())
+
+    def _map(self, d: pathlib.Path, rows: int) -> Dict[str, np.ndarray]:
+        out = {}
+        for f, dt in FIELDS.items():
+            if rows == 0:
+                out[f] = np.empty(0, dtype=dt)
+            else:
+                out[f] = np.memmap(self._col(d, f), dtype=dt, mode="r", shape=(rows,))
+        return out
+
+    # --- 1m ------------------------------------------------------------------------
+
+    def rows(self, symbol: str, tf: str = BASE_TF) -> int:
+        d = self._dir(symbol, tf)
+        if tf == BASE_TF:
+            return self._file_rows(d, "ts")
+        with self._locked(symbol, tf):
+            self._resample(symbol, tf)
+            return self._meta(d)["rows"]
+
+    def last_ts(self, symbol: str, tf: str = BASE_TF) -> Optional[int]:
+        n = self.rows(symbol, tf)
+        if not n:
+            return None
+        return int(self.load(symbol, tf)["ts"][-1])
+
+    def append(self, symbol: str, cols: Dict[str, np.ndarray]) -> int:
+        """
+        Дописать 1m-бары. ts должен строго возрастать; строки не новее уже записанных отбрасываются.
+        Возвращает число добавленных строк.
+        """
+        d = self._dir(symbol, BASE_TF)
+        ts = np.asarray(cols["ts"], dtype=np.int64)
+        if len(ts) > 1 and not (ts[1:] > ts[:-1]).all():
+            raise ValueError("bars must be sorted by ts without duplicates")
+        with self._locked(symbol, BASE_TF):
+            n = self._file_rows(d, "ts")
+            self._repair(d, n)
+            if n:
+                last = int(np.memmap(self._col(d, "ts"), dtype=FIELDS["ts"], mode="r", shape=(n,))[-1])
+                keep = ts > last
+            else:
+                keep = np.ones(len(ts), dtype=bool)
+            if not keep.any():
+                return 0
+            self._write(d, {f: np.asarray(cols[f])[keep] for f in FIELDS})
+            return int(keep.sum())
+
+    def truncate(self, symbol: str, rows: int) -> None:
+        """
+        Обрезать 1m до первых rows строк (переписать хвост заново — см. data.importer).
+        Агрегаты старших tf, успевшие захватить отрезанное, удаляются и пересчитаются при чтении.
+        """
+        with contextlib.ExitStack() as locks:
+            for tf in TF_MS:  # старшие, затем 1m (BASE_TF в TF_MS первый — берём его последним)
+                if tf != BASE_TF:
+                    locks.enter_context(self._locked(symbol, tf))
+            locks.enter_context(self._locked(symbol, BASE_TF))
+            self._shrink(self._dir(symbol, BASE_TF), rows)
+            for tf in TF_MS:
+                d = self._dir(symbol, tf)
+                if tf != BASE_TF and self._meta(d)["src_rows"] > rows:
+                    shutil.rmtree(d, ignore_errors=True)
+
+    # --- чтение --------------------------------------------------------------------
+
+    def load(self, symbol: str, tf: str = BASE_TF, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Завершённые бары tf как словарь memmap-колонок (без копирования).
+        start/end — границы по ts в мс, [start, end).
+        """
+        d = self._dir(symbol, tf)
+        with self._locked(symbol, tf, shared=tf == BASE_TF):
+            if tf == BASE_TF:
+                rows = self._file_rows(d, "ts")
+            else:
+                self._resample(symbol, tf)
+                rows = self._meta(d)["rows"]
+            cols = self._map(d, rows)
+        if start is None and end is None:
+            return cols
+        ts = cols["ts"]
+        i = int(np.searchsorted(ts, start, "left")) if start is not None else 0
+        j = int(np.searchsorted(ts, end, "left")) if end is not None else len(ts)
+        return {f: a[i:j] for f, a in cols.items()}
+
+    def partial(self, symbol: str, tf: str) -> Optional[Dict[str, float]]:
+        """Текущий незакрытый бар старшего tf, собранный из хвоста 1m; None если его нет."""
+        if tf == BASE_TF:
+            return None
+        with self._locked(symbol, tf):
+            self._resample(symbol, tf)
+            meta = self._meta(self._dir(symbol, tf))
+            base = self.load(symbol, BASE_TF)
+        tail = {f: a[meta["src_rows"]:] for f, a in base.items()}
+        if not len(tail["ts"]):
+            return None
+        agg = aggregate(tail, TF_MS[tf])
+        return {f: agg[f][0].item() for f in FIELDS}
+
+    # --- старшие таймфреймы ------------------------------------------------------
+
+    def resample(self, symbol: str, tf: str) -> int:
+        """
+        Догнать сохранённый агрегат tf по новым 1m-строкам. Возвращает число добавленных баров.
+        Последний бакет не пишется, пока в 1m не появится бар следующего бакета.
+        """
+        if tf == BASE_TF:
+            return 0
+        with self._locked(symbol, tf):
+            return self._resample(symbol, tf)
+
+    def _resample(self, symbol: str, tf: str) -> int:
+        # под блокировкой (symbol, tf)
+        d = self._dir(symbol, tf)
+        meta = self._meta(d)
+        self._repair(d, meta["rows"])
+        base = self.load(symbol, BASE_TF)
+        n = len(base["ts"])
+        added = 0
+        pos = meta["src_rows"]
+        while n - pos > 0:
+            hi = min(n, pos + _CHUNK_ROWS)
+            agg = aggregate({f: a[pos:hi] for f, a in base.items()}, TF_MS[tf])
+            complete = len(agg["ts"]) - 1  # последний бакет может продолжиться дальше
+            if complete <= 0:
+                break
+            consumed = int(np.searchsorted(base["ts"][pos:hi], agg["ts"][complete], "left"))
+            self._write(d, {f: a[:complete] for f, a in agg.items()})
+            pos += consumed
+            added += complete
+            meta = {"rows": meta["rows"] + complete, "src_rows": pos}
+            self._save_meta(d, meta)
+        return added
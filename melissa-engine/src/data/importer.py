@@ -0,0 +1,370 @@
+"""
+Потоковый импорт исторических 1m-свечей в BarStore:
+    melissa data import <file.csv | file.csv.gz | file.parquet> --symbol BTCUSDT [--workers K] [--chunk-mb 16]
+
+CSV читается блоками по границам строк (gzip распаковывается на лету), блоки разбираются в пуле
+процессов, в работе одновременно не больше 2*workers блоков. Parquet (нужен pyarrow, extra `parquet`)
+читается батчами в основном процессе — декодирует сам pyarrow. Каждый блок сортируется по ts,
+дубли отбрасываются (остаётся первое вхождение в файле).
+
+Упорядоченный файл дописывается в хранилище по мере разбора. Строки, залезающие назад во времени,
+складываются на диск отсортированными прогонами; в конце записанный этим импортом хвост сливается
+с ними k-way слиянием блоками по MERGE_ROWS и переписывается. Целиком файл в память не грузится.
+
+Колонки: заголовок с именами (ts|timestamp|time|open_time|date|datetime, open, high, low, close[, volume])
+или без заголовка — первые шесть полей ts,open,high,low,close,volume (как в выгрузках Binance).
+ts — epoch в с/мс/мкс/нс (единица определяется по величине) или ISO 8601 в UTC.
+
+Возобновление: после каждого блока позиция в исходнике сохраняется в bars/<SYMBOL>/import/state.json
+вместе со счётчиками и "last" — последним ts, который они учли; повторный запуск той же команды
+продолжает с неё. Повтор блока после обрыва ничего не дублирует — BarStore отбрасывает строки не новее
+последней, — и не считает дублями строки, которые дописала оборвавшаяся попытка (они новее "last").
+Строки не новее данных, лежавших в хранилище до импорта, пропускаются: хранилище только дописывается.
+"""
+import gzip
+import io
+import json
+import os
+import pathlib
+import shutil
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.data.bars import BASE_TF, FIELDS, BarStore
+
+CHUNK_MB = 16
+MERGE_ROWS = 1_000_000  # строк на шаг слияния, на все прогоны вместе
+TS_NAMES = ("ts", "timestamp", "time", "open_time", "date", "datetime")
+VOLUME_NAMES = ("volume", "vol")
+PRICE_FIELDS = ("open", "high", "low", "close")
+REC = np.dtype([(f, dt) for f, dt in FIELDS.items()])
+
+# --- разбор --------------------------------------------------------------------------
+
+def _is_num(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+def _epoch_ms(t: np.ndarray) -> np.ndarray:
+    # единица по величине: до 1e11 — секунды, до 1e14 — мс, до 1e17 — мкс, дальше нс
+    a = np.abs(t)
+    scale = np.where(a < 1e11, 1e3, np.where(a < 1e14, 1.0, np.where(a < 1e17, 1e-3, 1e-6)))
+    return np.rint(t * scale).astype(np.int64)
+
+def _iso_ms(t: np.ndarray) -> np.ndarray:
+    t = np.char.replace(np.char.rstrip(np.char.strip(t), "Z"), "+00:00", "")
+    return t.astype("datetime64[ms]").astype(np.int64)
+
+def sorted_unique(rec: np.ndarray) -> np.ndarray:
+    """Записи по возрастанию ts; при равных ts остаётся первая (сортировка стабильная)."""
+    ts = rec["ts"]
+    if len(ts) > 1 and not (ts[1:] > ts[:-1]).all():
+        rec = rec[np.argsort(ts, kind="stable")]
+        ts = rec["ts"]
+        rec = rec[np.r_[True, ts[1:] != ts[:-1]]]
+    return rec
+
+def sniff(head: bytes) -> Dict[str, Any]:
+    """Раскладка CSV по началу файла: разделитель, номера колонок, формат ts, длина заголовка."""
+    bom = 3 if head.startswith(b"\xef\xbb\xbf") else 0
+    lines = [ln for ln in head[bom:].decode("utf-8", "replace").splitlines(keepends=True) if ln.strip()]
+    if not lines:
+        raise ValueError("empty file")
+    first = lines[0].strip()
+    delim = next((d for d in (",", ";", "\t") if d in first), ",")
+    fields = [f.strip().strip('"').strip() for f in first.split(delim)]
+    skip = bom
+    if not any(_is_num(f) for f in fields):
+        names = [f.lower() for f in fields]
+        ts = next((names.index(n) for n in TS_NAMES if n in names), None)
+        if ts is None:
+            raise ValueError(f"no timestamp column (expected one of: {', '.join(TS_NAMES)})")
+        missing = [f for f in PRICE_FIELDS if f not in names]
+        if missing:
+            raise ValueError(f"missing columns: {', '.join(missing)}")
+        vol = next((names.index(n) for n in VOLUME_NAMES if n in names), None)
+        usecols = [ts] + [names.index(f) for f in PRICE_FIELDS] + ([vol] if vol is not None else [])
+        skip += len(head[bom:].split(b"\n", 1)[0]) + 1
+        data = lines[1].split(delim) if len(lines) > 1 else None
+    else:
+        if len(fields) < 5:
+            raise ValueError("expected columns ts,open,high,low,close[,volume]")
+        usecols = list(range(min(6, len(fields))))
+        data = first.split(delim)
+    iso = data is not None and not _is_num(data[usecols[0]].strip().strip('"'))
+    return {"delimiter": delim, "usecols": usecols, "iso": iso, "skip": skip}
+
+def parse_block(data: bytes, layout: Dict[str, Any]) -> Tuple[np.ndarray, int]:
+    """Целые строки CSV -> (записи REC по возрастанию ts без дублей, число строк в блоке)."""
+    names = list(FIELDS)[:len(layout["usecols"])]
+    dtype = [(n, "U40" if n == "ts" and layout["iso"] else "f8") for n in names]
+    raw = np.loadtxt(io.BytesIO(data), delimiter=layout["delimiter"], usecols=layout["usecols"], dtype=dtype,
+                     quotechar='"', ndmin=1, encoding="latin1")
+    rec = np.empty(len(raw), dtype=REC)
+    rec["ts"] = _iso_ms(raw["ts"]) if layout["iso"] else _epoch_ms(raw["ts"])
+    for n in names[1:]:
+        rec[n] = raw[n]
+    if "volume" not in names:
+        rec["volume"] = 0.0
+    return sorted_unique(rec), len(raw)
+
+def _worker_init() -> None:
+    # Ctrl-C обрабатывает основной процесс: дописывает state и закрывает пул
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# --- источники -----------------------------------------------------------------------
+
+def _open(path: pathlib.Path):
+    with open(path, "rb") as fh:
+        gz = fh.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if gz else open(path, "rb")
+
+def _csv_blocks(path: pathlib.Path, start: int, chunk: int) -> Iterator[Tuple[bytes, int, int]]:
+    # (целые строки, позиция начала, позиция конца) — позиции в распакованном потоке
+    with _open(path) as fh:
+        fh.seek(start)  # для gzip — распаковкой вперёд, без разбора
+        pos, tail = start, b""
+        while True:
+            buf = fh.read(chunk)
+            if not buf:
+                break
+            buf = tail + buf
+            cut = buf.rfind(b"\n") + 1
+            if not cut:  # строка длиннее блока
+                tail = buf
+                continue
+            tail = buf[cut:]
+            if buf[:cut].strip():
+                yield buf[:cut], pos, pos + cut
+            pos += cut
+        if tail.strip():
+            yield tail, pos, pos + len(tail)
+
+def _csv_records(path: pathlib.Path, start: int, chunk: int, workers: int) -> Iterator[Tuple[np.ndarray, int, int]]:
+    with _open(path) as fh:
+        layout = sniff(fh.read(64 * 1024))
+    blocks = _csv_blocks(path, max(start, layout["skip"]), chunk)
+
+    def bad(at: int, e: ValueError) -> ValueError:
+        return ValueError(f"{path.name}: bad rows in block at byte {at}: {e}")
+
+    if workers <= 1:
+        for data, at, end in blocks:
+            try:
+                rec, n = parse_block(data, layout)
+            except ValueError as e:
+                raise bad(at, e) from e
+            yield rec, n, end
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as ex:
+        pending: deque = deque()
+        for data, at, end in blocks:
+            pending.append((ex.submit(parse_block, data, layout), at, end))
+            # блоки отдаём по порядку файла; читаем вперёд не больше 2*workers
+            while pending and (len(pending) >= 2 * workers or pending[0][0].done()):
+                fut, at0, end0 = pending.popleft()
+                try:
+                    rec, n = fut.result()
+                except ValueError as e:
+                    raise bad(at0, e) from e
+                yield rec, n, end0
+        for fut, at, end in pending:
+            try:
+                rec, n = fut.result()
+            except ValueError as e:
+                raise bad(at, e) from e
+            yield rec, n, end
+
+def _parquet_records(path: pathlib.Path, start: int, rows: int) -> Iterator[Tuple[np.ndarray, int, int]]:
+    # позиция — число прочитанных строк файла
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("parquet import needs pyarrow: pip install 'melissa-engine[parquet]'") from None
+    pf = pq.ParquetFile(path)
+    names = {n.lower(): n for n in pf.schema_arrow.names}
+    ts = next((names[n] for n in TS_NAMES if n in names), None)
+    if ts is None:
+        raise ValueError(f"no timestamp column (expected one of: {', '.join(TS_NAMES)})")
+    missing = [f for f in PRICE_FIELDS if f not in names]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    vol = next((names[n] for n in VOLUME_NAMES if n in names), None)
+    columns = [ts] + [names[f] for f in PRICE_FIELDS] + ([vol] if vol else [])
+    pos = 0
+    for batch in pf.iter_batches(batch_size=rows, columns=columns):
+        at, pos = pos, pos + batch.num_rows
+        if pos <= start:
+            continue
+        batch = batch.slice(max(0, start - at))
+        rec = np.empty(batch.num_rows, dtype=REC)
+        t = batch.column(0)
+        if pa.types.is_timestamp(t.type):
+            scale = {"s": 1000, "ms": 1, "us": 1e-3, "ns": 1e-6}[t.type.unit]
+            rec["ts"] = np.rint(t.cast(pa.int64()).to_numpy() * scale).astype(np.int64)
+        elif pa.types.is_string(t.type) or pa.types.is_large_string(t.type):
+            rec["ts"] = _iso_ms(t.to_numpy(zero_copy_only=False).astype(str))
+        else:
+            rec["ts"] = _epoch_ms(t.to_numpy(zero_copy_only=False).astype(np.float64))
+        for i, f in enumerate(FIELDS):
+            if 0 < i < batch.num_columns:
+                rec[f] = batch.column(i).to_numpy(zero_copy_only=False)
+        if not vol:
+            rec["volume"] = 0.0
+        yield sorted_unique(rec), batch.num_rows, pos
+
+# --- слияние -------------------------------------------------------------------------
+
+def merge_runs(runs: List[np.ndarray], rows: int = MERGE_ROWS) -> Iterator[np.ndarray]:
+    """
+    k-way слияние отсортированных прогонов без дублей, блоками примерно по rows записей.
+    При равных ts остаётся запись из более раннего прогона.
+    """
+    pos = [0] * len(runs)
+    step = max(1, rows // max(1, len(runs)))
+    while True:
+        live = [i for i, r in enumerate(runs) if pos[i] < len(r)]
+        if not live:
+            return
+        # всё, что не позже cut, уже лежит в текущих окнах прогонов
+        cut = min(int(runs[i]["ts"][min(pos[i] + step, len(runs[i])) - 1]) for i in live)
+        parts = []
+        for i in live:
+            j = pos[i] + int(np.searchsorted(runs[i]["ts"][pos[i]:pos[i] + step], cut, "right"))
+            parts.append(runs[i][pos[i]:j])
+            pos[i] = j
+        yield sorted_unique(np.concatenate(parts))
+
+# --- импорт --------------------------------------------------------------------------
+
+class _Import:
+    def __init__(self, store: BarStore, symbol: str, path: pathlib.Path, restart: bool):
+        self.store, self.symbol = store, symbol
+        self.dir = store._dir(symbol, BASE_TF).parent / "import"
+        st = path.stat()
+        source = {"source": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        state_file = self.dir / "state.json"
+        if restart:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        if state_file.exists():
+            self.state = json.loads(state_file.read_text(encoding="utf-8"))
+            if {k: self.state[k] for k in source} != source:
+                raise ValueError(f"unfinished import of {self.state['source']} into {symbol}: "
+                                 "rerun it to finish or pass --restart")
+        else:
+            base = store.rows(symbol)
+            last = store.last_ts(symbol)
+            self.state = {**source, "phase": "scan", "offset": 0, "base_rows": base, "base_last": last,
+                          "last": last, "runs": 0, "read": 0, "dups": 0, "older": 0}
+            self.dir.mkdir(parents=True, exist_ok=True)
+            self._save()
+        self.last = store.last_ts(symbol)
+
+    def _save(self) -> None:
+        tmp = self.dir / "state.json.tmp"
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        os.replace(tmp, self.dir / "state.json")
+
+    def _run(self, name: str) -> pathlib.Path:
+        return self.dir / f"{name}.npy"
+
+    def feed(self, rec: np.ndarray, n: int, end: int) -> None:
+        st = self.state
+        st["read"] += n
+        st["dups"] += n - len(rec)
+        if st["base_last"] is not None:
+            k = int(np.searchsorted(rec["ts"], st["base_last"], "right"))
+            st["older"] += k
+            rec = rec[k:]
+        k = int(np.searchsorted(rec["ts"], self.last, "right")) if self.last is not None else 0
+        behind, ahead = rec[:k], rec[k:]
+        if len(behind) and self.last is not None:
+            # назад во времени: то, что уже записано этим импортом, — дубли, остальное в прогон
+            tail = self.store.load(self.symbol)["ts"][st["base_rows"]:]
+            i = np.minimum(np.searchsorted(tail, behind["ts"]), len(tail) - 1)
+            hit = tail[i] == behind["ts"]
+            # новее сохранённого "last" — строки этого же блока, дописанные до обрыва: не дубли
+            replay = behind["ts"] > st["last"] if st["last"] is not None else np.ones(len(hit), bool)
+            st["dups"] += int((hit & ~replay).sum())
+            behind = behind[~hit]
+            if len(behind):
+                np.save(self._run(f"run{st['runs']}"), behind)
+                st["runs"] += 1
+        if len(ahead):
+            self.store.append(self.symbol, {f: ahead[f] for f in FIELDS})
+            self.last = int(ahead["ts"][-1])
+        if len(rec):
+            st["last"] = int(rec["ts"][-1]) if st["last"] is None else max(st["last"], int(rec["ts"][-1]))
+        st["offset"] = end
+        self._save()
+
+    def merge(self) -> None:
+        st = self.state
+        if st["phase"] == "scan":
+            if not st["runs"]:
+                return
+            # хвост этого импорта — самый приоритетный прогон: его строки встретились в файле раньше
+            cols = self.store.load(self.symbol)
+            n = len(cols["ts"]) - st["base_rows"]
+            out = np.lib.format.open_memmap(self._run("tail"), mode="w+", dtype=REC, shape=(n,))
+            for i in range(0, n, MERGE_ROWS):
+                lo, hi = st["base_rows"] + i, st["base_rows"] + min(n, i + MERGE_ROWS)
+                for f in FIELDS:
+                    out[f][i:i + MERGE_ROWS] = cols[f][lo:hi]
+            out.flush()
+            del out
+            st["phase"] = "merge"
+            self._save()
+        self.store.truncate(self.symbol, st["base_rows"])
+        runs = [np.load(self._run(name), mmap_mode="r") for name in ["tail"] + [f"run{i}" for i in range(st["runs"])]]
+        for rec in merge_runs(runs):
+            self.store.append(self.symbol, {f: rec[f] for f in FIELDS})
+
+    def finish(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def import_file(
+    path: str | pathlib.Path,
+    symbol: str,
+    store: Optional[BarStore] = None,
+    workers: Optional[int] = None,
+    chunk_mb: float = CHUNK_MB,
+    restart: bool = False,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Импортировать файл свечей в 1m-хранилище symbol (или продолжить прерванный импорт).
+    Возвращает {"read", "added", "dups", "older", "seconds"}; progress получает state после каждого блока
+    (его "dups" — пока без дублей между прогонами, они видны только при слиянии).
+    """
+    path = pathlib.Path(path).resolve()
+    store = store or BarStore()
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, int(chunk_mb * 2**20))
+    t0 = time.perf_counter()
+    imp = _Import(store, symbol, path, restart)
+    st = imp.state
+    if st["phase"] == "scan":
+        if path.suffix.lower() in (".parquet", ".pq"):
+            records = _parquet_records(path, st["offset"], max(1, chunk // 64))
+        else:
+            records = _csv_records(path, st["offset"], chunk, workers)
+        for rec, n, end in records:
+            imp.feed(rec, n, end)
+            if progress:
+                progress(st)
+    imp.merge()
+    imp.finish()
+    added = store.rows(symbol) - st["base_rows"]
+    # каждая прочитанная строка либо добавлена, либо старше данных, либо дубль (в т.ч. снятый при слиянии)
+    return {"read": st["read"], "added": added, "dups": st["read"] - added - st["older"],
+            "older": st["older"], "seconds": time.perf_counter() - t0}
@@ -0,0 +1,360 @@
+"""
+Бэктест бандла на исторических барах: индикаторы -> маски rules -> сделки по `orders`.
+
+Модель исполнения (одна позиция на символ):
+  - position_sizing.max_concurrent < 1 — входов нет; больше 1 на одном символе ничего не меняет;
+  - вход по сигналу бара i исполняется по open[i+1]; выход по сигналу exits — так же;
+  - sl: {"type": "pct", "value": 1.5}        — 1.5% от цены входа
+        {"type": "atr_k", "value": 2}        — 2*ATR (первый ATR-узел графа или {"k": 2, "atr": "<ref>"})
+        {"type": "structure", "value": 20}   — экстремум low/high за 20 баров до входа
+  - tp: [{"type": "pct"|"rr"|"atr_k", "value": x, "size": доля}] — частичные выходы;
+        без size позиция делится поровну; rr — кратно расстоянию до sl;
+  - trailing: {"type": "pct"|"atr_k", "value": x} — от экстремума с момента входа;
+  - order_policy.reduce_on_inverse_signal — встречный вход закрывает позицию.
+SL/TP исполняются по уровню (или по open при гэпе); если на баре задеты оба — считаем SL.
+Без сигнала выхода позиция ждёт SL/TP до последнего бара включительно, иначе закрывается по close.
+Пока уровень не определён (atr_k на непрогретом ATR — NaN), входа нет.
+
+Узлы со старшим `tf` считаются на барах, собранных из колонок бэктеста (нужна "ts"),
+и видны только после закрытия своего бара; tf ниже tf бэктеста — ValueError.
+
+Первые касания SL/TP ищутся сразу для всех сигналов входа (спуск по блочным min/max, O(log n)
+на вход); цикл по сделкам только сцепляет их и считает pnl. Trailing — векторно внутри сделки.
+"""
+import math
+from bisect import bisect_left
+from typing import Any, Dict, List, Mapping, Optional
+
+import numpy as np
+
+from src.core import indicators as ind
+from src.core.indicators import IndicatorGraph
+from src.core.rules import RulePlan, known_refs
+from src.data.bars import TF_MS, aggregate
+
+DEFAULT_BALANCE = 10_000.0
+_SCAN0 = 256
+
+def _scan(hit, start: int, stop: int) -> int:
+    """Первый индекс в [start, stop), где hit(a, b) истинно; stop если нет. Окно растёт вдвое."""
+    a, step = start, _SCAN0
+    while a < stop:
+        b = min(stop, a + step)
+        m = hit(a, b)
+        k = int(m.argmax())
+        if m[k]:
+            return a + k
+        a, step = b, step * 2
+    return stop
+
+def _any(masks: List[np.ndarray], n: int) -> np.ndarray:
+    out = np.zeros(n, dtype=bool)
+    for m in masks:
+        out |= m
+    return out
+
+def _atr_series(graph: IndicatorGraph, series: Mapping[str, np.ndarray], ref: Optional[str]) -> np.ndarray:
+    if ref:
+        return series[ref]
+    for nid in graph.order:
+        if graph.nodes[nid]["type"] == "ATR":
+            return series[nid]
+    return ind.atr(series["high"], series["low"], series["close"], 14)
+
+def _distance(spec: Dict[str, Any], px, i, atr: Optional[np.ndarray]):
+    """Расстояние уровня от цены входа; px/i — скаляры или массивы по всем входам сразу."""
+    v = spec.get("value")
+    if spec["type"] == "pct":
+        return px * float(v) / 100.0
+    if spec["type"] == "atr_k":
+        k = v.get("k") if isinstance(v, dict) else v
+        return float(k) * atr[i]
+    raise ValueError(f"unsupported level type '{spec['type']}'")
+
+def _blocks(a: np.ndarray, lower: bool) -> List[np.ndarray]:
+    """Уровень j — min (lower) или max по выровненным блокам по 2^j баров; NaN не считается касанием."""
+    red, pad = (np.fmin, np.inf) if lower else (np.fmax, -np.inf)
+    levels = [a]
+    while len(levels[-1]) > 1:
+        x = levels[-1]
+        if len(x) % 2:
+            x = np.append(x, pad)
+        levels.append(red(x[0::2], x[1::2]))
+    return levels
+
+def _first(levels: List[np.ndarray], start: np.ndarray, lvl: np.ndarray, lower: bool) -> np.ndarray:
+    """
+    Для каждого start — первый t >= start, где a[t] <= lvl (lower) или a[t] >= lvl; len(a), если касания нет.
+    Подъём по выровненным блокам до блока с касанием и спуск внутри него: O(log n) на вход, векторно по всем.
+    """
+    n, top = len(levels[0]), len(levels) - 1
+    t = np.array(start, dtype=np.int64)
+    found = np.full(len(t), -1)  # уровень блока [t, t + 2^j), в котором есть касание
+
+    def hit(j, sel):
+        blk = levels[j][t[sel] >> j]
+        return blk <= lvl[sel] if lower else blk >= lvl[sel]
+
+    for j in range(top + 1):
+        # t выровнен на 2^j; если не на 2^(j+1) — проверяем блок длины 2^j, иначе выше
+        sel = np.flatnonzero((found < 0) & (t < n) & ((((t >> j) & 1) == 1) | (j == top)))
+        h = hit(j, sel)
+        found[sel[h]] = j
+        t[sel[~h]] += 1 << j
+    for j in range(top, 0, -1):
+        sel = np.flatnonzero(found == j)
+        left = hit(j - 1, sel)
+        t[sel[~left]] += 1 << (j - 1)
+        found[sel] = j - 1
+    return np.where(found < 0, n, t)
+
+def _window(a: np.ndarray, idx: np.ndarray, lb: int, lower: bool) -> np.ndarray:
+    """min (lower) или max a[max(0, i - lb + 1):i + 1] для каждого i из idx."""
+    if not len(idx):
+        return np.empty(0)
+    pad = np.full(lb - 1, np.inf if lower else -np.inf)
+    win = np.lib.stride_tricks.sliding_window_view(np.concatenate((pad, a)), lb)[idx]
+    return win.min(axis=1) if lower else win.max(axis=1)
+
+def tf_columns(graph: IndicatorGraph, cols: Mapping[str, np.ndarray], tf: Optional[str]) -> Dict[str, Dict[str, np.ndarray]]:
+    """Бары старших tf узлов графа из базовых колонок; незакрытый последний бакет выравнивание не покажет."""
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    for nid, node in graph.nodes.items():
+        ntf = node.get("tf") or None
+        if ntf is None or ntf == tf or ntf in out:
+            continue
+        if ntf not in TF_MS:
+            raise ValueError(f"indicator '{nid}': unsupported timeframe '{ntf}'")
+        if tf is not None and TF_MS[ntf] < TF_MS[tf]:
+            raise ValueError(f"indicator '{nid}': tf {ntf} is below the backtest tf {tf}")
+        if "ts" not in cols:
+            raise ValueError(f"indicator '{nid}': resampling to {ntf} needs 'ts' in columns")
+        out[ntf] = aggregate(cols, TF_MS[ntf])
+    return out
+
+class Backtest:
+    """Скомпилированный бэктест: граф и план строятся один раз, run() — на любых колонках."""
+
+    def __init__(self, payload: dict, balance: float = DEFAULT_BALANCE, fee_bps: float = 0.0,
+                 plan: Optional[RulePlan] = None, tf: Optional[str] = None):
+        self.payload = payload
+        self.tf = tf
+        self.graph = IndicatorGraph(payload["indicators"])
+        self.plan = plan or RulePlan(payload["rules"], known_refs(payload["indicators"]))
+        self.orders = payload["orders"]
+        self.balance = float(balance)
+        self.fee = float(fee_bps) / 10_000.0
+
+    def run(self, cols: Mapping[str, np.ndarray], htf: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None,
+            memo=None) -> Dict[str, Any]:
+        """htf — уже собранные tf_columns для этих cols, memo — кэш узлов IndicatorGraph.run (оба — для sweep)."""
+        htf = tf_columns(self.graph, cols, self.tf) if htf is None else htf
+        series = self.graph.evaluate(cols, htf, self.tf, memo)
+        n = len(series["close"])
+        sig = self.plan.signals(series, n)
+        sides = {rid: side for rid, side, _ in self.plan.entries + self.plan.exits}
+        allowed = self.orders["position_sizing"].get("side", "both")
+        long_in = _any([m for r, m in sig["entries"].items() if sides[r] == "LONG"], n) if allowed != "short" else np.zeros(n, bool)
+        short_in = _any([m for r, m in sig["entries"].items() if sides[r] == "SHORT"], n) if allowed != "long" else np.zeros(n, bool)
+        both = long_in & short_in  # противоречивый бар — пропускаем
+        long_in &= ~both
+        short_in &= ~both
+        long_out = _any([m for r, m in sig["exits"].items() if sides[r] == "LONG"], n)
+        short_out = _any([m for r, m in sig["exits"].items() if sides[r] == "SHORT"], n)
+        if self.orders["order_policy"].get("reduce_on_inverse_signal"):
+            long_out |= short_in
+            short_out |= long_in
+        return self._simulate(series, n, long_in, short_in, long_out, short_out)
+
+    def _simulate(self, s, n, long_in, short_in, long_out, short_out) -> Dict[str, Any]:
+        o, h, l, c = (np.asarray(s[k], dtype=np.float64) for k in ("open", "high", "low", "close"))
+        ps = self.orders["position_sizing"]
+        lev = float(ps.get("leverage", 1) or 1)
+        sl_spec = self.orders["sl"]
+        tp_specs = self.orders.get("tp") or []
+        trail = self.orders.get("trailing") or None
+        atr_ref, atr = None, None
+        for spec in [sl_spec, trail] + list(tp_specs):
+            if spec and isinstance(spec.get("value"), dict):
+                atr_ref = spec["value"].get("atr") or atr_ref
+        if any(spec and spec["type"] == "atr_k" for spec in [sl_spec, trail] + list(tp_specs)):
+            atr = _atr_series(self.graph, s, atr_ref)
+
+        # все возможные входы разом: уровни и первые касания SL/TP (до конца данных)
+        cand = np.flatnonzero((long_in | short_in)[:max(0, n - 1)])
+        if int(ps.get("max_concurrent", 1)) < 1:
+            cand = cand[:0]
+        e_all = cand + 1
+        side_all = np.where(long_in[cand], 1, -1)
+        px_all = o[e_all]
+        if sl_spec["type"] == "structure":
+            lb = max(1, int(sl_spec["value"]))
+            sl_all = np.where(side_all > 0, _window(l, cand, lb, True), _window(h, cand, lb, False))
+        else:
+            sl_all = px_all - side_all * _distance(sl_spec, px_all, cand, atr)
+        risk = np.abs(px_all - sl_all)
+        tp_all, tp_size = [], []
+        for t in tp_specs:
+            dist = float(t["value"]) * risk if t["type"] == "rr" else _distance(t, px_all, cand, atr)
+            tp_all.append(px_all + side_all * dist)
+            tp_size.append(float(t.get("size", 1.0 / len(tp_specs))))
+        tdist_all = _distance(trail, px_all, cand, atr) * np.ones(len(cand)) if trail else np.zeros(len(cand))
+        # уровень от ещё не прогретого индикатора (ATR = NaN): без стопа не входим
+        ok_all = np.isfinite(sl_all) & np.isfinite(tdist_all)
+        for tp in tp_all:
+            ok_all &= np.isfinite(tp)
+
+        lows, highs = _blocks(l, True), _blocks(h, False)
+        is_long = side_all > 0
+
+        def touch(lvl, against):
+            # against: уровень против позиции (SL) — лонг касается снизу, шорт сверху; TP — наоборот
+            out = np.full(len(cand), n)
+            down = is_long == against
+            out[down] = _first(lows, e_all[down], lvl[down], True)
+            out[~down] = _first(highs, e_all[~down], lvl[~down], False)
+            return out
+
+        # выход по сигналу: сигнал на баре x -> исполнение open[x+1]; без него стоп ищется до последнего бара
+        sig_at = np.full(len(cand), n)
+        for ex, m in ((np.flatnonzero(long_out), is_long), (np.flatnonzero(short_out), ~is_long)):
+            sig_at[m] = np.append(ex, n)[np.searchsorted(ex, e_all[m])] + 1
+        signal = sig_at < n
+        end = np.where(signal, sig_at, n)
+        sl_i = np.minimum(touch(sl_all, True), end)
+        base_stop = np.where(sl_i < end, sl_i, np.where(signal, end, n - 1))  # стоп без учёта trailing
+
+        # доли tp: каждая закрывается по своему уровню, остаток — по стопу
+        eff, rest = [], 1.0
+        for t, frac in enumerate(tp_size):
+            frac = min(frac, rest)
+            if frac > 0:
+                eff.append((t, frac))
+                rest -= frac
+        rest = rest if rest > 1e-12 else 0.0
+        tp_first = {t: touch(tp_all[t], False) for t, _ in eff}
+        tp_last = np.max([tp_first[t] for t, _ in eff], axis=0) if eff and not rest else None
+
+        # цепочка сделок: следующий вход — первый сигнал не раньше выхода предыдущей
+        entries, ok = cand.tolist(), ok_all.tolist()
+        chain: List[int] = []
+        tr_found = np.zeros(len(cand), dtype=bool)
+        tr_i_all = np.zeros(len(cand), dtype=np.int64)
+        tr_px_all = np.full(len(cand), np.nan)
+        if not trail:
+            last_all = base_stop if tp_last is None else np.minimum(base_stop, tp_last)
+            nxt = np.searchsorted(cand, last_all, "left").tolist()
+        else:
+            lim_all, stop_l = np.minimum(sl_i, end).tolist(), base_stop.tolist()
+            tp_l = tp_last.tolist() if tp_last is not None else None
+        k = 0
+        while k < len(entries):
+            if not ok[k]:
+                k += 1
+                continue
+            chain.append(k)
+            if not trail:
+                k = nxt[k]
+                continue
+            # trailing зависит от экстремума с момента входа — ищется только для сделок цепочки
+            e, side, tdist, lim = entries[k] + 1, int(side_all[k]), float(tdist_all[k]), lim_all[k]
+            def tr_hit(a, b):
+                # уровень — от экстремума до предыдущего бара включительно, без заглядывания вперёд
+                if side > 0:
+                    prev = np.concatenate(([-np.inf], np.maximum.accumulate(h[e:b])[:-1]))[a - e:]
+                    return l[a:b] <= prev - tdist
+                prev = np.concatenate(([np.inf], np.minimum.accumulate(l[e:b])[:-1]))[a - e:]
+                return h[a:b] >= prev + tdist
+            tr_i = _scan(tr_hit, e, lim)
+            stop = stop_l[k]
+            if tr_i < lim:
+                ext = float(h[e:tr_i].max() if side > 0 else l[e:tr_i].min())
+                tr_found[k], tr_i_all[k], tr_px_all[k] = True, tr_i, ext - side * tdist
+                stop = tr_i
+            k = bisect_left(entries, stop if tp_l is None else min(stop, tp_l[k]))
+
+        # сделки цепочки — векторно
+        ch = np.asarray(chain, dtype=np.intp)
+        e, side, px = e_all[ch], side_all[ch], px_all[ch]
+        si, en, trf = sl_i[ch], end[ch], tr_found[ch]
+
+        def fill(idx, lvl, worse):
+            # исполнение по уровню или по open при гэпе: стоп — худшая из двух цен, tp — лучшая
+            oo = o[np.minimum(idx, n - 1)]
+            lo, hi = np.minimum(oo, lvl), np.maximum(oo, lvl)
+            return np.where((side > 0) == worse, lo, hi)
+
+        cond = [~trf & (si < en), trf, signal[ch]]
+        stop_i = np.select(cond, [si, tr_i_all[ch], en], n - 1)
+        stop_px = np.select(cond, [fill(si, sl_all[ch], True), fill(tr_i_all[ch], tr_px_all[ch], True),
+                                   o[np.minimum(en, n - 1)]], c[n - 1] if n else np.nan)
+        why = np.select(cond, ["sl", "trailing", "signal"], "end")
+        # tp считается, если коснулся раньше стопа; позиция, дожившая до конца данных, видит и последний бар
+        tp_stop = np.where(why == "end", n, stop_i)
+        legs = []
+        for t, frac in eff:
+            ti = tp_first[t][ch]
+            hit = ti < tp_stop
+            legs.append((frac, np.where(hit, ti, stop_i), np.where(hit, fill(ti, tp_all[t][ch], False), stop_px),
+                         np.where(hit, "tp", why)))
+        if rest:
+            legs.append((rest, stop_i, stop_px, why))
+
+        # размер позиции; pnl на единицу notional известен заранее, pct_balance сцепляет только cash
+        unit = -self.fee + sum(frac * (side * (xp - px) - xp * self.fee) / px for frac, _, xp, _ in legs)
+        if ps["mode"] == "fixed_usdt":
+            notional = np.full(len(ch), float(ps["value"]) * lev)
+        else:
+            notional = np.empty(len(ch))
+            cash = self.balance
+            for m, u in enumerate(unit.tolist()):
+                notional[m] = cash * float(ps["value"]) / 100.0 * lev
+                cash += notional[m] * u
+        qty = notional / px
+        pnl = notional * unit
+
+        # счёт по барам: комиссия входа и закрытия долей — в realized, открытые доли — в unreal на [e, xi)
+        r_at, r_amt = [e], [-notional * self.fee]
+        u_at, u_qty = [], []  # +q с бара входа, -q с бара выхода доли
+        last = e
+        for frac, xi, xp, _ in legs:
+            q = side * qty * frac
+            r_at.append(xi)
+            r_amt.append(q * (xp - px) - side * q * xp * self.fee)
+            u_at += [e, xi]
+            u_qty += [q, -q]
+            last = np.maximum(last, xi)
+        realized = np.bincount(np.concatenate(r_at), np.concatenate(r_amt), minlength=n)[:n]
+        u_at, u_qty = np.concatenate(u_at), np.concatenate(u_qty)
+        open_qty = np.bincount(u_at, u_qty, minlength=n + 1)[:n]
+        open_cost = np.bincount(u_at, u_qty * np.tile(px, 2 * len(legs)), minlength=n + 1)[:n]
+        unreal = c * np.cumsum(open_qty) - np.cumsum(open_cost)
+        equity = self.balance + np.cumsum(realized) + unreal
+        reason = legs[-1][3]
+        trades = [
+            {"side": "LONG" if sd > 0 else "SHORT", "entry_i": ei, "entry_px": ep, "exit_i": xi,
+             "exit_reason": r, "qty": q, "pnl": pl}
+            for sd, ei, ep, xi, r, q, pl in zip(side.tolist(), e.tolist(), px.tolist(), last.tolist(),
+                                                reason.tolist(), qty.tolist(), pnl.tolist())
+        ]
+        return {"trades": trades, "equity": equity, "stats": stats(trades, equity, self.balance)}
+
+def stats(trades: List[Dict[str, Any]], equity: np.ndarray, balance: float) -> Dict[str, Any]:
+    pnl = np.array([t["pnl"] for t in trades], dtype=np.float64)
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl < 0]
+    final = float(equity[-1]) if len(equity) else balance
+    peak = np.maximum.accumulate(equity) if len(equity) else np.array([balance])
+    dd = float(((peak - equity) / peak).max()) if len(equity) else 0.0
+    return {
+        "trades": int(len(pnl)),
+        "win_rate": float(len(wins) / len(pnl)) if len(pnl) else 0.0,
+        "net_pnl": float(pnl.sum()),
+        "return_pct": (final / balance - 1.0) * 100.0,
+        "max_drawdown_pct": dd * 100.0,
+        "profit_factor": float(wins.sum() / -losses.sum()) if len(losses) else (float("inf") if len(wins) else 0.0),
+        "final_equity": final,
+    }
+
+def run_backtest(payload: dict, cols: Mapping[str, np.ndarray], **kw) -> Dict[str, Any]:
+    return Backtest(payload, **kw).run(cols)
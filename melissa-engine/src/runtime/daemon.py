@@ -0,0 +1,293 @@
+"""
+`melissa run`: долгоживущий процесс со стратегиями в памяти.
+
+Корутины в одном event loop:
+  - sync:  фоновый sync раз в `interval` секунд или сразу по событию сервера; если у стратегии
+           сменились semver/ETag, новый бандл читается с диска в потоке и подменяет старый
+           в Scheduler за один шаг цикла (add нового + remove старого без await между ними).
+           Общие узлы индикаторов сохраняют прогрев, догреваются только новые.
+  - feed:  опрос BarStore в потоке по Scheduler.streams() (tf групп и старшие tf их узлов,
+           младшие первыми); новые закрытые бары и тик текущего бара — в очередь.
+  - bars:  разбор очереди: шаги Scheduler и сигналы стратегий. Сеть и диск здесь не трогаются.
+  - events: SSE /v1/devices/{id}/events (grants_changed / artifact_published) будит sync;
+           при обрыве — переподключение с backoff, interval остаётся страховкой.
+
+Группа (symbol, tf), которой нужен прогрев, копит приходящие бары в Scheduler, пока история
+(базовый tf и старшие tf узлов) грузится в потоке; после warm они проигрываются — без
+пропусков и двойного счёта.
+"""
+import asyncio
+import pathlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from src.core.binbundle import load_bundle
+from src.core.rules import compile_rules
+from src.core.state import find_bundle, load_cache, semver_key
+from src.data.bars import FIELDS, TF_MS, BarStore
+from src.runtime.loader import make_client, sse_events
+from src.runtime.scheduler import Scheduler, strategy_key
+from src.runtime.sync import shutdown_pool, sync_once
+
+Group = Tuple[str, str]
+
+def _read_bundle(path: pathlib.Path) -> dict:
+    bundle = load_bundle(path)
+    # .mlb читается через mmap с ленивыми секциями: разбираем всё здесь, в потоке, чтобы
+    # event loop не трогал диск при первом обращении к секции
+    bundle = {**bundle, "payload": dict(bundle["payload"])}
+    compile_rules(bundle)  # план попадает в кеш по manifest.hash заранее, вне цикла баров
+    return bundle
+
+class Daemon:
+    def __init__(self, cfg: dict, dev: dict, interval: float = 60.0, concurrency: int = 8,
+                 poll: float = 1.0, warmup_bars: int = 5000, store: Optional[BarStore] = None):
+        self.cfg = cfg
+        self.dev = dev
+        self.interval = interval
+        self.concurrency = concurrency
+        self.poll = poll
+        self.warmup_bars = warmup_bars
+        self.store = store or BarStore()
+        self.sch = Scheduler()
+        self.bundles: Dict[str, dict] = {}                 # strategy_id -> бандл в работе
+        self.active: Dict[str, Tuple[str, Any]] = {}       # strategy_id -> (semver, etag)
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+        self.cursor: Dict[Group, int] = {}                 # поток -> последний ts, отданный feed'ом
+        self.warming: Set[Group] = set()                   # группы, чья история грузится
+        self.tasks: Set[asyncio.Task] = set()              # фоновые загрузки истории (держим ссылки)
+        self.locks: Dict[Group, threading.Lock] = {}       # поток -> чтение BarStore (load/resample)
+        self.ticks: Dict[Group, Any] = {}
+        self.kick = asyncio.Event()                        # событие сервера -> внеплановый sync
+        self.last_event_id: Optional[str] = None
+
+    def log(self, msg: str) -> None:
+        print(time.strftime("%H:%M:%S"), msg, flush=True)
+
+    # --- стратегии -----------------------------------------------------------------
+
+    def swap(self, sid: str, semver: str, etag: Any, bundle: dict) -> None:
+        """Атомарная подмена версии стратегии (вызывается только из event loop)."""
+        new_key = strategy_key(bundle)
+        old = self.bundles.get(sid)
+        self.sch.add(bundle)
+        if old is not None and strategy_key(old) != new_key:
+            self.sch.remove(strategy_key(old))
+        self.bundles[sid] = bundle
+        self.active[sid] = (semver, etag)
+        self.log(f"🔁 {sid}: {strategy_key(old) if old else '-'} -> {new_key}")
+        self._request_warm()
+
+    def retire(self, sid: str) -> None:
+        old = self.bundles.pop(sid, None)
+        self.active.pop(sid, None)
+        if old is not None:
+            self.sch.remove(strategy_key(old))
+            self.log(f"⏹  {sid}: grant removed")
+
+    async def _load_local(self) -> None:
+        # старт без сети: по одной (старшей) версии на стратегию из cache.json
+        cache = await asyncio.to_thread(load_cache)
+        latest: Dict[str, str] = {}
+        for key in cache:
+            if key.startswith("_"):
+                continue  # служебные записи (курсор дельты)
+            sid, _, semver = key.partition(":")
+            if sid not in latest or semver_key(semver) > semver_key(latest[sid]):
+                latest[sid] = semver
+        for sid, semver in latest.items():
+            path = find_bundle(sid, semver)
+            if path is None:
+                continue
+            try:
+                bundle = await asyncio.to_thread(_read_bundle, path)
+                self.swap(sid, semver, cache[f"{sid}:{semver}"].get("etag"), bundle)
+            except Exception as e:
+                self.log(f"⚠️  {sid}@{semver}: {e}")
+
+    async def _sync_pass(self, client) -> None:
+        results = await sync_once(client, self.cfg, self.dev, self.concurrency, log=lambda m: None)
+        seen = set()
+        for res in results:
+            sid = res["strategy_id"]
+            seen.add(sid)
+            if res["status"] not in ("cached", "downloaded"):
+                if res["status"] == "failed":
+                    self.log(f"⚠️  {sid}@{res['semver']}: {res.get('error')}")
+                continue
+            if self.active.get(sid) == (res["semver"], res["etag"]):
+                continue
+            if res.get("path") is None:
+                # 304 без файла на диске: бандл перекачается на следующем sync, остальные не ждут
+                self.log(f"⚠️  {sid}@{res['semver']}: bundle file missing")
+                continue
+            try:
+                bundle = await asyncio.to_thread(_read_bundle, res["path"])
+                self.swap(sid, res["semver"], res["etag"], bundle)
+            except Exception as e:
+                # битый бандл одной стратегии не отменяет подмены остальных и retire
+                self.log(f"⚠️  {sid}@{res['semver']}: {e}")
+        for sid in list(self.bundles):
+            if sid not in seen:
+                self.retire(sid)
+
+    async def _sync_loop(self) -> None:
+        async with make_client(max_connections=self.concurrency) as client:
+            while True:
+                try:
+                    await self._sync_pass(client)
+                except Exception as e:
+                    self.log(f"⚠️  sync failed: {e}")
+                try:
+                    await asyncio.wait_for(self.kick.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.kick.clear()
+
+    async def _events_loop(self) -> None:
+        base = self.cfg["api_base"].rstrip("/")
+        url = f"{base}/v1/devices/{self.dev['device_id']}/events"
+        headers = {"Authorization": f"Device {self.dev['device_token']}"}
+        backoff = 1.0
+        async with make_client(max_connections=1) as client:
+            while True:
+                try:
+                    async for ev_id, ev, _ in sse_events(client, url, headers, self.last_event_id):
+                        backoff = 1.0
+                        self.last_event_id = ev_id or self.last_event_id
+                        self.log(f"📨 {ev}")
+                        self.kick.set()
+                except Exception as e:
+                    self.log(f"⚠️  events: {e or type(e).__name__}; retry in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    # --- прогрев -------------------------------------------------------------------
+
+    def _request_warm(self) -> None:
+        for (symbol, tf), g in self.sch.groups.items():
+            grp = (symbol, tf)
+            if grp in self.warming or not self.sch.needs_warm(symbol, tf):
+                continue
+            self.warming.add(grp)
+            htf = self.sch.higher_tfs(symbol, tf)
+            task = asyncio.get_running_loop().create_task(self._load_history(grp, htf, self.sch.last_ts(symbol, tf)))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def _lock(self, grp: Group) -> threading.Lock:
+        # load/partial старшего tf дописывают его из 1m: потоки прогрева и feed не должны
+        # делать это для одной группы одновременно
+        return self.locks.setdefault(grp, threading.Lock())
+
+    def _tail(self, symbol: str, tf: str, end: Optional[int]) -> Dict[str, np.ndarray]:
+        with self._lock((symbol, tf)):
+            cols = self.store.load(symbol, tf, end=None if end is None else end + 1)
+            k = max(0, len(cols["ts"]) - self.warmup_bars)
+            return {f: np.array(a[k:]) for f, a in cols.items()}
+
+    def _history(self, grp: Group, htf: List[str], end: Optional[int]) -> tuple:
+        # старшие tf — только бары, закрывшиеся не позже последнего базового (как их видит batch)
+        cols = self._tail(grp[0], grp[1], end)
+        if not len(cols["ts"]):
+            return cols, {}
+        close = int(cols["ts"][-1]) + TF_MS[grp[1]]
+        return cols, {t: self._tail(grp[0], t, close - TF_MS[t]) for t in htf}
+
+    def _history_empty(self) -> Dict[str, np.ndarray]:
+        return {f: np.empty(0, dtype=dt) for f, dt in FIELDS.items()}
+
+    async def _load_history(self, grp: Group, htf: List[str], end: Optional[int]) -> None:
+        try:
+            hist = await asyncio.to_thread(self._history, grp, htf, end)
+        except Exception as e:
+            self.log(f"⚠️  warm-up {grp[0]} {grp[1]} failed: {e}")
+            hist = None
+        await self.queue.put(("warm", grp, hist))
+
+    # --- бары ----------------------------------------------------------------------
+
+    def _read_new(self, cursor: Dict[Group, int], ticks: Dict[Group, Any],
+                  groups: Set[Group]) -> Tuple[List[tuple], Dict[Group, int]]:
+        """
+        В потоке: новые бары по потокам из снимка cursor (читается только хвост после курсора)
+        и изменившиеся тики групп. Младшие tf читаются первыми: закрытый базовый бар означает,
+        что старший, закрывшийся вместе с ним, уже на диске. Курсоры и тики не трогает —
+        новые значения применяет event loop.
+        """
+        bars, out, moved = [], [], {}
+        for grp in sorted(cursor, key=lambda st: TF_MS.get(st[1], 0)):
+            with self._lock(grp):
+                cols = self.store.load(grp[0], grp[1], start=cursor[grp] + 1)
+                cols = {f: np.array(a) for f, a in cols.items()}
+                tick = self.store.partial(grp[0], grp[1]) if grp in groups else None
+            if len(cols["ts"]):
+                moved[grp] = int(cols["ts"][-1])
+                bars.append(("bars", grp, cols))
+            if tick and tick != ticks.get(grp):
+                out.append(("tick", grp, tick))
+        # в очередь — наоборот, старшие первыми: Scheduler придержит их до нужного базового бара
+        return bars[::-1] + out, moved
+
+    async def _feed_loop(self) -> None:
+        while True:
+            try:
+                items, moved = await asyncio.to_thread(self._read_new, dict(self.cursor), dict(self.ticks),
+                                                      set(self.sch.groups))
+                for grp, ts in moved.items():
+                    self.cursor[grp] = max(self.cursor.get(grp, ts), ts)
+                for item in items:
+                    if item[0] == "tick":
+                        self.ticks[item[1]] = item[2]
+                    await self.queue.put(item)
+            except Exception as e:
+                self.log(f"⚠️  feed failed: {e}")
+            await asyncio.sleep(self.poll)
+
+    def _signals(self, grp: Group, ts: int, out: Dict[str, Dict[str, Any]], closed: bool) -> None:
+        for key, res in out.items():
+            sig = res["signals"]
+            for rid in sig["entries"]:
+                self.log(f"📣 {key} {grp[0]} {grp[1]} ts={ts} ENTRY {rid}{'' if closed else ' (forming)'}")
+            for rid in sig["exits"]:
+                self.log(f"📣 {key} {grp[0]} {grp[1]} ts={ts} EXIT {rid}{'' if closed else ' (forming)'}")
+
+    def _apply_bars(self, grp: Group, cols: Dict[str, np.ndarray]) -> None:
+        # повторы и бары непрогретой группы отсеивает/копит Scheduler
+        fields = [f for f in cols if f != "ts"]
+        for i in range(len(cols["ts"])):
+            ts = int(cols["ts"][i])
+            bar = {f: float(cols[f][i]) for f in fields}
+            bar["ts"] = ts
+            self._signals(grp, ts, self.sch.on_bar(grp[0], grp[1], bar), True)
+
+    async def _bar_loop(self) -> None:
+        while True:
+            kind, grp, data = await self.queue.get()
+            if kind == "warm":
+                self.warming.discard(grp)
+                # истории нет/не прочиталась — старт с нуля
+                cols, tfc = data if data is not None else (self._history_empty(), {})
+                for ts, out in self.sch.warm(grp[0], grp[1], cols, tfc):
+                    self._signals(grp, ts, out, True)
+                last = self.sch.last_ts(*grp)
+                self.cursor.setdefault(grp, -1 if last is None else last)
+                for t, c in tfc.items():
+                    self.cursor.setdefault((grp[0], t), int(c["ts"][-1]) if len(c["ts"]) else -1)
+                self.log(f"🔥 warmed {grp[0]} {grp[1]} on {len(cols['ts'])} bars")
+                self._request_warm()  # пока грузили, могли прийти новые бандлы
+            elif kind == "bars":
+                self._apply_bars(grp, data)
+            elif kind == "tick" and not self.sch.needs_warm(*grp):
+                self._signals(grp, int(data["ts"]), self.sch.on_bar(grp[0], grp[1], data, closed=False), False)
+
+    async def run(self) -> None:
+        await self._load_local()
+        self.log(f"▶️  running {len(self.bundles)} strategies; sync every {self.interval:.0f}s")
+        try:
+            await asyncio.gather(self._sync_loop(), self._events_loop(), self._feed_loop(), self._bar_loop())
+        finally:
+            shutdown_pool()
@@ -1,18 +1,113 @@
+import gzip
+import importlib.util
+import json
+
 import httpx
 
-async def post_json(url: str, data: dict) -> dict:
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, json=data)
-        r.raise_for_status()
-        return r.json()
+# что умеем распаковать: httpx сам снимает Content-Encoding (zstd — при установленном zstandard)
+ACCEPT_ENCODING = "zstd, gzip" if importlib.util.find_spec("zstandard") else "gzip"
+BATCH_ENCODINGS = [e.strip() for e in ACCEPT_ENCODING.split(",")]
+
+def make_client(max_connections: int = 10, timeout: float = 30) -> httpx.AsyncClient:
+    """
+    Общий keep-alive клиент с пулом соединений: один TCP+TLS хендшейк на соединение,
+    а не на каждый запрос. Закрывать через `async with`.
+    """
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+async def post_json(url: str, data: dict, client: httpx.AsyncClient | None = None) -> dict:
+    if client is None:
+        async with httpx.AsyncClient(timeout=30) as c:
+            return await post_json(url, data, client=c)
+    r = await client.post(url, json=data)
+    r.raise_for_status()
+    return r.json()
 
-async def get_bytes(url: str, etag: str | None = None) -> tuple[int, bytes | None, str | None]:
-    headers = {}
+async def get_bytes(url: str, etag: str | None = None, client: httpx.AsyncClient | None = None,
+                    accept: str | None = None, params: dict | None = None) -> tuple[int, bytes | None, httpx.Headers]:
+    """(status, тело, заголовки ответа); 304 — тела нет."""
+    if client is None:
+        async with httpx.AsyncClient(timeout=30) as c:
+            return await get_bytes(url, etag=etag, client=c, accept=accept, params=params)
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    if accept:
+        headers["Accept"] = accept
     if etag:
         headers["If-None-Match"] = etag
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, headers=headers)
-        if r.status_code == 304:
-            return 304, None, None
+    r = await client.get(url, headers=headers, params=params)
+    if r.status_code == 304:
+        return 304, None, r.headers
+    r.raise_for_status()
+    return r.status_code, r.content, r.headers
+
+async def sse_events(client: httpx.AsyncClient, url: str, headers: dict | None = None,
+                     last_id: str | None = None, read_timeout: float = 60):
+    """
+    Поток Server-Sent Events: yield (id, event, data). Комментарии-пинги не отдаются,
+    но держат read_timeout — мёртвое соединение отвалится с ошибкой, а не повиснет.
+    """
+    headers = dict(headers or {}, Accept="text/event-stream")
+    if last_id:
+        headers["Last-Event-ID"] = last_id
+    timeout = httpx.Timeout(10, read=read_timeout)
+    async with client.stream("GET", url, headers=headers, timeout=timeout) as r:
+        r.raise_for_status()
+        ev_id, ev, data = None, "message", []
+        async for line in r.aiter_lines():
+            if not line:
+                if data:
+                    yield ev_id, ev, "\n".join(data)
+                ev, data = "message", []
+                continue
+            if line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "id":
+                ev_id = value
+            elif field == "event":
+                ev = value
+            elif field == "data":
+                data.append(value)
+
+def decode_body(encoding: str, body: bytes) -> bytes:
+    """Тело кадра batch-ответа: сервер отдаёт готовый сжатый вариант, распаковываем сами."""
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+async def batch_frames(client: httpx.AsyncClient, url: str, items: list[dict], headers: dict | None = None,
+                       fmt: str = "json"):
+    """
+    POST /v1/artifacts/batch: yield (header, body) по мере прихода кадров, не дожидаясь конца ответа.
+    Кадр — строка-заголовок JSON и ровно header["size"] байт. Последний — {"end": true}; если поток
+    оборвался раньше, бросаем ошибку (уже отданные кадры остаются валидными).
+    """
+    async with client.stream("POST", url, json={"items": items, "encodings": BATCH_ENCODINGS, "format": fmt},
+                             headers=headers) as r:
         r.raise_for_status()
-        return r.status_code, r.content, r.headers.get("ETag")
+        buf = bytearray()
+        header = None
+        async for chunk in r.aiter_bytes():
+            buf += chunk
+            while True:
+                if header is None:
+                    nl = buf.find(b"\n")
+                    if nl < 0:
+                        break
+                    header = json.loads(buf[:nl])
+                    del buf[:nl + 1]
+                    if header.get("end"):
+                        return
+                size = header.get("size", 0)
+                if len(buf) < size:
+                    break
+                body = bytes(buf[:size])
+                del buf[:size]
+                yield header, body
+                header = None
+    raise httpx.RemoteProtocolError("batch response ended without end frame")
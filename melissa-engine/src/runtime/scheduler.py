@@ -0,0 +1,338 @@
+"""
+Планировщик нескольких стратегий на общих символах/таймфреймах.
+
+Графы индикаторов всех бандлов группы (symbol, tf) сливаются в один граф без дублей:
+узел идентифицируется ключом (type, inputs, params, tf) — с развёрнутыми ссылками на
+другие узлы и подставленными параметрами по умолчанию. Поэтому `EMA(close, 200)` из
+десятка стратегий считается один раз за бар (batch — IndicatorGraph, live — StreamingGraph),
+а каждая стратегия видит результат под своими локальными именами.
+
+Узел со своим старшим `tf` входит в ключ под этим tf и в live питается собственным потоком
+(symbol, tf): закрытый старший бар ждёт в очереди группы и применяется перед первым базовым
+баром, закрывшимся не раньше него — ровно то, что видит batch-выравнивание (IndicatorGraph._align).
+Потоки, которые нужно подавать в on_bar, перечисляет streams().
+
+Пока группа не прогрета (или в ней есть холодные узлы), её базовые бары копятся и
+проигрываются после warm; повторно пришедшие бары (ts не новее учтённого) пропускаются.
+"""
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+from src.core.indicators import COLUMNS, FIELDS, IndicatorGraph
+from src.core.rules import RulePlan, compile_rules
+from src.core.stream import StreamingGraph
+from src.data.bars import TF_MS
+from src.runtime.backtest import tf_columns as _resampled
+
+def _norm(v: Any) -> Any:
+    # 200 и 200.0 — один и тот же параметр
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, dict):
+        return {k: _norm(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_norm(x) for x in v]
+    return v
+
+def strategy_key(bundle: dict) -> str:
+    m = bundle.get("payload", bundle)["manifest"]
+    return f"{m['strategy_id']}@{m['version']}"
+
+def _check_tf(key: str, graph: IndicatorGraph, tf: str) -> None:
+    for nid, n in graph.nodes.items():
+        ntf = n.get("tf") or tf
+        if ntf == tf:
+            continue
+        if ntf not in TF_MS or tf not in TF_MS:
+            raise ValueError(f"{key}: indicator '{nid}': unsupported timeframe '{ntf if ntf not in TF_MS else tf}'")
+        if TF_MS[ntf] < TF_MS[tf]:
+            raise ValueError(f"{key}: indicator '{nid}': tf {ntf} is below the strategy tf {tf}")
+
+Replay = List[Tuple[int, Dict[str, Dict[str, Any]]]]
+
+class _Group:
+    """Общий граф одной пары (symbol, tf) и локальные представления стратегий."""
+
+    def __init__(self, symbol: str, tf: str):
+        self.symbol = symbol
+        self.tf = tf
+        self.nodes: Dict[str, dict] = {}        # canonical id -> узел общего графа
+        self.refs: Dict[str, int] = {}          # canonical id -> сколько стратегий используют
+        self.uses: Dict[str, Set[str]] = {}     # стратегия -> canonical ids
+        self.views: Dict[str, Dict[str, str]] = {}  # стратегия -> {локальная ссылка: общая}
+        self.plans: Dict[str, RulePlan] = {}
+        self.prev: Dict[str, Dict[str, float]] = {}
+        self.graph: Optional[IndicatorGraph] = None
+        self.stream: Optional[StreamingGraph] = None
+        self.cold: Set[str] = set()
+        self.htf: Set[str] = set()                 # старшие tf узлов общего графа
+        self.last: Optional[int] = None            # ts последнего учтённого базового бара
+        self.htf_last: Dict[str, int] = {}         # tf -> ts последнего принятого старшего бара
+        self.pending: Dict[str, List[dict]] = {}   # tf -> закрытые старшие бары, ещё не применённые
+        self.backlog: List[dict] = []              # базовые бары, пришедшие до прогрева
+
+    @property
+    def live(self) -> bool:
+        return self.stream is not None and not self.cold
+
+    def add(self, key: str, bundle: dict) -> None:
+        payload = bundle.get("payload", bundle)
+        local = IndicatorGraph(payload["indicators"])  # валидация ссылок + топопорядок
+        if key in self.uses:
+            self.remove(key, rebuild=False)
+        cid_of: Dict[str, str] = {}
+
+        def canon(ref: str) -> str:
+            if ref in COLUMNS:
+                return ref
+            nid, _, field = ref.partition(".")
+            return f"{cid_of[nid]}.{field or FIELDS[local.nodes[nid]['type']][0]}"
+
+        used = set()
+        for nid in local.order:
+            node = local.nodes[nid]
+            inputs = {name: canon(ref) for name, ref in local.inputs[nid].items()}
+            params = _norm(local.params[nid])
+            ntf = node.get("tf") or None
+            ntf = None if ntf == self.tf else ntf  # tf группы и «без tf» — один узел
+            ident = json.dumps([node["type"], inputs, params, ntf], sort_keys=True, separators=(",", ":"))
+            cid = f"{node['type'].lower()}_{hashlib.sha1(ident.encode()).hexdigest()[:12]}"
+            cid_of[nid] = cid
+            if cid not in self.nodes:
+                self.nodes[cid] = {"id": cid, "type": node["type"], "inputs": inputs, "params": params}
+                if ntf is not None:
+                    self.nodes[cid]["tf"] = ntf
+            used.add(cid)
+
+        for cid in used:
+            self.refs[cid] = self.refs.get(cid, 0) + 1
+        self.uses[key] = used
+
+        view = {c: c for c in COLUMNS}
+        for nid in local.order:
+            view[nid] = canon(nid)
+            for f in FIELDS[local.nodes[nid]["type"]]:
+                view[f"{nid}.{f}"] = f"{cid_of[nid]}.{f}"
+        for name, ref in local.outputs.items():
+            view[name] = canon(ref)
+        self.views[key] = view
+        self.plans[key] = compile_rules(bundle)
+        self._rebuild()
+
+    def remove(self, key: str, rebuild: bool = True) -> None:
+        for cid in self.uses.pop(key, set()):
+            self.refs[cid] -= 1
+            if self.refs[cid] <= 0:
+                del self.refs[cid]
+                del self.nodes[cid]
+        self.views.pop(key, None)
+        self.plans.pop(key, None)
+        self.prev.pop(key, None)
+        if rebuild:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self.htf = {n["tf"] for n in self.nodes.values() if n.get("tf")}
+        for t in list(self.pending):
+            if t not in self.htf:
+                self.pending.pop(t)
+                self.htf_last.pop(t, None)
+        if not self.nodes:
+            self.graph, self.stream, self.cold = None, None, set()
+            return
+        self.graph = IndicatorGraph({"nodes": list(self.nodes.values()), "outputs": {}})
+        if self.stream is not None:
+            # общие узлы переезжают со своим состоянием, прогрев нужен только новым
+            # (узлы, ещё не прогретые с прошлой перестройки, остаются холодными)
+            fresh = StreamingGraph(self.graph)
+            self.cold = fresh.adopt(self.stream) | (self.cold & set(self.nodes))
+            self.stream = fresh
+
+    def view(self, key: str, series: Mapping[str, Any]) -> Dict[str, Any]:
+        return {local: series[shared] for local, shared in self.views[key].items() if shared in series}
+
+    def tf_columns(self, columns: Mapping[str, np.ndarray],
+                   given: Optional[Mapping[str, Mapping[str, np.ndarray]]]) -> Dict[str, Mapping[str, np.ndarray]]:
+        # недостающие старшие tf — ресемплинг базовых колонок
+        out = dict(given or {})
+        if self.htf - set(out):
+            out.update({t: c for t, c in _resampled(self.graph, columns, self.tf).items() if t not in out})
+        return out
+
+    def take_htf(self, tf: str, bar: Mapping[str, float]) -> None:
+        """Закрытый бар старшего tf: в очередь до базового бара, который его увидит."""
+        ts = bar.get("ts")
+        if ts is not None:
+            ts = int(ts)
+            if ts <= self.htf_last.get(tf, -1):
+                return
+            self.htf_last[tf] = ts
+        self.pending.setdefault(tf, []).append(dict(bar))
+        if self.live and self.last is not None:
+            self.drain(self.last + TF_MS[self.tf])  # опоздавший бар: базовый уже прошёл
+
+    def drain(self, close: Optional[int]) -> None:
+        """Применить старшие бары, закрывшиеся не позже `close` (None — все), в порядке закрытия."""
+        due = []
+        for t, bars in self.pending.items():
+            keep = []
+            for b in bars:
+                end = None if b.get("ts") is None else int(b["ts"]) + TF_MS[t]
+                (due if close is None or end is None or end <= close else keep).append((end or 0, t, b))
+            self.pending[t] = [b for _, _, b in keep]
+        for _, t, b in sorted(due, key=lambda x: (x[0], TF_MS[x[1]])):
+            self.stream.update(b, t)
+
+    def step(self, bar: Mapping[str, float], closed: bool) -> Dict[str, Dict[str, Any]]:
+        ts = bar.get("ts")
+        if closed:
+            if ts is not None and self.last is not None and int(ts) <= self.last:
+                return {}  # уже учтено прогревом
+            if self.pending:
+                self.drain(None if ts is None else int(ts) + TF_MS[self.tf])
+        vals = self.stream.update(bar) if closed else self.stream.peek(bar)
+        out = {}
+        for key in self.views:
+            view = self.view(key, vals)
+            out[key] = {"values": view, "signals": self.plans[key].on_bar(view, self.prev.get(key))}
+            if closed:
+                self.prev[key] = view
+        if closed and ts is not None:
+            self.last = int(ts)
+        return out
+
+class Scheduler:
+    """
+    sch.add(bundle)                          # symbol/tf по умолчанию — manifest.assets[0]
+    sch.evaluate(symbol, tf, columns)        # batch: {strategy: {"series", "signals"}}
+    sch.streams()                            # live: какие (symbol, tf) подавать в on_bar
+    sch.warm(symbol, tf, columns, tf_cols)   # live: прогрев общего графа -> проигранные бары
+    sch.on_bar(symbol, tf, bar)              # live: {strategy: {"values", "signals"}}
+
+    tf_cols — {старший tf: колонки с "ts"}; без них старшие бары собираются из columns.
+    """
+
+    def __init__(self):
+        self.groups: Dict[Tuple[str, str], _Group] = {}
+        self.where: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(self, bundle: dict, assets: Optional[Iterable[Tuple[str, str]]] = None) -> str:
+        payload = bundle.get("payload", bundle)
+        key = strategy_key(bundle)
+        if assets is None:
+            a = payload["manifest"]["assets"][0]
+            assets = [(a["symbol"], a["tf"][0])]
+        assets = list(assets)
+        local = IndicatorGraph(payload["indicators"])
+        for _, tf in assets:
+            _check_tf(key, local, tf)  # до любых изменений групп
+        for st in self.where.get(key, []):
+            if st not in assets:
+                self.groups[st].remove(key)
+        for st in assets:
+            self.groups.setdefault(st, _Group(*st)).add(key, bundle)
+        self.where[key] = assets
+        return key
+
+    def remove(self, key: str) -> None:
+        for st in self.where.pop(key, []):
+            self.groups[st].remove(key)
+
+    def strategies(self, symbol: str, tf: str) -> List[str]:
+        g = self.groups.get((symbol, tf))
+        return list(g.views) if g else []
+
+    def shared_nodes(self, symbol: str, tf: str) -> int:
+        g = self.groups.get((symbol, tf))
+        return len(g.nodes) if g else 0
+
+    def streams(self) -> List[Tuple[str, str]]:
+        """Потоки баров для live: tf групп и старшие tf их узлов, по возрастанию tf."""
+        out = set()
+        for (symbol, tf), g in self.groups.items():
+            if g.nodes:
+                out.add((symbol, tf))
+                out.update((symbol, t) for t in g.htf)
+        return sorted(out, key=lambda st: (st[0], TF_MS.get(st[1], 0), st[1]))
+
+    def higher_tfs(self, symbol: str, tf: str) -> List[str]:
+        g = self.groups.get((symbol, tf))
+        return sorted(g.htf, key=TF_MS.get) if g else []
+
+    def last_ts(self, symbol: str, tf: str) -> Optional[int]:
+        g = self.groups.get((symbol, tf))
+        return g.last if g else None
+
+    # --- batch ---------------------------------------------------------------------
+
+    def evaluate(self, symbol: str, tf: str, columns: Mapping[str, np.ndarray],
+                 tf_cols: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None) -> Dict[str, Dict[str, Any]]:
+        g = self.groups.get((symbol, tf))
+        if not g or g.graph is None:
+            return {}
+        series = g.graph.evaluate(columns, g.tf_columns(columns, tf_cols), tf)
+        n = len(series["close"])
+        out = {}
+        for key in g.views:
+            view = g.view(key, series)
+            out[key] = {"series": view, "signals": g.plans[key].signals(view, n)}
+        return out
+
+    # --- live ----------------------------------------------------------------------
+
+    def warm(self, symbol: str, tf: str, columns: Mapping[str, np.ndarray],
+             tf_cols: Optional[Mapping[str, Mapping[str, np.ndarray]]] = None) -> Replay:
+        """
+        Прогрев; после add/remove на живой группе греются только новые узлы.
+        Возвращает [(ts, результат on_bar)] баров, накопленных за время прогрева.
+        """
+        g = self.groups.get((symbol, tf))
+        if not g or g.graph is None:
+            return []
+        tfc = g.tf_columns(columns, tf_cols)
+        if g.stream is None:
+            g.stream = StreamingGraph(g.graph)
+            g.stream.warm(columns, tfc, tf=tf)
+        elif g.cold:
+            g.stream.warm(columns, tfc, only=g.cold, tf=tf)
+        g.cold = set()
+        if "ts" in columns and len(columns["ts"]):
+            g.last = max(g.last if g.last is not None else -1, int(columns["ts"][-1]))
+        for t in g.htf:
+            if len(tfc[t]["ts"]):
+                tail = int(tfc[t]["ts"][-1])
+                g.htf_last[t] = max(g.htf_last.get(t, -1), tail)
+                g.pending[t] = [b for b in g.pending.get(t, []) if b.get("ts") is None or int(b["ts"]) > tail]
+        backlog, g.backlog = g.backlog, []
+        replay = []
+        for bar in backlog:
+            out = g.step(bar, True)
+            if out:
+                replay.append((int(bar.get("ts", -1)), out))
+        return replay
+
+    def needs_warm(self, symbol: str, tf: str) -> bool:
+        g = self.groups.get((symbol, tf))
+        return bool(g and g.graph is not None and not g.live)
+
+    def on_bar(self, symbol: str, tf: str, bar: Mapping[str, float], closed: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Бар потока (symbol, tf): шаг группы этого tf с fan-out по стратегиям, а закрытый бар —
+        ещё и в очереди групп того же символа, чьи узлы считаются на этом tf.
+        closed=False — тик формирующегося бара. bar["ts"] нужен для старших tf и отсева повторов.
+        """
+        if closed:
+            for (sym, gtf), g in self.groups.items():
+                if sym == symbol and tf in g.htf:
+                    g.take_htf(tf, bar)
+        g = self.groups.get((symbol, tf))
+        if not g or g.graph is None:
+            return {}
+        if not g.live:
+            if closed:
+                g.backlog.append(dict(bar))
+            return {}
+        return g.step(bar, closed)
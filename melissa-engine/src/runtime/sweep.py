@@ -0,0 +1,138 @@
+"""
+Перебор параметров индикаторов поверх Backtest на пуле процессов.
+
+Пространство задаётся по ключам "<node_id>.<param>":
+  grid:   {"ef.period": [5, 10, 20], "es.period": [50, 100]}   — декартово произведение
+  random: {"ef.period": [5, 30], "es.period": [40, 200]}       — n случайных точек в [lo, hi]
+          (целые, если обе границы целые)
+
+ts и OHLCV кладутся в shared memory один раз; воркеры получают только словарь параметров варианта
+и возвращают stats, без пиклинга массивов на каждую задачу. Воркер держит LRU результатов
+узлов (NODE_CACHE_MB): узлы, чьи параметры вариант не меняет, считаются один раз на воркер.
+"""
+import copy
+import itertools
+import os
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from src.core.rules import RulePlan, known_refs
+from src.core.indicators import DEFAULT_PARAMS, IndicatorGraph
+from src.runtime.backtest import Backtest, tf_columns
+
+NODE_CACHE_MB = 256  # на воркер
+
+def grid(space: Mapping[str, List[Any]]) -> List[Dict[str, Any]]:
+    keys = list(space)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*(space[k] for k in keys))]
+
+def random_space(space: Mapping[str, List[Any]], n: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        v = {}
+        for k, (lo, hi) in space.items():
+            v[k] = rnd.randint(lo, hi) if isinstance(lo, int) and isinstance(hi, int) else rnd.uniform(lo, hi)
+        out.append(v)
+    return out
+
+def apply_params(payload: dict, variant: Mapping[str, Any]) -> dict:
+    """Копия payload с подставленными params узлов; rules/orders не трогаем."""
+    p = dict(payload)
+    p["indicators"] = copy.deepcopy(payload["indicators"])
+    nodes = {n["id"]: n for n in p["indicators"]["nodes"]}
+    for key, val in variant.items():
+        nid, _, param = key.partition(".")
+        if nid not in nodes or not param:
+            raise ValueError(f"unknown sweep key '{key}'")
+        known = DEFAULT_PARAMS.get(nodes[nid]["type"], {})
+        if param not in known:
+            raise ValueError(f"unknown sweep key '{key}': {nodes[nid]['type']} takes {', '.join(sorted(known))}")
+        nodes[nid].setdefault("params", {})[param] = val
+    return p
+
+# --- воркер ------------------------------------------------------------------------
+
+_W: Dict[str, Any] = {}
+
+class _NodeCache(OrderedDict):
+    """LRU результатов узлов с лимитом по байтам массивов."""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.size = 0
+
+    def __getitem__(self, key):
+        self.move_to_end(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, res):
+        super().__setitem__(key, res)
+        self.size += sum(a.nbytes for a in res.values())
+        while self.size > self.limit and len(self) > 1:
+            _, old = self.popitem(last=False)
+            self.size -= sum(a.nbytes for a in old.values())
+
+def _close() -> None:
+    # сначала отпускаем массивы поверх буферов, иначе close() — BufferError
+    shms = _W.get("shms", [])
+    _W.clear()
+    for shm in shms:
+        shm.close()
+
+def _init(shm_meta: Dict[str, Tuple[str, Tuple[int, ...], str]], payload: dict, bt_kw: dict) -> None:
+    shms, cols = [], {}
+    for f, (name, shape, dtype) in shm_meta.items():
+        shm = shared_memory.SharedMemory(name=name)
+        shms.append(shm)
+        cols[f] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _W.update(
+        shms=shms, cols=cols, payload=payload, bt_kw=bt_kw,
+        # rules от параметров индикаторов не зависят — компилируем один раз на воркер
+        plan=RulePlan(payload["rules"], known_refs(payload["indicators"])),
+        # как и бары старших tf: вариант меняет params, но не tf узлов
+        htf=tf_columns(IndicatorGraph(payload["indicators"]), cols, bt_kw.get("tf")),
+        memo=_NodeCache(NODE_CACHE_MB << 20),
+    )
+    # atexit в воркерах пула не вызывается, Finalize с приоритетом — вызывается
+    util.Finalize(None, _close, exitpriority=10)
+
+def _run_variant(variant: Dict[str, Any]) -> Dict[str, Any]:
+    bt = Backtest(apply_params(_W["payload"], variant), plan=_W["plan"], **_W["bt_kw"])
+    return bt.run(_W["cols"], _W["htf"], _W["memo"])["stats"]
+
+def run_sweep(
+    payload: dict,
+    cols: Mapping[str, np.ndarray],
+    variants: List[Dict[str, Any]],
+    workers: Optional[int] = None,
+    **bt_kw,
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Прогнать варианты параллельно; результат — [(variant, stats)] в порядке variants."""
+    workers = workers or os.cpu_count() or 1
+    apply_params(payload, {k: None for v in variants for k in v})  # опечатка в ключе — до запуска пула
+    shms: List[shared_memory.SharedMemory] = []
+    meta = {}
+    try:
+        for f in ("ts", "open", "high", "low", "close", "volume"):
+            if f not in cols:
+                continue
+            a = np.ascontiguousarray(cols[f], dtype=np.int64 if f == "ts" else np.float64)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+            shms.append(shm)
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[:] = a
+            meta[f] = (shm.name, a.shape, a.dtype.str)
+        chunk = max(1, len(variants) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(meta, payload, bt_kw)) as ex:
+            results = list(ex.map(_run_variant, variants, chunksize=chunk))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return list(zip(variants, results))
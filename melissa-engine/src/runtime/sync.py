@@ -0,0 +1,308 @@
+"""
+Синхронизация грантов устройства: дельта списка стратегий -> batch-загрузка изменившихся артефактов
+(или условные GET на старом сервере) -> проверка -> диск.
+Общая часть для `melissa sync` и фонового sync в `melissa run`.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List
+
+import httpx
+
+from src.core.binbundle import MAGIC, MEDIA_TYPE, BinBundle
+from src.core.delta import apply_patch
+from src.core.schema import validate_payload_parts
+from src.core.state import bundle_path, find_bundle, load_cache, save_cache, semver_key, write_bytes_atomic
+from src.core.verify import verify_bundle
+from src.runtime.loader import get_bytes, batch_frames, decode_body
+
+DELTA_KEY = "_delta"  # служебный ключ cache.json: {"cursor", "items": {sid: item}, "retry": [sid]}
+BATCH_MAX_ITEMS = 500  # столько же принимает сервер в одном POST /v1/artifacts/batch
+VERIFY_POOL_MIN = 32   # с такого размера batch проверка бандлов уходит в пул процессов
+VERIFY_WORKERS = os.cpu_count() or 1
+
+_pool: ProcessPoolExecutor | None = None
+
+def verify_pool() -> ProcessPoolExecutor:
+    """
+    Пул процессов для CPU-части синка больших batch (распаковка, патч, sha256, ed25519, schema):
+    event loop тем временем читает следующие кадры, проверка идёт параллельно на всех ядрах.
+    Создаётся при первом большом batch и живёт до shutdown_pool() в конце `melissa sync` / `melissa run`;
+    spawn — в `melissa run` уже есть потоки.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=VERIFY_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool() -> None:
+    """Останавливает пул verify_pool(), если он создавался; следующий большой batch создаст новый."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def store_bundle(sid: str, semver: str, body: bytes, pubkey_b64: str, encoding: str = "identity") -> pathlib.Path:
+    # CPU-часть синка (unzip + schema + sha256/ed25519) — гоняем в потоке, чтобы не стопорить загрузки
+    raw = decode_body(encoding, body)
+    if raw[:4] == MAGIC:
+        # .mlb: подпись — по каноническому блоку как есть, без пересериализации payload
+        bb = BinBundle(raw)
+        bb.verify(pubkey_b64)
+        validate_payload_parts(bb.bundle()["payload"], bb.header["hash"])
+        path = bundle_path(sid, semver, "mlb")
+    else:
+        # старый сервер отдал JSON: проверяем как раньше, на диск — полученные байты без переформатирования
+        bundle = json.loads(raw.decode("utf-8"))
+        verify_bundle(bundle, pubkey_b64)
+        validate_payload_parts(bundle["payload"], bundle["payload"]["manifest"]["hash"])
+        path = bundle_path(sid, semver)
+    write_bytes_atomic(path, raw)
+    return path
+
+def store_patched(sid: str, semver: str, base_semver: str, patch: bytes, pubkey_b64: str,
+                  encoding: str = "identity") -> pathlib.Path:
+    # патч накладывается на сохранённый .mlb базовой версии; результат проверяется как полный файл
+    raw = apply_patch(bundle_path(sid, base_semver, "mlb").read_bytes(), decode_body(encoding, patch))
+    return store_bundle(sid, semver, raw, pubkey_b64)
+
+def _delta_base(sid: str, semver: str, cache: dict) -> str | None:
+    """Старшая из уже сохранённых (.mlb) версий стратегии — от неё сервер может прислать патч."""
+    have = [v for key in cache if not key.startswith("_")
+            for s, _, v in [key.partition(":")] if s == sid and v != semver]
+    have = [v for v in have if bundle_path(sid, v, "mlb").exists()]
+    return max(have, key=semver_key) if have else None
+
+async def sync_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, base: str, item: dict, cache: dict,
+                   pubkey_b64: str, log: Callable[[str], None] = print) -> Dict[str, object]:
+    """
+    Один грант. Результат: {"strategy_id", "semver", "status", "etag", "path"},
+    status: none | cached | downloaded | failed.
+    Новой версии просим патч от сохранённой старшей (?base=, как "base" в batch); сервер отдаёт
+    его с X-Delta-Base, иначе — файл целиком. Патч не сошёлся — качаем целиком.
+    """
+    sid = item["strategy_id"]
+    art = item.get("artifact")
+    if not art:
+        log(f"- {sid}: no artifact (pinned/latest not set or no versions)")
+        return {"strategy_id": sid, "semver": None, "status": "none"}
+    semver = art["semver"]
+    url = base + art["url"]
+    cache_key = f"{sid}:{semver}"
+    path = find_bundle(sid, semver)
+    # etag шлём, только если бандл на диске: иначе 304 оставит нас без файла
+    etag = cache.get(cache_key, {}).get("etag") if path else None
+    res = {"strategy_id": sid, "semver": semver, "etag": etag, "path": path}
+    base_semver = _delta_base(sid, semver, cache) if not path else None
+    via = ""
+    try:
+        async with sem:
+            status, body, headers = await get_bytes(url, etag=etag, client=client, accept=MEDIA_TYPE,
+                                                    params={"base": base_semver} if base_semver else None)
+            if status == 304:
+                log(f"- {sid}@{semver}: 304 (cached)")
+                return {**res, "status": "cached"}
+            got_base = headers.get("X-Delta-Base")
+            try:
+                if got_base:
+                    path = await asyncio.to_thread(store_patched, sid, semver, got_base, body, pubkey_b64)
+                    via = f" (patch from {got_base})"
+            except Exception as e:
+                log(f"- {sid}@{semver}: patch from {got_base} failed ({e}), full download")
+                got_base = None
+                status, body, headers = await get_bytes(url, client=client, accept=MEDIA_TYPE)
+            if not got_base:
+                path = await asyncio.to_thread(store_bundle, sid, semver, body, pubkey_b64)
+    except Exception as e:
+        # ошибка одной стратегии не валит весь sync
+        log(f"- {sid}@{semver}: failed: {e}")
+        return {**res, "status": "failed", "error": str(e)}
+    new_etag = headers.get("ETag")
+    cache[cache_key] = {"etag": new_etag}
+    log(f"- {sid}@{semver}: downloaded{via}, verified, saved to {path}")
+    return {**res, "status": "downloaded", "etag": new_etag, "path": path}
+
+class BatchUnsupported(Exception):
+    """Сервер без /v1/artifacts/batch — качаем по одному."""
+
+async def sync_batch(client: httpx.AsyncClient, sem: asyncio.Semaphore, base: str, items: List[dict], cache: dict,
+                     pubkey_b64: str, log: Callable[[str], None] = print, delta: bool = True) -> List[Dict[str, object]]:
+    """
+    Гранты с артефактами одним потоковым ответом. Каждый бандл проверяется и пишется в потоке,
+    пока читаются следующие кадры; `sem` ограничивает число бандлов в обработке (и в памяти).
+    Не пришедшие в ответе — не изменились (cached). Обрыв потока — failed для недополученных.
+    delta: для новых версий просим патч от сохранённой старшей версии; не сошёлся — качаем целиком.
+    """
+    pending: Dict[str, Dict[str, object]] = {}
+    by_sid = {item["strategy_id"]: item for item in items}
+    req = []
+    for item in items:
+        sid, semver = item["strategy_id"], item["artifact"]["semver"]
+        path = find_bundle(sid, semver)
+        # etag шлём, только если бандл на диске: иначе нужен сам бандл
+        etag = cache.get(f"{sid}:{semver}", {}).get("etag") if path else None
+        pending[sid] = {"strategy_id": sid, "semver": semver, "etag": etag, "path": path}
+        req.append({"strategy_id": sid, "semver": semver, "etag": etag})
+        base_semver = _delta_base(sid, semver, cache) if delta and not path else None
+        if base_semver:
+            req[-1]["base"] = base_semver
+
+    results: List[Dict[str, object]] = []
+    tasks = []
+    refetch: List[dict] = []
+    loop = asyncio.get_running_loop()
+    pool = verify_pool() if len(items) >= VERIFY_POOL_MIN else None  # маленький batch — хватит потока
+    if pool is not None:
+        sem = asyncio.Semaphore(2 * VERIFY_WORKERS)  # по паре бандлов на воркер: ядра заняты, память ограничена
+
+    async def store(res: Dict[str, object], header: dict, body: bytes) -> None:
+        global _pool
+        sid, semver = res["strategy_id"], res["semver"]
+        enc = header.get("encoding", "identity")
+        try:
+            if header.get("delta_base"):
+                path = await loop.run_in_executor(pool, store_patched, sid, semver, header["delta_base"], body,
+                                                  pubkey_b64, enc)
+            else:
+                path = await loop.run_in_executor(pool, store_bundle, sid, semver, body, pubkey_b64, enc)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool) and _pool is pool:
+                _pool = None  # упавший воркер ломает весь пул — следующий batch создаст новый
+            if header.get("delta_base"):
+                log(f"- {sid}@{semver}: patch from {header['delta_base']} failed ({e}), full download")
+                refetch.append(by_sid[sid])
+                return
+            log(f"- {sid}@{semver}: failed: {e}")
+            results.append({**res, "status": "failed", "error": str(e)})
+            return
+        finally:
+            sem.release()
+        cache[f"{sid}:{semver}"] = {"etag": header.get("etag")}
+        via = f" (patch from {header['delta_base']})" if header.get("delta_base") else ""
+        log(f"- {sid}@{semver}: downloaded{via}, verified, saved to {path}")
+        results.append({**res, "status": "downloaded", "etag": header.get("etag"), "path": path})
+
+    error = None
+    try:
+        async for header, body in batch_frames(client, f"{base}/v1/artifacts/batch", req, fmt="mlb"):
+            res = pending.pop(header["strategy_id"], None)
+            if res is None:
+                continue
+            if header.get("status") != 200:
+                log(f"- {res['strategy_id']}@{res['semver']}: failed: artifact not found")
+                results.append({**res, "status": "failed", "error": "artifact not found"})
+                continue
+            await sem.acquire()
+            tasks.append(asyncio.create_task(store(res, header, body)))
+    except httpx.HTTPStatusError as e:
+        if not tasks and not results and e.response.status_code in (404, 405):
+            raise BatchUnsupported() from e
+        error = e
+    except (httpx.HTTPError, ValueError) as e:
+        error = e
+    await asyncio.gather(*tasks)
+
+    for res in pending.values():
+        if error is not None:
+            log(f"- {res['strategy_id']}@{res['semver']}: failed: {error}")
+            results.append({**res, "status": "failed", "error": str(error)})
+        else:
+            log(f"- {res['strategy_id']}@{res['semver']}: 304 (cached)")
+            results.append({**res, "status": "cached"})
+    if refetch:
+        results += await sync_batch(client, sem, base, refetch, cache, pubkey_b64, log, delta=False)
+    return results
+
+def _local_result(item: dict, cache: dict) -> Dict[str, object] | None:
+    """Грант не менялся с прошлого курсора и бандл уже на диске — сеть не нужна."""
+    sid = item["strategy_id"]
+    art = item.get("artifact")
+    if not art:
+        return {"strategy_id": sid, "semver": None, "status": "none"}
+    semver = art["semver"]
+    entry = cache.get(f"{sid}:{semver}")
+    path = find_bundle(sid, semver)
+    if not entry or not path:
+        return None
+    return {"strategy_id": sid, "semver": semver, "etag": entry.get("etag"), "path": path, "status": "cached"}
+
+async def _fetch_items(client: httpx.AsyncClient, base: str, dev: dict, delta: dict):
+    """
+    (items, changed, state): дельта с сервера поверх локального списка; state — {"cursor"} для DELTA_KEY.
+    Сервер без /changes — полный список с If-None-Match (state — {"etag"}): 304 — список прежний,
+    иначе все элементы считаются изменёнными. state=None — запоминать нечего.
+    """
+    headers = {"Authorization": f"Device {dev['device_token']}"}
+    r = await client.get(f"{base}/v1/devices/{dev['device_id']}/changes",
+                         params={"cursor": delta.get("cursor", 0)}, headers=headers)
+    if r.status_code == 404:
+        if delta.get("etag") and "items" in delta:
+            headers["If-None-Match"] = delta["etag"]
+        r = await client.get(f"{base}/v1/devices/{dev['device_id']}/strategies", headers=headers)
+        if r.status_code == 304:
+            return dict(delta["items"]), set(delta.get("retry", [])), {"etag": delta["etag"]}
+        r.raise_for_status()
+        items = {it["strategy_id"]: it for it in r.json()}
+        etag = r.headers.get("ETag")
+        return items, set(items), {"etag": etag} if etag else None
+    r.raise_for_status()
+    ch = r.json()
+    items = {} if ch["full"] else dict(delta.get("items", {}))
+    for it in ch["items"]:
+        items[it["strategy_id"]] = it
+    changed = {it["strategy_id"] for it in ch["items"]} | set(delta.get("retry", []))
+    return items, changed, {"cursor": ch["cursor"]}
+
+async def sync_once(client: httpx.AsyncClient, cfg: dict, dev: dict, concurrency: int = 1,
+                    log: Callable[[str], None] = print) -> List[Dict[str, object]]:
+    """
+    Полный проход sync; cache.json сохраняется один раз в конце.
+    Курсор дельты (или ETag списка) и последний известный список грантов лежат в cache.json под DELTA_KEY:
+    без изменений на сервере проход — один маленький запрос, без запросов по стратегиям.
+    """
+    base = cfg["api_base"].rstrip("/")
+    concurrency = max(1, concurrency)
+    cache = await asyncio.to_thread(load_cache)
+
+    # 1) что поменялось с прошлого курсора
+    items, changed, state = await _fetch_items(client, base, dev, cache.get(DELTA_KEY) or {})
+
+    # 2) изменившиеся (и без локального бандла) — одним batch-запросом с известными ETag
+    sem = asyncio.Semaphore(concurrency)
+    pubkey = cfg["public_ed25519_pubkey_b64"]
+    results, fetch = [], []
+    for item in items.values():
+        res = _local_result(item, cache) if item["strategy_id"] not in changed else None
+        if res is None and not item.get("artifact"):
+            log(f"- {item['strategy_id']}: no artifact (pinned/latest not set or no versions)")
+            res = {"strategy_id": item["strategy_id"], "semver": None, "status": "none"}
+        if res is None:
+            fetch.append(item)
+        else:
+            results.append(res)
+    try:
+        for i in range(0, len(fetch), BATCH_MAX_ITEMS):
+            results += await sync_batch(client, sem, base, fetch[i:i + BATCH_MAX_ITEMS], cache, pubkey, log)
+    except BatchUnsupported:
+        # старый сервер: условные GET, не более `concurrency` одновременно
+        done = {r["strategy_id"] for r in results}
+        results += await asyncio.gather(*(sync_one(client, sem, base, it, cache, pubkey, log)
+                                          for it in fetch if it["strategy_id"] not in done))
+    order = {sid: i for i, sid in enumerate(items)}
+    results.sort(key=lambda r: order[r["strategy_id"]])
+    unchanged = len(items) - sum(1 for it in items if it in changed)
+    if unchanged:
+        log(f"- {unchanged} unchanged")
+    if state is not None:
+        # упавшие загрузки повторим в следующий раз, даже если сервер о них больше не скажет
+        retry = [r["strategy_id"] for r in results if r["status"] == "failed"]
+        cache[DELTA_KEY] = {**state, "items": items, "retry": retry}
+    else:
+        cache.pop(DELTA_KEY, None)
+    await asyncio.to_thread(save_cache, cache)
+    return results
@@ -0,0 +1,56 @@
+import copy
+
+import numpy as np
+import pytest
+
+@pytest.fixture
+def make_bars():
+    """Синтетические 1m-бары: случайное блуждание с честными high/low."""
+    def make(n: int, seed: int = 0, start: float = 100.0):
+        rng = np.random.default_rng(seed)
+        c = start + np.cumsum(rng.normal(0, 0.1, n))
+        o = np.r_[start, c[:-1]]
+        return {
+            "ts": np.arange(n, dtype=np.int64) * 60_000,
+            "open": o,
+            "high": np.maximum(o, c) + rng.random(n) * 0.05,
+            "low": np.minimum(o, c) - rng.random(n) * 0.05,
+            "close": c,
+            "volume": rng.random(n) * 10,
+        }
+    return make
+
+PAYLOAD = {
+    "manifest": {
+        "strategy_id": "t", "name": "test", "version": "1.0.0", "engine_min": "0.1.0",
+        "created_at": "2025-01-01T00:00:00Z", "permissions": {"place_orders": False},
+        "assets": [{"symbol": "BTCUSDT", "tf": ["1m"]}],
+    },
+    "indicators": {
+        "nodes": [
+            {"id": "ef", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 12}},
+            {"id": "es", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 26}},
+        ],
+        "outputs": {},
+    },
+    "rules": {
+        "entries": [
+            {"id": "L", "side": "LONG", "expr": {"cross_up": ["ef", "es"]}},
+            {"id": "S", "side": "SHORT", "expr": {"cross_down": ["ef", "es"]}},
+        ],
+        "exits": [
+            {"id": "XL", "side": "LONG", "expr": {"cross_down": ["ef", "es"]}},
+            {"id": "XS", "side": "SHORT", "expr": {"cross_up": ["ef", "es"]}},
+        ],
+    },
+    "orders": {
+        "position_sizing": {"mode": "fixed_usdt", "value": 100, "leverage": 1, "max_concurrent": 1, "side": "both"},
+        "sl": {"type": "pct", "value": 1.0},
+        "order_policy": {"post_only": False, "time_in_force": "GTC", "reduce_on_inverse_signal": False,
+                         "one_signal_per_bar": True},
+    },
+}
+
+@pytest.fixture
+def payload():
+    return copy.deepcopy(PAYLOAD)
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from src.core.indicators import ema
+from src.data.bars import TF_MS, aggregate
+from src.runtime.backtest import Backtest, tf_columns
+
+def _masks(bt, cols):
+    series = bt.graph.evaluate(cols)
+    n = len(cols["close"])
+    sig = bt.plan.signals(series, n)
+    sides = {rid: side for rid, side, _ in bt.plan.entries + bt.plan.exits}
+    def any_of(kind, side):
+        out = np.zeros(n, dtype=bool)
+        for rid, m in sig[kind].items():
+            if sides[rid] == side:
+                out |= m
+        return out
+    long_in, short_in = any_of("entries", "LONG"), any_of("entries", "SHORT")
+    both = long_in & short_in
+    return long_in & ~both, short_in & ~both, any_of("exits", "LONG"), any_of("exits", "SHORT")
+
+def reference(bt, cols):
+    """Побарная модель той же семантики (pct SL, pct/rr TP, выход по сигналу, fixed_usdt)."""
+    o, h, l, c = (cols[k] for k in ("open", "high", "low", "close"))
+    n = len(c)
+    long_in, short_in, long_out, short_out = _masks(bt, cols)
+    sl_pct = bt.orders["sl"]["value"]
+    tp_specs = bt.orders.get("tp") or []
+    notional = bt.orders["position_sizing"]["value"]
+    trades, i = [], 0
+    while i < n - 1:
+        if not (long_in[i] or short_in[i]):
+            i += 1
+            continue
+        side = 1 if long_in[i] else -1
+        e = i + 1
+        px = o[e]
+        sl = px - side * px * sl_pct / 100
+        tps, left = [], 1.0
+        for t in tp_specs:
+            dist = t["value"] * abs(px - sl) if t["type"] == "rr" else px * t["value"] / 100
+            frac = min(t.get("size", 1.0 / len(tp_specs)), left)
+            if frac > 0:
+                tps.append([px + side * dist, frac])
+                left -= frac
+        out = long_out if side > 0 else short_out
+        legs = []
+        for b in range(e, n):
+            if b > e and out[b - 1]:
+                legs += [(f, b, o[b], "signal") for _, f in tps] + ([(left, b, o[b], "signal")] if left > 1e-12 else [])
+                break
+            if (l[b] <= sl) if side > 0 else (h[b] >= sl):
+                fill = min(o[b], sl) if side > 0 else max(o[b], sl)
+                legs += [(f, b, fill, "sl") for _, f in tps] + ([(left, b, fill, "sl")] if left > 1e-12 else [])
+                break
+            for tp in list(tps):
+                if (h[b] >= tp[0]) if side > 0 else (l[b] <= tp[0]):
+                    legs.append((tp[1], b, max(o[b], tp[0]) if side > 0 else min(o[b], tp[0]), "tp"))
+                    tps.remove(tp)
+            if not tps and left <= 1e-12:
+                break
+        else:
+            legs += [(f, n - 1, c[-1], "end") for _, f in tps] + ([(left, n - 1, c[-1], "end")] if left > 1e-12 else [])
+        qty = notional / px
+        pnl = -notional * bt.fee + sum(side * qty * f * (xp - px) - qty * f * xp * bt.fee for f, _, xp, _ in legs)
+        last = max(b for _, b, _, _ in legs)
+        trades.append((e, last, pnl))
+        i = last
+    return trades
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("tp", [None, [{"type": "pct", "value": 0.5}],
+                                [{"type": "rr", "value": 1, "size": 0.5}, {"type": "pct", "value": 2}],
+                                [{"type": "rr", "value": 2, "size": 0.3}]])
+def test_matches_bar_by_bar_reference(payload, make_bars, seed, tp):
+    payload["orders"]["sl"] = {"type": "pct", "value": 0.5}
+    if tp:
+        payload["orders"]["tp"] = tp
+    cols = make_bars(3000, seed)
+    bt = Backtest(payload, fee_bps=4)
+    res = bt.run(cols)
+    got = [(t["entry_i"], t["exit_i"], t["pnl"]) for t in res["trades"]]
+    want = reference(bt, cols)
+    assert [g[:2] for g in got] == [w[:2] for w in want]
+    np.testing.assert_allclose([g[2] for g in got], [w[2] for w in want], rtol=1e-9, atol=1e-12)
+    assert res["equity"][-1] == pytest.approx(bt.balance + sum(g[2] for g in got))
+
+def _one_entry(payload, at_close):
+    # вход — пересечение close уровня at_close, без выходов по сигналу
+    payload["rules"] = {"entries": [{"id": "L", "side": "LONG", "expr": {"cross_up": ["close", at_close]}}], "exits": []}
+    return payload
+
+def test_atr_stop_waits_for_warm_atr(payload, make_bars):
+    payload = _one_entry(payload, 100.5)
+    payload["indicators"]["nodes"].append({"id": "atr", "type": "ATR", "params": {"period": 14}})
+    payload["orders"]["sl"] = {"type": "atr_k", "value": 2}
+    cols = make_bars(60, 0)
+    c = np.full(60, 100.0)
+    c[3], c[40] = 101.0, 101.0  # сигналы на 3 (ATR ещё NaN) и на 40
+    cols.update(open=np.r_[100.0, c[:-1]], close=c, high=np.maximum(np.r_[100.0, c[:-1]], c) + 0.1,
+                low=np.minimum(np.r_[100.0, c[:-1]], c) - 0.1)
+    trades = Backtest(payload).run(cols)["trades"]
+    assert [t["entry_i"] for t in trades] == [41]
+    assert trades[0]["exit_reason"] in ("sl", "end")
+
+def test_stop_touched_on_last_bar(payload, make_bars):
+    payload = _one_entry(payload, 100.5)
+    payload["orders"]["sl"] = {"type": "pct", "value": 1.0}
+    n = 30
+    cols = make_bars(n, 0)
+    c = np.full(n, 101.0)
+    c[:5] = 100.0
+    o = np.r_[100.0, c[:-1]]
+    cols.update(open=o, close=c, high=np.maximum(o, c), low=np.minimum(o, c))
+    cols["low"][-1] = 99.0  # вход по open=101 на баре 6, стоп 99.99 задет только последним баром
+    trades = Backtest(payload).run(cols)["trades"]
+    assert len(trades) == 1
+    t = trades[0]
+    assert (t["entry_i"], t["exit_i"], t["exit_reason"]) == (6, n - 1, "sl")
+    assert t["pnl"] == pytest.approx(100.0 / 101.0 * (101.0 * 0.99 - 101.0))
+
+def test_max_concurrent_zero_means_no_entries(payload, make_bars):
+    payload["orders"]["position_sizing"]["max_concurrent"] = 0
+    res = Backtest(payload).run(make_bars(2000, 0))
+    assert res["trades"] == []
+    assert np.all(res["equity"] == res["stats"]["final_equity"])
+
+def test_higher_tf_node_runs_on_resampled_bars(payload, make_bars):
+    payload["indicators"]["nodes"][1]["tf"] = "5m"
+    cols = make_bars(2000, 1)
+    bt = Backtest(payload, tf="1m")
+    series = bt.graph.evaluate(cols, tf_columns(bt.graph, cols, "1m"), "1m")
+    want = ema(aggregate(cols, TF_MS["5m"])["close"], 26)
+    # 1m-бар 5k+4 закрывается вместе с 5m-баром k: раньше значение не видно
+    assert series["es"][5 * 100 + 4] == want[100]
+    assert series["es"][5 * 100 + 3] == want[99]
+    assert bt.run(cols)["stats"]["trades"] > 0
+
+def test_node_tf_below_backtest_tf_is_rejected(payload, make_bars):
+    payload["indicators"]["nodes"][1]["tf"] = "1m"
+    with pytest.raises(ValueError, match="below the backtest tf"):
+        Backtest(payload, tf="5m").run(make_bars(500, 0))
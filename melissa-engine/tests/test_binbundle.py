@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import json
+import pickle
+import struct
+
+import pytest
+from nacl.signing import SigningKey
+
+from src.core.binbundle import MAGIC, BinBundle, load_bundle
+
+from tests.conftest import PAYLOAD
+
+KEY = SigningKey(bytes(range(32)))
+PUB = base64.b64encode(bytes(KEY.verify_key)).decode()
+
+def _mlb(payload: dict, sections=None) -> bytes:
+    # контейнер по формату melissa-api/src/services/binbundle.py
+    canon, secs, parts, pos = None, {}, [], 1
+    for name in sorted(payload):
+        key = json.dumps(name).encode() + b":"
+        blob = json.dumps(payload[name], ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode()
+        pos += len(key)
+        secs[name] = [pos, len(blob)]
+        parts.append(key + blob)
+        pos += len(blob) + 1
+    canon = b"{" + b",".join(parts) + b"}"
+    header = json.dumps({"v": 1, "hash": hashlib.sha256(canon).hexdigest(),
+                         "signature_b64": base64.b64encode(KEY.sign(canon).signature).decode(),
+                         "sections": sections or secs}).encode()
+    return MAGIC + struct.pack("<I", len(header)) + header + canon
+
+def test_mlb_round_trip(tmp_path):
+    p = tmp_path / "b.bundle.mlb"
+    p.write_bytes(_mlb(PAYLOAD))
+    bundle = load_bundle(p)
+    payload = bundle["payload"]
+    assert sorted(payload) == sorted(PAYLOAD)
+    for name in PAYLOAD:
+        want = PAYLOAD[name] if name != "manifest" else {**PAYLOAD[name], "hash": payload[name]["hash"]}
+        assert payload[name] == want
+    # в процесс (sweep) уходит обычный dict
+    assert type(pickle.loads(pickle.dumps(payload))) is dict
+    BinBundle.open(p).verify(PUB)
+
+def test_mlb_tampering_is_detected(tmp_path):
+    blob = _mlb(PAYLOAD)
+    with pytest.raises(ValueError, match="Hash mismatch"):
+        BinBundle(blob[:-2] + b" }").verify(PUB)
+    # диапазоны секций из неподписанного заголовка не могут указывать в чужие байты
+    bb = BinBundle(blob)
+    swapped = dict(bb.sections, rules=bb.sections["orders"], orders=bb.sections["rules"])
+    with pytest.raises(ValueError, match="layout"):
+        BinBundle(_mlb(PAYLOAD, swapped)).verify(PUB)
+    with pytest.raises(ValueError, match="Not a binary bundle"):
+        BinBundle(b"JSON" + blob[4:])
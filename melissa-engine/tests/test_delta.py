@@ -0,0 +1,67 @@
+import asyncio
+import copy
+import hashlib
+import json
+import struct
+
+import httpx
+import pytest
+
+from src.core import state
+from src.core.delta import MAGIC, apply_patch
+from src.runtime.sync import sync_one
+
+from tests.conftest import PAYLOAD
+from tests.test_binbundle import PUB, _mlb
+
+def _patch(base: bytes, target: bytes, cut: int) -> bytes:
+    # общий префикс — копией из базы, остаток — вставкой (формат melissa-api/src/services/delta.py)
+    header = json.dumps({"base_sha256": hashlib.sha256(base).hexdigest(),
+                         "target_sha256": hashlib.sha256(target).hexdigest(),
+                         "target_size": len(target)}).encode()
+    return (MAGIC + struct.pack("<I", len(header)) + header
+            + b"C" + struct.pack("<II", 0, cut) + b"I" + struct.pack("<I", len(target) - cut) + target[cut:])
+
+def _versions():
+    p2 = copy.deepcopy(PAYLOAD)
+    p2["manifest"]["version"] = "1.1.0"
+    base, target = _mlb(PAYLOAD), _mlb(p2)
+    cut = next(i for i, (a, b) in enumerate(zip(base, target)) if a != b)
+    return base, target, cut
+
+def test_apply_patch_round_trip():
+    base, target, cut = _versions()
+    patch = _patch(base, target, cut)
+    assert hashlib.sha256(apply_patch(base, patch)).hexdigest() == hashlib.sha256(target).hexdigest()
+    with pytest.raises(ValueError, match="base mismatch"):
+        apply_patch(target, patch)
+    with pytest.raises(ValueError, match="result mismatch"):
+        apply_patch(base, patch[:-1] + bytes([patch[-1] ^ 1]))
+
+@pytest.mark.parametrize("broken", [False, True])
+def test_sync_one_asks_for_patch(tmp_path, monkeypatch, broken):
+    monkeypatch.setattr(state, "STRAT_DIR", tmp_path)
+    base, target, cut = _versions()
+    patch = _patch(base, target, cut)
+    if broken:
+        patch = patch[:-1] + bytes([patch[-1] ^ 1])
+    state.bundle_path("s", "1.0.0", "mlb").write_bytes(base)
+    seen = []
+
+    def handler(req: httpx.Request) -> httpx.Response:
+        seen.append(req.url.params.get("base"))
+        if req.url.params.get("base") == "1.0.0":
+            return httpx.Response(200, content=patch, headers={"X-Delta-Base": "1.0.0", "ETag": '"t"'})
+        return httpx.Response(200, content=target, headers={"ETag": '"t"'})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as c:
+            item = {"strategy_id": "s", "artifact": {"semver": "1.1.0", "url": "/v1/artifacts/s/1.1.0"}}
+            return await sync_one(c, asyncio.Semaphore(1), "http://api", item, {"s:1.0.0": {}}, PUB,
+                                  log=lambda _: None)
+
+    res = asyncio.run(run())
+    assert res["status"] == "downloaded"
+    # битый патч не сохраняется: повтор без base, на диске — полный файл
+    assert seen == (["1.0.0", None] if broken else ["1.0.0"])
+    assert res["path"].read_bytes() == target
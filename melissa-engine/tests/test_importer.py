@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.data import importer
+from src.data.bars import BarStore
+from src.data.importer import REC, import_file, merge_runs, sorted_unique
+
+def _rec(ts, tag=0.0):
+    r = np.zeros(len(ts), dtype=REC)
+    r["ts"] = ts
+    r["close"] = tag
+    return r
+
+def test_sorted_unique_keeps_first():
+    r = _rec([3, 1, 3, 2, 1])
+    r["close"] = [0, 1, 2, 3, 4]
+    out = sorted_unique(r)
+    assert out["ts"].tolist() == [1, 2, 3]
+    assert out["close"].tolist() == [1, 3, 0]  # при равных ts — первое вхождение
+
+def test_merge_runs_matches_sort():
+    rng = np.random.default_rng(0)
+    runs = [sorted_unique(_rec(rng.choice(5000, 700, replace=False), tag=i)) for i in range(4)]
+    # маленький rows — много шагов слияния с разными окнами
+    got = np.concatenate(list(merge_runs(runs, rows=64)))
+    want = sorted_unique(np.concatenate(runs))  # более ранний прогон побеждает при равных ts
+    assert got["ts"].tolist() == want["ts"].tolist()
+    assert got["close"].tolist() == want["close"].tolist()
+
+T0 = 1_700_000_000_000
+
+def _csv(path, rows):
+    path.write_text("ts,open,high,low,close,volume\n"
+                    + "".join(f"{T0 + t * 60_000},1,1,1,{t},1\n" for t in rows), encoding="utf-8")
+
+def test_resume_after_crash_between_append_and_save(tmp_path, monkeypatch):
+    # 20 повторов и 50 строк назад во времени (уйдут в прогон и слияние)
+    rows = [*range(300), *range(100, 120), *range(350, 400), *range(300, 350)]
+    src = tmp_path / "m1.csv"
+    _csv(src, rows)
+    store = BarStore(tmp_path / "bars")
+    real_save, calls = importer._Import._save, []
+
+    def crashing_save(self):
+        calls.append(1)
+        if len(calls) == 4:  # третий блок уже дописан в хранилище, state — нет
+            raise KeyboardInterrupt
+        real_save(self)
+
+    monkeypatch.setattr(importer._Import, "_save", crashing_save)
+    with pytest.raises(KeyboardInterrupt):
+        import_file(src, "BTCUSDT", store=store, workers=1, chunk_mb=1500 / 2**20)
+    monkeypatch.setattr(importer._Import, "_save", real_save)
+
+    seen = []
+    res = import_file(src, "BTCUSDT", store=store, workers=1, chunk_mb=1500 / 2**20,
+                      progress=lambda st: seen.append(dict(st)))
+    want = sorted(set(rows))
+    assert store.load("BTCUSDT")["ts"].tolist() == [T0 + t * 60_000 for t in want]
+    assert res["read"] == len(rows) and res["added"] == len(want) and res["dups"] == len(rows) - len(want)
+    # счётчик по ходу импорта: повтор блока после обрыва не добавляет дублей
+    assert seen[-1]["dups"] == 20
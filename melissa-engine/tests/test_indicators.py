@@ -0,0 +1,123 @@
+import math
+
+import numpy as np
+import pytest
+
+from src.core import indicators as ind
+from src.core.indicators import IndicatorGraph
+from src.core.stream import StreamingGraph
+
+NODES = {
+    "nodes": [
+        {"id": "ema", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 10}},
+        {"id": "sma", "type": "SMA", "inputs": {"src": "close"}, "params": {"period": 7}},
+        {"id": "rsi", "type": "RSI", "inputs": {"src": "close"}, "params": {"period": 14}},
+        {"id": "macd", "type": "MACD", "inputs": {"src": "close"}, "params": {"fast": 5, "slow": 13, "signal": 4}},
+        {"id": "atr", "type": "ATR", "params": {"period": 14}},
+        {"id": "adx", "type": "ADX", "params": {"period": 9}},
+        # узлы от узлов: сглаживание RSI и линии сигнала MACD
+        {"id": "rsi_s", "type": "SMA", "inputs": {"src": "rsi"}, "params": {"period": 5}},
+        {"id": "hist_e", "type": "EMA", "inputs": {"src": "macd.hist"}, "params": {"period": 3}},
+    ],
+    "outputs": {"trend": "adx", "vol": "atr"},
+}
+
+# --- поштучные эталоны ------------------------------------------------------------
+
+def _seeded_loop(x, period, alpha):
+    out, vals = [math.nan] * len(x), []
+    for i, v in enumerate(x):
+        if math.isnan(v):
+            continue
+        if len(vals) < period:
+            vals.append(v)
+            if len(vals) == period:
+                out[i] = sum(vals) / period
+        else:
+            out[i] = alpha * v + (1 - alpha) * out[i - 1]
+    return np.array(out)
+
+def _sma_loop(x, period):
+    return np.array([sum(x[i - period + 1:i + 1]) / period if i >= period - 1 else math.nan for i in range(len(x))])
+
+def _tr_loop(h, l, c):
+    return np.array([h[0] - l[0]] + [max(h[i] - l[i], abs(h[i] - c[i - 1]), abs(l[i] - c[i - 1]))
+                                     for i in range(1, len(h))])
+
+def test_primitives_match_loops(make_bars):
+    b = make_bars(600)
+    c, h, l = b["close"], b["high"], b["low"]
+    np.testing.assert_allclose(ind.sma(c, 7), _sma_loop(c, 7), rtol=1e-12)
+    np.testing.assert_allclose(ind.ema(c, 10), _seeded_loop(c, 10, 2 / 11), rtol=1e-12)
+    np.testing.assert_allclose(ind.atr(h, l, c, 14), _seeded_loop(_tr_loop(h, l, c), 14, 1 / 14), rtol=1e-12)
+    d = np.r_[math.nan, np.diff(c)]
+    up = _seeded_loop(np.where(np.isnan(d), math.nan, np.maximum(d, 0)), 14, 1 / 14)
+    dn = _seeded_loop(np.where(np.isnan(d), math.nan, np.maximum(-d, 0)), 14, 1 / 14)
+    np.testing.assert_allclose(ind.rsi(c, 14), 100 * up / (up + dn), rtol=1e-12)
+    m = ind.macd(c, 5, 13, 4)
+    # MACD — разность EMA порядка цены (~100): сравнение по абсолютной погрешности от масштаба цены
+    np.testing.assert_allclose(m["macd"], _seeded_loop(c, 5, 2 / 6) - _seeded_loop(c, 13, 2 / 14), atol=1e-12 * 100)
+    np.testing.assert_allclose(m["hist"], m["macd"] - _seeded_loop(m["macd"], 4, 2 / 5), atol=1e-12 * 100)
+    # прогрев: до period валидных значений — NaN
+    assert np.isnan(ind.ema(c, 10)[:9]).all() and not np.isnan(ind.ema(c, 10)[9:]).any()
+
+def test_ewm_long_series_is_stable():
+    # блочный cumsum не переполняется и не копит ошибку на длинных рядах
+    x = np.random.default_rng(1).normal(100, 1, 200_000)
+    got = ind.ema(x, 3)
+    np.testing.assert_allclose(got[-1000:], _seeded_loop(x, 3, 0.5)[-1000:], rtol=1e-12)
+
+def test_graph_order_outputs_and_errors(make_bars):
+    b = make_bars(300)
+    g = IndicatorGraph(NODES)
+    assert g.order.index("rsi") < g.order.index("rsi_s") and g.order.index("macd") < g.order.index("hist_e")
+    s = g.evaluate(b)
+    np.testing.assert_array_equal(s["trend"], s["adx.adx"])
+    np.testing.assert_array_equal(s["rsi_s"], ind.sma(s["rsi"], 5))
+    assert set(ind.compute_indicators({"payload": {"indicators": NODES}}, b)) == {"trend", "vol"}
+
+    bad = [
+        ({"nodes": [{"id": "a", "type": "EMA", "inputs": {"src": "b"}}, {"id": "b", "type": "EMA", "inputs": {"src": "a"}}]},
+         "cycle"),
+        ({"nodes": [{"id": "a", "type": "EMA", "inputs": {"src": "nope"}}]}, "unknown reference"),
+        ({"nodes": [{"id": "a", "type": "MACD", "inputs": {"src": "close"}}], "outputs": {"o": "a.value"}}, "unknown field"),
+        ({"nodes": [{"id": "a", "type": "ATR"}, {"id": "a", "type": "ADX"}]}, "duplicate"),
+        ({"nodes": [{"id": "close", "type": "ATR"}]}, "clashes"),
+        ({"nodes": [{"id": "a", "type": "VWAP"}]}, "unsupported"),
+    ]
+    for spec, msg in bad:
+        with pytest.raises(ValueError, match=msg):
+            IndicatorGraph(spec)
+
+def test_streaming_matches_batch(make_bars):
+    b = make_bars(1000)
+    g = IndicatorGraph(NODES)
+    want = g.evaluate(b)
+    sg = StreamingGraph(g)
+    split = 300
+    sg.warm({k: v[:split] for k, v in b.items()})
+    refs = [r for r in want if r != "ts"]
+    ticks, got = [], []
+    for i in range(split, len(b["ts"])):
+        bar = {k: float(v[i]) for k, v in b.items()}
+        ticks.append([sg.peek(bar)[r] for r in refs])  # peek не двигает состояние
+        vals = sg.update(bar)
+        got.append([vals[r] for r in refs])
+    got = np.array(got)
+    np.testing.assert_array_equal(np.array(ticks), got)
+    for j, ref in enumerate(refs):
+        # atol — от масштаба цены (~100): разности EMA (MACD) теряют относительную точность
+        np.testing.assert_allclose(got[:, j], want[ref][split:], rtol=1e-12, atol=1e-12 * 100, err_msg=ref)
+
+def test_streaming_warm_shorter_than_period(make_bars):
+    # прогрев на истории короче периода: затравка добирается уже в потоке
+    b = make_bars(60)
+    g = IndicatorGraph({"nodes": [{"id": "e", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 20}},
+                                  {"id": "s", "type": "SMA", "inputs": {"src": "close"}, "params": {"period": 20}}]})
+    want = g.evaluate(b)
+    sg = StreamingGraph(g)
+    sg.warm({k: v[:5] for k, v in b.items()})
+    for i in range(5, 60):
+        vals = sg.update({k: float(v[i]) for k, v in b.items()})
+        for ref in ("e", "s"):
+            np.testing.assert_allclose(vals[ref], want[ref][i], rtol=1e-12, atol=1e-12)
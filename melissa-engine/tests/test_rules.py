@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from src.core.indicators import IndicatorGraph
+from src.core.rules import RulePlan, compile_rules, known_refs
+
+INDICATORS = {
+    "nodes": [
+        {"id": "ef", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 5}},
+        {"id": "es", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 15}},
+        {"id": "rsi", "type": "RSI", "inputs": {"src": "close"}, "params": {"period": 7}},
+        {"id": "m", "type": "MACD", "inputs": {"src": "close"}, "params": {"fast": 4, "slow": 9, "signal": 3}},
+    ],
+    "outputs": {"fast": "ef"},
+}
+
+RULES = {
+    "entries": [
+        {"id": "L", "side": "LONG", "expr": {"and": [{"cross_up": ["fast", "es"]}, {"lt": ["rsi", 70]}]}},
+        {"id": "S", "side": "SHORT", "expr": {"or": [{"cross_down": ["ef", "es"]},
+                                                    {"gt": [{"sub": ["close", {"prev": "close"}]}, 0.15]}]}},
+    ],
+    "exits": [
+        {"id": "XL", "side": "LONG", "expr": {"lt": ["m.hist", {"neg": {"abs": {"mul": [0.5, "m.signal"]}}}]}},
+    ],
+    "guards": [{"id": "g", "expr": {"gte": ["rsi", 20]}}, {"ne": ["volume", 0]}],
+}
+
+def test_vector_and_scalar_agree(make_bars):
+    b = make_bars(800)
+    series = IndicatorGraph(INDICATORS).evaluate(b)
+    plan = RulePlan(RULES, known_refs(INDICATORS))
+    sig = plan.signals(series)
+    n = len(b["ts"])
+    fired = {rid: np.zeros(n, dtype=bool) for rid in ("L", "S", "XL")}
+    prev = None
+    for i in range(n):
+        cur = {r: float(a[i]) for r, a in series.items()}
+        res = plan.on_bar(cur, prev)
+        for rid in res["entries"] + res["exits"]:
+            fired[rid][i] = True
+        prev = cur
+    for rid in ("L", "S"):
+        np.testing.assert_array_equal(sig["entries"][rid], fired[rid], err_msg=rid)
+    np.testing.assert_array_equal(sig["exits"]["XL"], fired["XL"])
+    assert all(sig["entries"][r].any() for r in ("L", "S")) and sig["exits"]["XL"].any()
+    # guards режут только входы
+    closed = RulePlan({**RULES, "guards": [{"gt": ["rsi", 1000]}]}).signals(series)
+    assert not any(m.any() for m in closed["entries"].values())
+    np.testing.assert_array_equal(closed["exits"]["XL"], sig["exits"]["XL"])
+
+def test_cross_semantics():
+    s = {"a": np.array([1.0, 2.0, 3.0, 2.0, 2.0, 1.0]), "b": np.full(6, 2.0)}
+    plan = RulePlan({"entries": [{"id": "U", "side": "LONG", "expr": {"cross_up": ["a", "b"]}},
+                                 {"id": "D", "side": "SHORT", "expr": {"cross_down": ["a", "b"]}}]})
+    sig = plan.signals(s)
+    # касание снизу (1 -> 2) — ещё не пересечение, выход сверху (2 -> 3) — да
+    assert sig["entries"]["U"].tolist() == [False, False, True, False, False, False]
+    assert sig["entries"]["D"].tolist() == [False, False, False, False, False, True]
+    # первый бар (нет prev) не срабатывает и в live
+    assert plan.on_bar({"a": 3.0, "b": 2.0}) == {"entries": [], "exits": []}
+
+def test_constant_folding():
+    plan = RulePlan({
+        "entries": [
+            {"id": "T", "side": "LONG", "expr": {"or": [{"gt": [2, 1]}, "close"]}},
+            {"id": "F", "side": "LONG", "expr": {"and": [False, {"gt": ["close", 0]}]}},
+            {"id": "Z", "side": "LONG", "expr": {"gt": [{"div": [1, 0]}, 0]}},  # деление на 0 -> NaN -> False
+        ],
+    })
+    by_id = {rid: ce for rid, _, ce in plan.entries}
+    assert by_id["T"].node.is_const and by_id["T"].node.value is True
+    assert by_id["F"].node.is_const and by_id["F"].node.value is False
+    assert by_id["Z"].node.is_const and by_id["Z"].node.value is False
+    assert plan.signals({"close": np.ones(3)}, 3)["entries"]["T"].tolist() == [True] * 3
+    assert plan.on_bar({"close": 1.0}) == {"entries": ["T"], "exits": []}
+
+@pytest.mark.parametrize("expr, msg", [
+    ("nope", "unknown reference"),
+    ({"gt": ["close"]}, "takes 2"),
+    ({"add": ["close"]}, "at least 2"),
+    ({"prev": {"prev": "close"}}, "nested"),
+    ({"cross_up": [{"prev": "close"}, "open"]}, "nested"),
+    ({"pow": ["close", 2]}, "unknown operator"),
+    ({"gt": ["close", 1], "lt": ["close", 2]}, "single-key"),
+])
+def test_bad_expressions(expr, msg):
+    with pytest.raises(ValueError, match=msg):
+        RulePlan({"entries": [{"id": "E", "side": "LONG", "expr": expr}]}, known_refs(INDICATORS))
+
+def test_compile_rules_cached_by_hash():
+    bundle = {"payload": {"manifest": {"hash": "h-rules-test"}, "indicators": INDICATORS, "rules": RULES}}
+    plan = compile_rules(bundle)
+    assert compile_rules(bundle) is plan
+    assert plan.side("S") == "SHORT" and plan.side("XL") == "LONG" and plan.side("?") is None
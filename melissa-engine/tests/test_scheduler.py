@@ -0,0 +1,78 @@
+import copy
+
+import numpy as np
+import pytest
+
+from src.data.bars import TF_MS, aggregate
+from src.runtime.scheduler import Scheduler
+
+from tests.conftest import PAYLOAD
+
+def _bundle(sid, nodes, fast="ef", slow="eh"):
+    p = copy.deepcopy(PAYLOAD)
+    p["manifest"].update(strategy_id=sid, assets=[{"symbol": "BTCUSDT", "tf": ["15m"]}])
+    p["indicators"]["nodes"] = nodes
+    p["rules"]["entries"] = [{"id": "L", "side": "LONG", "expr": {"cross_up": [fast, slow]}}]
+    p["rules"]["exits"] = [{"id": "XL", "side": "LONG", "expr": {"cross_down": [fast, slow]}}]
+    return {"payload": p}
+
+EF = {"id": "ef", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 12}}
+EH = {"id": "eh", "type": "EMA", "inputs": {"src": "close"}, "params": {"period": 10}, "tf": "1h"}
+AH = {"id": "ah", "type": "ATR", "params": {"period": 14}, "tf": "1h"}
+
+def _rows(cols, i):
+    return {f: float(a[i]) if f != "ts" else int(a[i]) for f, a in cols.items()}
+
+def _slice(cols, a, b):
+    return {f: x[a:b] for f, x in cols.items()}
+
+def test_nodes_shared_by_type_inputs_params_tf():
+    sch = Scheduler()
+    sch.add(_bundle("a", [EF, EH]))
+    sch.add(_bundle("b", [dict(EH, id="h1"), dict(EF, id="f1")], fast="f1", slow="h1"))
+    assert sch.shared_nodes("BTCUSDT", "15m") == 2
+    # тот же EMA(close, 10), но на tf группы — другой узел
+    sch.add(_bundle("c", [EF, dict(EH, tf="15m")]))
+    assert sch.shared_nodes("BTCUSDT", "15m") == 3
+    assert sch.streams() == [("BTCUSDT", "15m"), ("BTCUSDT", "1h")]
+
+def test_node_tf_below_group_tf_is_rejected():
+    sch = Scheduler()
+    with pytest.raises(ValueError, match="below the strategy tf"):
+        sch.add(_bundle("a", [EF, dict(EH, tf="5m")]))
+    assert sch.streams() == []
+
+def test_live_higher_tf_matches_batch(make_bars):
+    m1 = make_bars(60 * 24 * 8, seed=3)
+    base, hour = aggregate(m1, TF_MS["15m"]), aggregate(m1, TF_MS["1h"])
+    sch = Scheduler()
+    a = sch.add(_bundle("a", [EF, EH, AH]))
+    batch = sch.evaluate("BTCUSDT", "15m", base, {"1h": hour})[a]["series"]
+
+    w = 300  # прогрев: 1h-бары, закрывшиеся не позже последнего базового
+    close = int(base["ts"][w - 1]) + TF_MS["15m"]
+    hw = int(np.searchsorted(hour["ts"] + TF_MS["1h"], close, "right"))
+    # бары, пришедшие до прогрева, копятся и проигрываются после него
+    early = [sch.on_bar("BTCUSDT", "15m", _rows(base, i)) for i in range(w - 5, w + 3)]
+    assert early == [{}] * 8
+    replay = sch.warm("BTCUSDT", "15m", _slice(base, 0, w), {"1h": _slice(hour, 0, hw)})
+    assert [ts for ts, _ in replay] == [int(t) for t in base["ts"][w:w + 3]]
+
+    got = {i: out[a]["values"] for i, (_, out) in zip(range(w, w + 3), replay)}
+    i, h = w + 3, hw
+    while i < len(base["ts"]):
+        # опрос: старшие бары приходят раньше базовых, иногда с опережением
+        upto = min(len(base["ts"]), i + 7)
+        hend = int(np.searchsorted(hour["ts"], base["ts"][upto - 1] + TF_MS["15m"], "left")) + 1
+        for k in range(h, min(hend, len(hour["ts"]))):
+            sch.on_bar("BTCUSDT", "1h", _rows(hour, k))
+        h = max(h, min(hend, len(hour["ts"])))
+        for j in range(i, upto):
+            got[j] = sch.on_bar("BTCUSDT", "15m", _rows(base, j))[a]["values"]
+        i = upto
+    # повтор уже учтённого бара ничего не сдвигает
+    assert sch.on_bar("BTCUSDT", "15m", _rows(base, len(base["ts"]) - 1)) == {}
+
+    for ref in ("ef", "eh", "ah"):
+        live = np.array([got[j][ref] for j in range(w, len(base["ts"]))])
+        np.testing.assert_allclose(live, batch[ref][w:], rtol=1e-9, atol=1e-9)
@@ -0,0 +1,72 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from src.core import indicators
+from src.runtime import sweep
+from src.runtime.backtest import Backtest
+from src.runtime.sweep import _NodeCache, apply_params, grid, random_space, run_sweep
+
+def test_grid_and_random_space():
+    assert grid({"a.x": [1, 2], "b.y": [3]}) == [{"a.x": 1, "b.y": 3}, {"a.x": 2, "b.y": 3}]
+    vs = random_space({"a.x": [5, 9], "b.y": [0.5, 1.0]}, 50, seed=1)
+    assert all(isinstance(v["a.x"], int) and 5 <= v["a.x"] <= 9 and 0.5 <= v["b.y"] <= 1.0 for v in vs)
+
+def test_apply_params_rejects_unknown_keys(payload):
+    p = apply_params(payload, {"ef.period": 7})
+    assert p["indicators"]["nodes"][0]["params"]["period"] == 7
+    assert payload["indicators"]["nodes"][0]["params"]["period"] == 12  # исходник не тронут
+    with pytest.raises(ValueError, match="takes period"):
+        apply_params(payload, {"ef.lenght": 7})
+    with pytest.raises(ValueError, match="unknown sweep key"):
+        apply_params(payload, {"nope.period": 7})
+
+def test_run_sweep_rejects_typo_before_starting_workers(payload, make_bars):
+    with pytest.raises(ValueError, match="ef.lenght"):
+        run_sweep(payload, make_bars(100), [{"ef.period": 5}, {"ef.lenght": 7}], workers=1)
+
+def test_sweep_matches_single_backtests(payload, make_bars):
+    cols = make_bars(3000, 2)
+    payload["orders"]["tp"] = [{"type": "rr", "value": 1.5}]
+    variants = grid({"ef.period": [5, 8, 12], "es.period": [20, 40]})
+    results = run_sweep(payload, cols, variants, workers=2, fee_bps=3)
+    assert [v for v, _ in results] == variants
+    for v, st in results:
+        want = Backtest(apply_params(payload, v), fee_bps=3).run(cols)["stats"]
+        assert st == pytest.approx(want)
+
+def test_node_cache_reuses_unchanged_nodes(payload, make_bars, monkeypatch):
+    cols = make_bars(1000, 3)
+    memo = _NodeCache(64 << 20)
+    calls = []
+    real = indicators.compute_node
+    monkeypatch.setattr(indicators, "compute_node", lambda kind, args, params: calls.append(params) or real(kind, args, params))
+    for period in (5, 6, 7):
+        Backtest(apply_params(payload, {"ef.period": period})).run(cols, memo=memo)
+    # es (period 26) посчитан один раз, ef — на каждый вариант
+    assert sorted(p["period"] for p in calls) == [5, 6, 7, 26]
+
+def test_node_cache_is_bounded_by_bytes():
+    memo = _NodeCache(3 * 800)
+    for k in range(10):
+        memo[k] = {"value": np.zeros(100)}
+    assert memo.size <= 3 * 800 and list(memo) == [7, 8, 9]
+    memo[7]  # обращение освежает запись
+    memo[10] = {"value": np.zeros(100)}
+    assert list(memo) == [9, 7, 10]
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="подмена _close видна только форкнутым воркерам")
+def test_workers_close_shared_memory(payload, make_bars, tmp_path, monkeypatch):
+    closed = tmp_path / "closed"
+    real = sweep._close
+
+    def spy():
+        n = len(sweep._W.get("shms", []))
+        real()
+        with open(closed, "a") as f:
+            f.write(f"{n}\n")
+
+    monkeypatch.setattr(sweep, "_close", spy)
+    run_sweep(payload, make_bars(200), [{"ef.period": 5}, {"ef.period": 6}], workers=2)
+    assert closed.read_text().split() == ["6", "6"]